@@ -32,11 +32,17 @@
 
 # https://stackoverflow.com/questions/1112618/import-python-package-from-local-directory-into-interpreter
 # https://stackoverflow.com/questions/14500183/in-python-can-i-call-the-main-of-an-imported-module
+import os
 import sys
-from pathlib import Path
 
-module_dir = Path(__file__).resolve().parent
-sys.path.append(str(module_dir))
+module_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(module_dir)
+if "_ARGCOMPLETE" in os.environ:
+    # Answer tab-completion requests from the cached index without loading all the project modules (this exits
+    # unless the request can only be handled by argcomplete).
+    from pycheribuild.completion import complete_from_index  # noqa: E402, RUF100
+
+    complete_from_index()
 # noinspection PyPep8
 from pycheribuild.__main__ import main  # "__main__" case  # noqa: E402, PLC2701, RUF100
 
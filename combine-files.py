@@ -38,7 +38,8 @@ imports: "list[str]" = []
 from_imports: "list[str]" = []
 lines: "list[str]" = []
 handled_files: "list[Path]" = []
-ignored_files = [script_dir / "jenkins.py", script_dir / "config/jenkinsconfig.py"]
+# The daemon forks the already-loaded package and is only used by cheribuild-daemon.py/cheribuild-client.py.
+ignored_files = [script_dir / "jenkins.py", script_dir / "config/jenkinsconfig.py", script_dir / "daemon.py"]
 empty_lines = 0
 
 
@@ -124,6 +125,14 @@ def check_all_files_used(directory: Path):
 # append all the individual files in the right order
 add_filtered_file(script_dir / "colour.py")
 add_filtered_file(script_dir / "utils.py")
+add_filtered_file(script_dir / "profiling.py")
+add_filtered_file(script_dir / "probe_cache.py")
+add_filtered_file(script_dir / "resource_usage.py")
+add_filtered_file(script_dir / "compressed_log.py")
+add_filtered_file(script_dir / "completion.py")
+add_filtered_file(script_dir / "timings.py")
+add_filtered_file(script_dir / "jobserver.py")
+add_filtered_file(script_dir / "dependency_graph.py")
 add_filtered_file(script_dir / "mtree.py")
 add_filtered_file(script_dir / "config/config_loader_base.py")
 add_filtered_file(script_dir / "config/loader.py")
@@ -134,6 +143,7 @@ add_filtered_file(script_dir / "processutils.py")
 add_filtered_file(script_dir / "config/target_info.py")
 add_filtered_file(script_dir / "config/defaultconfig.py")
 add_filtered_file(script_dir / "targets.py")
+add_filtered_file(script_dir / "target_registry.py")
 add_filtered_file(script_dir / "jenkins_utils.py")
 add_filtered_file(script_dir / "ssh_utils.py")
 add_filtered_file(script_dir / "projects/simple_project.py")
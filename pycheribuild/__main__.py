@@ -28,6 +28,7 @@
 # SUCH DAMAGE.
 #
 import fcntl
+import importlib
 import json
 import os
 import shutil
@@ -38,7 +39,10 @@ from collections import OrderedDict
 
 # noinspection PyUnresolvedReferences
 from pathlib import Path
+from typing import Optional
 
+from .completion import CompletionIndex
+from .compressed_log import CompressedLogReader
 from .config.defaultconfig import CheribuildAction, DefaultCheribuildConfigLoader, DefaultCheriConfig
 
 # First thing we need to do is set up the config loader (before importing anything else!)
@@ -52,16 +56,14 @@ from .processutils import (
     run_and_kill_children_on_exit,
     run_command,
 )
-
-# make sure all projects are loaded so that target_manager gets populated
-# noinspection PyUnresolvedReferences
-from .projects import *  # noqa: F401, F403, RUF100
-
-# noinspection PyUnresolvedReferences
-from .projects.cross import *  # noqa: F401, F403, RUF100
+from .probe_cache import file_hash_cache, probe_cache
+from .profiling import profile_run, profiler
 from .projects.repository import GitRepository
 from .projects.simple_project import SimpleProject
+from .resource_usage import resource_usage
+from .target_registry import TargetRegistry, import_all_project_modules
 from .targets import Target, target_manager
+from .timings import BuildTimingDatabase, format_timing_report, summarize_timings
 from .utils import (
     AnsiColour,
     coloured,
@@ -158,27 +160,164 @@ def get_config_option_value(handle: ConfigOptionHandle, config: DefaultCheriConf
     return option.__get__(config, type(config))
 
 
-def real_main() -> None:
-    # avoid weird errors with macos terminal:
-    ensure_fd_is_blocking(sys.stdin.fileno())
-    ensure_fd_is_blocking(sys.stdout.fileno())
-    ensure_fd_is_blocking(sys.stderr.fileno())
+def print_timing_report(config: DefaultCheriConfig) -> None:
+    summaries = summarize_timings(BuildTimingDatabase.for_config(config).load())
+    if config.targets:
+        targets = target_manager.get_all_chosen_targets(config)
+    else:
+        # Report all targets that have been recorded (and still exist)
+        all_names = set(target_manager.target_names(None))
+        targets = [target_manager.get_target_raw(name) for name in summaries if name in all_names]
+        for target in targets:
+            target.cache_dependencies(config)
+        targets = target_manager.sort_in_dependency_order(targets, config)
+    dependencies = {t.name: [dep.name for dep in t.project_class.cached_full_dependencies()] for t in targets}
+    print(format_timing_report(summaries, [t.name for t in targets], dependencies))
 
+
+def show_build_log(config: DefaultCheriConfig, target_name: str, *, errors_only: bool) -> None:
+    if target_name not in target_manager.target_names(config):
+        fatal_error("Unknown target", target_name, "(see --list-targets)", pretend=False)
+    Target.instantiating_targets_should_warn = False
+    target = target_manager.get_target(target_name, config=config, caller="--show-log")
+    project = target._get_or_create_project_no_setup(None, config, caller=None)
+    build_dir: "Optional[Path]" = getattr(project, "build_dir", None)
+    logs = []
+    if build_dir is not None and build_dir.is_dir():
+        logs = [p for p in build_dir.glob("*.xz") if CompressedLogReader.index_path_for(p).is_file()]
+    if not logs:
+        fatal_error(
+            "Could not find any compressed build logs for",
+            target_name,
+            "in",
+            build_dir,
+            fixit_hint="Build logs are only compressed when building with --logfile --compress-logs",
+            pretend=False,
+        )
+        return
+    logfile = max(logs, key=lambda p: p.stat().st_mtime)
+    reader = CompressedLogReader(logfile)
+    print("Showing", logfile, file=sys.stderr)
+    if not errors_only:
+        for chunk in reader.iter_chunks():
+            sys.stdout.buffer.write(chunk)
+        return
+    last_target = None
+    found = False
+    for target_entry, entry in reader.failures():
+        found = True
+        if target_entry is not None and target_entry != last_target:
+            print(reader.read_line(target_entry).decode("utf-8", errors="replace"))
+            last_target = target_entry
+        print(f"{entry.line}:", reader.read_line(entry).decode("utf-8", errors="replace"))
+    if not found:
+        print("No errors found in", logfile)
+
+
+# The single-file script generated by combine-files.py already contains all project modules and cannot import them
+# lazily (or cache which module defines which target).
+_IS_COMBINED_SCRIPT = True
+_IS_COMBINED_SCRIPT = False  # no-combine
+
+
+def _load_registry_for_quick_query(
+    config_loader: DefaultCheribuildConfigLoader, args: "list[str]"
+) -> "Optional[TargetRegistry]":
+    if config_loader.is_completing_arguments or any(
+        arg in ("-h", "--help", "--help-all", "--help-hidden") for arg in args
+    ):
+        return None
+    if "--list-targets" not in args and not any(arg.startswith("--get-config-option") for arg in args):
+        return None
+    registry = TargetRegistry.load()
+    if registry is None:
+        return None
+    modules = registry.modules_for_command_line(args)
+    if modules is None:
+        return None  # Unknown option -> load everything to get the usual error message.
+    for module in sorted(modules):
+        importlib.import_module(module)
+    return registry
+
+
+def register_targets_and_options(
+    *, allow_lazy_loading: bool = True
+) -> "tuple[DefaultCheribuildConfigLoader, DefaultCheriConfig, Optional[TargetRegistry]]":
+    """
+    Load the project modules and register all command line options. This does not depend on the command line
+    arguments (other than for deciding which modules can be loaded lazily), so the result can be reused by the
+    cheribuild daemon to handle multiple invocations.
+    """
     config_loader = DefaultCheribuildConfigLoader()
+    # Quick queries only import the project modules that they need (the others are loaded on demand).
+    with profiler.phase("load target registry"):
+        registry = None
+        if allow_lazy_loading and not _IS_COMBINED_SCRIPT:
+            registry = _load_registry_for_quick_query(config_loader, sys.argv[1:])
+    if registry is None and not _IS_COMBINED_SCRIPT:
+        # make sure all projects are loaded so that target_manager gets populated
+        with profiler.phase("import project modules"):
+            import_all_project_modules()
     # Don't suggest deprecated names when tab-completing
     if config_loader.is_completing_arguments:
         all_target_names = list(sorted(target_manager.non_deprecated_target_names(None)))
+    elif registry is not None:
+        all_target_names = list(sorted(registry.target_modules))
     else:
         all_target_names = list(sorted(target_manager.target_names(None)))
     run_everything_target = "__run_everything__"
     # Register all command line options
-    cheri_config = DefaultCheriConfig(config_loader, [*all_target_names, run_everything_target])
-    # Make sure nothing other than the config loader uses this as it will include disabled target names
-    del all_target_names
-    SimpleProject._config_loader = config_loader
-    target_manager.register_command_line_options()
+    with profiler.phase("register command line options"):
+        cheri_config = DefaultCheriConfig(config_loader, [*all_target_names, run_everything_target])
+        # Make sure nothing other than the config loader uses this as it will include disabled target names
+        del all_target_names
+        SimpleProject._config_loader = config_loader
+        target_manager.register_command_line_options()
+    if registry is not None:
+        config_loader.lazily_loaded_option_names = registry.option_modules.keys()
+        target_manager.lazy_target_loader = registry.load_target_module
+    elif not config_loader.is_completing_arguments and not _IS_COMBINED_SCRIPT:
+        with profiler.phase("update target registry and completion index"):
+            TargetRegistry.update_cache(target_manager, config_loader)
+            # Also write the index that allows tab-completion without loading all modules (see cheribuild.py).
+            CompletionIndex.update_cache(
+                getattr(config_loader, "_parser"),
+                sorted(target_manager.non_deprecated_target_names(None)),
+                config_loader.default_completion_excludes(),
+            )
+    return config_loader, cheri_config, registry
+
+
+def run_cheribuild(
+    config_loader: DefaultCheribuildConfigLoader,
+    cheri_config: DefaultCheriConfig,
+    registry: "Optional[TargetRegistry]",
+) -> None:
     # load them from JSON/cmd line
-    cheri_config.load()
+    with profiler.phase("load config"):
+        cheri_config.load()
+    try:
+        if not cheri_config.profile_cheribuild:
+            _run_actions(config_loader, cheri_config, registry)
+            return
+        with profile_run(
+            cheri_config.build_root / "cheribuild-profile", use_cprofile=cheri_config.profile_cheribuild_with_cprofile
+        ):
+            _run_actions(config_loader, cheri_config, registry)
+    finally:
+        # Also write the summary if a command failed, since that is often the one that ran out of memory.
+        if resource_usage.enabled and not cheri_config.pretend and resource_usage.commands:
+            resource_usage.write_summary(cheri_config.build_root / resource_usage.filename)
+            if cheri_config.verbose:
+                print(resource_usage.format_summary())
+
+
+def _run_actions(
+    config_loader: DefaultCheribuildConfigLoader,
+    cheri_config: DefaultCheriConfig,
+    registry: "Optional[TargetRegistry]",
+) -> None:
+    run_everything_target = "__run_everything__"
     # Running as root inside Docker/containers is safe since it is isolated from the host.
     if (
         not cheri_config.allow_running_as_root
@@ -187,12 +326,20 @@ def real_main() -> None:
     ):
         check_not_root()
     init_global_config(cheri_config)
+    resource_usage.enabled = cheri_config.record_resource_usage
+    if cheri_config.cache_tool_probes:
+        # Don't write to the build root in --pretend mode, but still use the results from previous runs.
+        probe_cache.configure(cheri_config.build_root / probe_cache.filename, read_only=cheri_config.pretend)
+        file_hash_cache.configure(cheri_config.build_root / file_hash_cache.filename, read_only=cheri_config.pretend)
     if config_loader.get_config_prefix() in ("docker-", "docker-portable-"):
         cheri_config.docker = True
 
     if CheribuildAction.LIST_TARGETS in cheri_config.action:
         # Skip target aliases to avoid printing too much output
-        names = list(target_manager.non_alias_target_names(cheri_config))
+        if registry is not None:
+            names = registry.listed_target_names(include_hybrid=cheri_config.enable_hybrid_targets)
+        else:
+            names = list(target_manager.non_alias_target_names(cheri_config))
         print("There are", len(names), "available targets:\n ", "\n  ".join(names))
         sys.exit()
     elif CheribuildAction.DUMP_CONFIGURATION in cheri_config.action:
@@ -208,6 +355,12 @@ def real_main() -> None:
                 continue
         json.dump(json_dict, sys.stdout, sort_keys=True, cls=MyJsonEncoder, indent=4)
         sys.exit()
+    elif CheribuildAction.TIMING_REPORT in cheri_config.action:
+        print_timing_report(cheri_config)
+        sys.exit()
+    elif cheri_config.show_log:
+        show_build_log(cheri_config, cheri_config.show_log, errors_only=cheri_config.show_log_errors)
+        sys.exit()
     elif cheri_config.get_config_option:
         if cheri_config.get_config_option not in config_loader.option_handles:
             fatal_error("Unknown config key", cheri_config.get_config_option, pretend=False)
@@ -333,7 +486,8 @@ def real_main() -> None:
                 sys.exit(coloured(AnsiColour.red, "Failed to start docker!"))
             raise
         sys.exit()
-    chosen_targets = target_manager.get_all_chosen_targets(cheri_config)
+    with profiler.phase("resolve targets"):
+        chosen_targets = target_manager.get_all_chosen_targets(cheri_config)
     if cheri_config.print_targets_only:
         print(
             "Will execute the following",
@@ -364,12 +518,21 @@ def real_main() -> None:
                 print("    Direct dependencies:", direct_deps[target.name])
         return
     # Check system dependencies before building any targets to get an error message earlier.
-    for target in chosen_targets:
-        target.check_system_deps(cheri_config)
-    if CheribuildAction.BUILD in cheri_config.action:
+    with profiler.phase("check system dependencies"):
         for target in chosen_targets:
-            target.execute(cheri_config)
-    if CheribuildAction.TEST in cheri_config.action:
+            target.check_system_deps(cheri_config)
+    pipeline_tests = (
+        cheri_config.pipeline_tests
+        and CheribuildAction.BUILD in cheri_config.action
+        and CheribuildAction.TEST in cheri_config.action
+    )
+    if CheribuildAction.BUILD in cheri_config.action:
+        if cheri_config.parallel_targets > 1 or pipeline_tests:
+            target_manager.execute_in_parallel(chosen_targets, cheri_config, pipeline_tests=pipeline_tests)
+        else:
+            for target in chosen_targets:
+                target.execute(cheri_config)
+    if CheribuildAction.TEST in cheri_config.action and not pipeline_tests:
         for target in chosen_targets:
             target.run_tests(cheri_config)
     if CheribuildAction.BENCHMARK in cheri_config.action:
@@ -377,9 +540,25 @@ def real_main() -> None:
             target.run_benchmarks(cheri_config)
 
 
-def main() -> None:
+def real_main(
+    prepared: "Optional[tuple[DefaultCheribuildConfigLoader, DefaultCheriConfig, Optional[TargetRegistry]]]" = None,
+) -> None:
+    # avoid weird errors with macos terminal:
+    ensure_fd_is_blocking(sys.stdin.fileno())
+    ensure_fd_is_blocking(sys.stdout.fileno())
+    ensure_fd_is_blocking(sys.stderr.fileno())
+    # Start profiling before the options are registered and parsed, since that is a significant part of the runtime.
+    if "--profile-cheribuild" in sys.argv[1:]:
+        profiler.start(use_cprofile="--profile-cheribuild-with-cprofile" in sys.argv[1:])
+    run_cheribuild(*(prepared or register_targets_and_options()))
+
+
+def main(
+    prepared: "Optional[tuple[DefaultCheribuildConfigLoader, DefaultCheriConfig, Optional[TargetRegistry]]]" = None,
+) -> None:
+    """:param prepared: the result of register_targets_and_options() if it has already been called (by the daemon)"""
     try:
-        run_and_kill_children_on_exit(real_main)
+        run_and_kill_children_on_exit(lambda: real_main(prepared))
     except Exception as e:
         # If we are currently debugging, raise the exception to allow e.g. PyCharm's
         # "break on exception that terminates execution" feature works.
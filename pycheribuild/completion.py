@@ -0,0 +1,256 @@
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+# This module is imported by cheribuild.py when tab-completing, so it must not import anything other than the (fast to
+# import) modules below. In particular, importing argcomplete, pathlib or any of the other pycheribuild modules would
+# add tens of milliseconds to every completion request.
+import hashlib
+import os
+import sys
+import typing
+from typing import Optional
+
+if typing.TYPE_CHECKING:
+    import argparse
+
+__all__ = ["CompletionIndex", "complete_from_index", "sources_cache_key", "user_cache_dir"]
+
+
+def sources_cache_key() -> str:
+    """A hash of all pycheribuild sources (as well as the python version and host OS)."""
+    h = hashlib.sha256(repr((sys.version_info[:2], sys.platform)).encode())
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    sources: "list[tuple[str, os.stat_result]]" = []
+    for dirpath, dirnames, filenames in os.walk(package_dir):
+        dirnames[:] = [d for d in dirnames if d != "__pycache__"]
+        for filename in filenames:
+            if filename.endswith(".py"):
+                path = os.path.join(dirpath, filename)
+                sources.append((os.path.relpath(path, package_dir), os.stat(path)))
+    for relpath, st in sorted(sources):
+        h.update(f"{relpath}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()[:24]
+
+
+def user_cache_dir() -> str:
+    return os.path.join(os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "cheribuild")
+
+
+class CompletionIndex:
+    """
+    All target names and command line options (including whether they take a value and the valid choices) in a plain
+    text file that can be searched without parsing it first. This allows answering tab-completion requests without
+    importing the project modules and registering the ~70000 command line options with argparse.
+
+    The file starts with a header line followed by one line per target name and one line per option string. Option
+    lines start with "-", options that take a value are followed by a tab and the (possibly empty) tab-separated list of
+    choices.
+    """
+
+    format_version = 1
+    header = f"# cheribuild completion index v{format_version}"
+
+    def __init__(self, data: str) -> None:
+        assert data.startswith(self.header + "\n"), "Invalid completion index"
+        self._data = data
+
+    @classmethod
+    def cache_path(cls, key: "Optional[str]" = None) -> str:
+        return os.path.join(user_cache_dir(), f"completion-index-{key or sources_cache_key()}.txt")
+
+    @classmethod
+    def load(cls, path: "Optional[str]" = None) -> "Optional[CompletionIndex]":
+        """Load the cached index, returns None if it does not exist or is out of date."""
+        try:
+            with open(path or cls.cache_path(), encoding="utf-8") as f:
+                data = f.read()
+        except (OSError, ValueError):
+            return None
+        if not data.startswith(cls.header + "\n"):
+            return None
+        return cls(data)
+
+    @classmethod
+    def generate(
+        cls, parser: "argparse.ArgumentParser", target_names: "typing.Iterable[str]", excludes: "typing.Iterable[str]"
+    ) -> "CompletionIndex":
+        excluded = set(excludes)
+        lines = [cls.header]
+        lines.extend(name for name in target_names if name not in excluded)
+        for action in parser._actions:
+            for option_string in action.option_strings:
+                if option_string in excluded:
+                    continue
+                if action.nargs == 0:
+                    lines.append(option_string)
+                else:
+                    lines.append(option_string + "\t" + "\t".join(str(c) for c in action.choices or ()))
+        return cls("\n".join(lines) + "\n")
+
+    def save(self, path: "Optional[str]" = None) -> None:
+        path = path or self.cache_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first to avoid concurrent completion requests reading a partially written index.
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self._data)
+        os.replace(tmp_path, path)
+        for old in os.listdir(os.path.dirname(path)):
+            if old.startswith("completion-index-") and old != os.path.basename(path):
+                os.unlink(os.path.join(os.path.dirname(path), old))
+
+    @classmethod
+    def update_cache(
+        cls, parser: "argparse.ArgumentParser", target_names: "typing.Iterable[str]", excludes: "typing.Iterable[str]"
+    ) -> None:
+        """Regenerate the cached index if it is missing or out of date (requires all options to be registered)."""
+        path = cls.cache_path()
+        if os.path.exists(path):
+            return
+        try:
+            cls.generate(parser, target_names, excludes).save(path)
+        except OSError:
+            pass  # The cache is optional (e.g. the home directory could be read-only)
+
+    def _lines_starting_with(self, prefix: str) -> "typing.Iterator[str]":
+        needle = "\n" + prefix
+        data = self._data
+        start = data.find(needle)
+        while start != -1:
+            end = data.find("\n", start + 1)
+            if end == -1:
+                return
+            yield data[start + 1 : end]
+            start = data.find(needle, end)
+
+    def target_names(self, prefix: str) -> "list[str]":
+        result = []
+        for line in self._lines_starting_with(prefix):
+            if line.startswith("-"):
+                break  # The option lines follow the target names
+            result.append(line)
+        return result
+
+    def option_strings(self, prefix: str) -> "list[str]":
+        assert prefix.startswith("-"), prefix
+        return [line.partition("\t")[0] for line in self._lines_starting_with(prefix)]
+
+    def option_choices(self, option: str) -> "Optional[list[str]]":
+        """Returns the choices for an option that takes a value (or None if it's a flag or an unknown option)."""
+        for line in self._lines_starting_with(option + "\t"):
+            return [c for c in line.split("\t")[1:] if c]
+        return None
+
+    def complete(self, words: "list[str]", prefix: str) -> "Optional[list[str]]":
+        """
+        Return the completions for prefix (the word under the cursor) given the preceding words. This mirrors what
+        argcomplete would return for the cheribuild argument parser, but returns None for the cases that are not
+        handled by the index (e.g. completing file names for options without choices).
+        """
+        if "--" in words:
+            return None
+        if prefix.startswith("-") and "=" in prefix:
+            # --option=PARTIAL_VALUE
+            option, _, value_prefix = prefix.partition("=")
+            choices = self.option_choices(option)
+            if not choices:
+                return None
+            return [option + "=" + c for c in choices if c.startswith(value_prefix)]
+        if words and words[-1].startswith("-"):
+            # If the previous word is an option that takes a value, only the values for that option are valid.
+            choices = self.option_choices(words[-1])
+            if choices is not None:
+                return [c for c in choices if c.startswith(prefix)] if choices else None
+        if prefix.startswith("-"):
+            return self.option_strings(prefix)
+        return self.target_names(prefix)
+
+
+def _split_line(comp_line: str) -> "Optional[tuple[list[str], str]]":
+    # argcomplete uses shlex to split the line, we only handle the simple cases without quotes or escapes.
+    if any(c in comp_line for c in "\"'\\$`"):
+        return None
+    words = comp_line.split()
+    if not words or comp_line[-1].isspace():
+        return words, ""
+    return words, words.pop()
+
+
+def _quote_completions(completions: "list[str]", prefix: str) -> "list[str]":
+    # Same as argcomplete's quote_completions() for an unquoted word when completing with bash.
+    wordbreaks = os.environ.get("_ARGCOMPLETE_COMP_WORDBREAKS", "")
+    last_wordbreak_pos = max((prefix.rfind(c) for c in wordbreaks if not c.isspace()), default=-1)
+    if last_wordbreak_pos != -1:
+        completions = [c[last_wordbreak_pos + 1 :] for c in completions]
+    special_chars = "\\();<>|&!`$*?[]{} \t\n\"'"
+    if any(c in special_chars for completion in completions for c in completion):
+        result = []
+        for completion in completions:
+            for c in special_chars:
+                completion = completion.replace(c, "\\" + c)
+            result.append(completion)
+        completions = result
+    if os.environ.get("_ARGCOMPLETE_SUPPRESS_SPACE") != "1":
+        if len(completions) == 1 and completions[0] and completions[0][-1] not in "=/:":
+            completions[0] += " "
+    return completions
+
+
+def complete_from_index() -> None:
+    """
+    Answer an argcomplete request using the cached CompletionIndex and exit. Returns without doing anything if the
+    request cannot be answered from the index, in which case the caller falls back to the (slow) argcomplete path.
+    """
+    env = os.environ
+    if (
+        "_ARGCOMPLETE_BENCHMARK" in env
+        or env.get("_ARGCOMPLETE_SHELL", "bash") != "bash"
+        or env.get("_ARGCOMPLETE_DFS")
+    ):
+        return
+    ifs = env.get("_ARGCOMPLETE_IFS", "\013")
+    try:
+        comp_line = env["COMP_LINE"][: int(env["COMP_POINT"])]
+        start = int(env["_ARGCOMPLETE"])
+    except (KeyError, ValueError):
+        return
+    split = _split_line(comp_line)
+    if split is None or len(ifs) != 1:
+        return
+    words, prefix = split
+    index = CompletionIndex.load()
+    if index is None:
+        return
+    # _ARGCOMPLETE is the number of words in the command (e.g. 2 for "python3 cheribuild.py")
+    completions = index.complete(words[start:], prefix)
+    if completions is None:
+        return
+    completions = _quote_completions(list(dict.fromkeys(completions)), prefix)
+    try:
+        filename = env.get("_ARGCOMPLETE_STDOUT_FILENAME")
+        with open(filename, "w") if filename else os.fdopen(8, "w") as output:
+            output.write(ifs.join(completions))
+    except OSError:
+        return
+    sys.exit(0)
@@ -0,0 +1,232 @@
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import bisect
+import json
+import lzma
+import re
+import typing
+from pathlib import Path
+from typing import Optional
+
+__all__ = ["CompressedLogReader", "CompressedLogWriter", "LogIndexEntry"]
+
+# Lines that are recorded in the index (this should match the common error/warning formats of compilers, make, ninja
+# and the CheriBSD build but does not need to be exact since --show-log can always show the full log).
+_INTERESTING_LINE_RE = re.compile(
+    rb"(?P<error>error:|Error code \d|\*\*\* \[|\*\*\* Error|^FAILED: |fatal error)|(?P<warning>warning:)"
+    rb"|(?P<target>^===> |^>>> |^make\[\d+\]: Entering directory)",
+    re.MULTILINE,
+)
+
+
+class LogIndexEntry(typing.NamedTuple):
+    kind: str  # "error", "warning" or "target" (the start of a new make target/subdirectory)
+    offset: int  # Offset of the start of the line in the uncompressed log
+    length: int  # Length of the line (excluding the newline)
+    line: int  # 1-based line number
+
+
+class CompressedLogWriter:
+    """
+    Writes a build log as a sequence of independently compressed xz streams (frames) of roughly frame_size bytes.
+    The concatenated streams are a valid .xz file (so xzcat/xzless work as usual), and the sidecar index file
+    (<log>.idx, one JSON object per line) records the start of each frame as well as the position of all error,
+    warning and make target lines. This allows CompressedLogReader to show the failures without decompressing
+    the whole log.
+    """
+
+    frame_size = 1024 * 1024
+
+    def __init__(self, path: Path, *, append: bool = False, preset: int = 1) -> None:
+        self.path = path
+        self.name = str(path)  # for the "See <logfile> for details" message
+        self.index_path = CompressedLogReader.index_path_for(path)
+        self._preset = preset
+        if append and path.exists() and self.index_path.exists():
+            reader = CompressedLogReader(path)
+            self._uncompressed_offset = reader.uncompressed_size
+            self._line = reader.line_count
+        else:
+            self._uncompressed_offset = 0
+            self._line = 1
+        mode = "ab" if append else "wb"
+        self._file = path.open(mode)
+        self._index = self.index_path.open("a" if append else "w", encoding="utf-8")
+        self._compressor: "Optional[lzma.LZMACompressor]" = None
+        self._frame_start = 0
+        self._partial_line = b""  # Incomplete line from the previous write() call
+
+    def _start_frame(self) -> None:
+        self._compressor = lzma.LZMACompressor(format=lzma.FORMAT_XZ, preset=self._preset)
+        self._frame_start = self._uncompressed_offset
+        self._write_index("frame", offset=self._uncompressed_offset, compressed_offset=self._file.tell())
+
+    def _finish_frame(self) -> None:
+        if self._compressor is not None:
+            self._file.write(self._compressor.flush())
+            self._compressor = None
+
+    def _write_index(self, kind: str, **kwargs: int) -> None:
+        self._index.write(json.dumps({"kind": kind, **kwargs}) + "\n")
+
+    def _index_lines(self, data: bytes, offset: int) -> None:
+        # Only complete lines are passed here, so ^ matches the start of a line.
+        last_line_start = 0
+        line = self._line
+        seen_lines: "set[int]" = set()
+        for match in _INTERESTING_LINE_RE.finditer(data):
+            line_start = data.rfind(b"\n", 0, match.start()) + 1
+            if line_start in seen_lines:
+                continue
+            seen_lines.add(line_start)
+            line_end = data.find(b"\n", match.end())
+            line += data.count(b"\n", last_line_start, line_start)
+            last_line_start = line_start
+            kind = typing.cast(str, match.lastgroup)
+            self._write_index(kind, offset=offset + line_start, length=line_end - line_start, line=line)
+
+    def write(self, data: bytes) -> int:
+        if self._compressor is None:
+            self._start_frame()
+        assert self._compressor is not None
+        self._file.write(self._compressor.compress(data))
+        # Scan the complete lines for errors/warnings (a line may be split across multiple calls).
+        end = data.rfind(b"\n") + 1
+        if end:
+            lines = self._partial_line + data[:end]
+            self._index_lines(lines, self._uncompressed_offset - len(self._partial_line))
+            self._line += lines.count(b"\n")
+            self._partial_line = data[end:]
+        else:
+            self._partial_line += data
+        self._uncompressed_offset += len(data)
+        if self._uncompressed_offset - self._frame_start >= self.frame_size:
+            self._finish_frame()
+        return len(data)
+
+    def flush(self) -> None:
+        self._file.flush()
+        self._index.flush()
+
+    def close(self) -> None:
+        if self._partial_line:
+            self._index_lines(self._partial_line + b"\n", self._uncompressed_offset - len(self._partial_line))
+            self._partial_line = b""
+        self._finish_frame()
+        self._write_index("end", offset=self._uncompressed_offset, line=self._line)
+        self._file.close()
+        self._index.close()
+
+    def __enter__(self) -> "CompressedLogWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class CompressedLogReader:
+    """Reads a log written by CompressedLogWriter using the index to only decompress the required frames."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.frames: "list[tuple[int, int]]" = []  # (uncompressed offset, compressed offset)
+        self.entries: "list[LogIndexEntry]" = []
+        self.uncompressed_size = 0
+        self.line_count = 1
+        # The most recently decompressed frame (index errors are usually close together, so this avoids
+        # decompressing the same frame again for every line that is read).
+        self._cached_frame: "Optional[tuple[int, bytes]]" = None
+        with self.index_path_for(path).open(encoding="utf-8") as f:
+            for line in f:
+                try:
+                    value = json.loads(line)
+                    kind = value["kind"]
+                    if kind == "frame":
+                        self.frames.append((int(value["offset"]), int(value["compressed_offset"])))
+                    elif kind == "end":
+                        self.uncompressed_size = int(value["offset"])
+                        self.line_count = int(value["line"])
+                    else:
+                        self.entries.append(
+                            LogIndexEntry(kind, int(value["offset"]), int(value["length"]), int(value["line"]))
+                        )
+                except (ValueError, KeyError, TypeError):
+                    continue  # Ignore truncated lines (e.g. from a build that was killed while writing)
+        if self.frames:
+            # If the build was killed, there is no "end" entry but the last frame could still be partially readable.
+            self.uncompressed_size = max(self.uncompressed_size, self.frames[-1][0])
+
+    @staticmethod
+    def index_path_for(path: Path) -> Path:
+        return path.with_name(path.name + ".idx")
+
+    def _decompress_frame(self, i: int) -> bytes:
+        start = self.frames[i][1]
+        end = self.frames[i + 1][1] if i + 1 < len(self.frames) else None
+        with self.path.open("rb") as f:
+            f.seek(start)
+            compressed = f.read(end - start if end is not None else -1)
+        decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+        try:
+            return decompressor.decompress(compressed)
+        except lzma.LZMAError:
+            return b""  # Truncated frame
+
+    def _cached_decompress_frame(self, i: int) -> bytes:
+        if self._cached_frame is None or self._cached_frame[0] != i:
+            self._cached_frame = (i, self._decompress_frame(i))
+        return self._cached_frame[1]
+
+    def read(self, offset: int, length: int) -> bytes:
+        """Return length bytes of the uncompressed log starting at offset."""
+        result = b""
+        # Start with the last frame that begins at or before offset.
+        first = max(0, bisect.bisect_right(self.frames, (offset, float("inf"))) - 1)
+        for i in range(first, len(self.frames)):
+            frame_offset = self.frames[i][0]
+            if frame_offset >= offset + length:
+                break
+            data = self._cached_decompress_frame(i)
+            result += data[max(0, offset - frame_offset) : offset + length - frame_offset]
+        return result
+
+    def read_line(self, entry: LogIndexEntry) -> bytes:
+        return self.read(entry.offset, entry.length)
+
+    def failures(
+        self, *, include_warnings: bool = False
+    ) -> "typing.Iterator[tuple[Optional[LogIndexEntry], LogIndexEntry]]":
+        """Yield all error (and optionally warning) entries together with the make target they occurred in."""
+        current_target: "Optional[LogIndexEntry]" = None
+        for entry in self.entries:
+            if entry.kind == "target":
+                current_target = entry
+            elif entry.kind == "error" or (include_warnings and entry.kind == "warning"):
+                yield current_target, entry
+
+    def iter_chunks(self) -> "typing.Iterator[bytes]":
+        """Decompress the whole log (one frame at a time)."""
+        for i in range(len(self.frames)):
+            yield self._decompress_frame(i)
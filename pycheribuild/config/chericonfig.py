@@ -28,7 +28,7 @@
 # SUCH DAMAGE.
 #
 import argparse
-import collections
+import contextlib
 import getpass
 import grp
 import inspect
@@ -37,6 +37,7 @@ import os
 import re
 import shutil
 import sys
+import threading
 import typing
 from abc import ABCMeta
 from enum import Enum
@@ -46,6 +47,7 @@ from typing import Optional
 
 from .computed_default_value import ComputedDefaultValue
 from .config_loader_base import ConfigLoaderBase
+from ..dependency_graph import DependencyGraph
 from ..processutils import get_compiler_info, latest_system_clang_tool, run_command
 from ..utils import (
     ConfigBase,
@@ -218,11 +220,19 @@ class CheriConfig(ConfigBase, metaclass=ABCMeta):
     force_configure: bool
     force_update: bool
     make_without_nice: bool
-    make_jobs: int
     loader: "ConfigLoaderBase[typing.Self]"
     # These are optional and do not exist for Jenkins
     start_with: Optional[str] = None
     start_after: Optional[str] = None
+    compress_logs: bool = False
+    parallel_targets: int = 1
+    use_jobserver: bool = False
+    pipeline_tests: bool = False
+    skip_unchanged_targets: bool = False
+    record_build_timings: bool = False
+    record_resource_usage: bool = False
+    cache_tool_probes: bool = False
+    strip_cache: bool = False
 
     def __init__(
         self,
@@ -233,7 +243,7 @@ class CheriConfig(ConfigBase, metaclass=ABCMeta):
         super().__init__(
             pretend=DoNotUseInIfStmt(), verbose=DoNotUseInIfStmt(), quiet=DoNotUseInIfStmt(), force=DoNotUseInIfStmt()
         )
-        self._cached_deps = collections.defaultdict(dict)
+        self._dependency_graph = DependencyGraph()
 
         loader._cheri_config = self
         self.loader = loader
@@ -768,6 +778,30 @@ class CheriConfig(ConfigBase, metaclass=ABCMeta):
             return old_path  # $PATH already starts with other_tools, don't add it again
         return new_prefix + old_path
 
+    # Allows parallel target builds to use a smaller number of jobs without affecting other threads (e.g. tests).
+    _thread_make_jobs = threading.local()
+
+    @property
+    def make_jobs(self) -> int:
+        override = getattr(self._thread_make_jobs, "jobs", None)
+        if override is not None:
+            return override
+        return self._make_jobs
+
+    @make_jobs.setter
+    def make_jobs(self, value: int) -> None:
+        self._make_jobs = value
+
+    @contextlib.contextmanager
+    def thread_make_jobs(self, jobs: int) -> "typing.Iterator[None]":
+        """Use jobs instead of --make-jobs for all builds started by the current thread."""
+        old = getattr(self._thread_make_jobs, "jobs", None)
+        self._thread_make_jobs.jobs = jobs
+        try:
+            yield
+        finally:
+            self._thread_make_jobs.jobs = old
+
     @property
     def make_j_flag(self):
         return "-j" + str(self.make_jobs)
@@ -51,6 +51,11 @@ class CheribuildAction(CheribuildActionEnum):
         ["build", "test"],
     )
     LIST_TARGETS = ("--list-targets", "List all available targets and exit")
+    TIMING_REPORT = (
+        "--timing-report",
+        "Show the recorded build times of the chosen targets (or all recorded targets if none are given) including "
+        "the critical path through the dependency graph and exit",
+    )
     DUMP_CONFIGURATION = (
         "--dump-configuration",
         "Print the current configuration as JSON. This can be saved to ~/.config/cheribuild.json to make it persistent",
@@ -67,20 +72,24 @@ class CheribuildAction(CheribuildActionEnum):
 
 
 class DefaultCheribuildConfigLoader(JsonAndCommandLineConfigLoader):
+    @staticmethod
+    def default_completion_excludes() -> "list[str]":
+        # if OSInfo.IS_FREEBSD: # FIXME: for some reason this won't work
+        result = ["-t", "--skip-dependencies"]
+        if sys.platform.startswith("freebsd"):
+            result += [
+                "--freebsd-builder-copy-only",
+                "--freebsd-builder-hostname",
+                "--freebsd-builder-output-path",
+            ]
+        return result
+
     def finalize_options(self, available_targets: "list[str]", **kwargs) -> None:
         target_option = self._parser.add_argument(
             "targets", metavar="TARGET", nargs=argparse.ZERO_OR_MORE, help="The targets to build"
         )
         if argcomplete and self.is_completing_arguments:
-            # if OSInfo.IS_FREEBSD: # FIXME: for some reason this won't work
-            self.completion_excludes = ["-t", "--skip-dependencies"]
-            if sys.platform.startswith("freebsd"):
-                self.completion_excludes += [
-                    "--freebsd-builder-copy-only",
-                    "--freebsd-builder-hostname",
-                    "--freebsd-builder-output-path",
-                ]
-
+            self.completion_excludes = self.default_completion_excludes()
             visible_targets = available_targets.copy()
             visible_targets.remove("__run_everything__")
             target_completer = argcomplete.completers.ChoicesCompleter(visible_targets)
@@ -109,6 +118,17 @@ class DefaultCheriConfig(CheriConfig):
             group=loader.action_group,
             help="Print the value of config option KEY and exit",
         )
+        self.show_log = loader.add_optional_option(
+            "show-log",
+            type=str,
+            metavar="TARGET",
+            group=loader.action_group,
+            help="Print the most recent compressed build log of TARGET (see --compress-logs) and exit",
+        )
+        self.show_log_errors = loader.add_commandline_only_bool_option(
+            "show-log-errors",
+            help="Only show the errors (and the make target they belong to) with --show-log",
+        )
         # boolean flags
         self.quiet = loader.add_bool_option("quiet", "q", help="Don't show stdout of the commands that are executed")
         self.verbose = loader.add_bool_option("verbose", "v", help="Print all commmands that are executed")
@@ -117,6 +137,11 @@ class DefaultCheriConfig(CheriConfig):
         self.write_logfile = loader.add_bool_option(
             "logfile", help="Write a logfile for the build steps", default=False
         )
+        self.compress_logs = loader.add_bool_option(
+            "compress-logs",
+            help="Compress the logfiles written by --logfile (as .xz files with an index of all errors and warnings "
+            "that is used by --show-log)",
+        )
         self.skip_update = loader.add_bool_option("skip-update", help="Skip the git pull step")
         self.skip_clone = False
         self.confirm_clone = loader.add_bool_option(
@@ -142,6 +167,47 @@ class DefaultCheriConfig(CheriConfig):
             group=configure_group,
             help="Always run the configure step, even for CMake projects with a valid cache.",
         )
+        self.skip_unchanged_targets = loader.add_bool_option(
+            "skip-unchanged-targets",
+            help="Record a fingerprint of the build inputs (source repository state, config options, compiler and the "
+            "fingerprints of the dependencies) after a successful build and skip targets whose fingerprint matches the "
+            "one from the last build.",
+        )
+        self.record_build_timings = loader.add_bool_option(
+            "record-build-timings",
+            help="Record the time spent in each phase of building/testing a target in "
+            "$BUILD_ROOT/cheribuild-timings.jsonl. The recorded timings can be shown using --timing-report.",
+        )
+        self.cache_tool_probes = loader.add_bool_option(
+            "cache-tool-probes",
+            help="Cache the results of probing compilers (version, resource and include directories, supported flags) "
+            "and the version output of other tools (cmake, ninja, git, etc.) in "
+            "$BUILD_ROOT/cheribuild-probe-cache.json and the checksums of downloaded files in "
+            "$BUILD_ROOT/cheribuild-file-hash-cache.json across cheribuild invocations. Cached results are discarded "
+            "automatically when the binary or file changes.",
+        )
+        self.strip_cache = loader.add_bool_option(
+            "strip-cache",
+            help="Keep the stripped copies of binaries that are added to disk images in $BUILD_ROOT/strip-cache, keyed "
+            "by the contents of the input file and the strip tool, so that unchanged binaries are not stripped again "
+            "when the disk image is rebuilt.",
+        )
+        self.record_resource_usage = loader.add_bool_option(
+            "record-resource-usage",
+            help="Record the CPU time, peak RSS, block I/O and context switches of every command that is run (grouped by "
+            "target and phase) and write a summary of the current run to $BUILD_ROOT/cheribuild-resource-usage.json.",
+        )
+        self.profile_cheribuild = loader.add_commandline_only_bool_option(
+            "profile-cheribuild",
+            help="Record the wall-clock and CPU time spent in cheribuild's own phases (config loading, dependency "
+            "resolution, project setup, compiler probing, etc.). A summary is printed on exit and a Chrome trace "
+            "(for chrome://tracing or https://ui.perfetto.dev) is written to the build root.",
+        )
+        self.profile_cheribuild_with_cprofile = loader.add_commandline_only_bool_option(
+            "profile-cheribuild-with-cprofile",
+            help="Also run cheribuild under cProfile when --profile-cheribuild is passed and save the statistics in "
+            "the build root.",
+        )
         self.include_dependencies = loader.add_commandline_only_bool_option(
             "include-dependencies",
             "d",
@@ -198,6 +264,27 @@ class DefaultCheriConfig(CheriConfig):
         self.make_jobs: int = loader.add_option(
             "make-jobs", "j", type=int, default=default_make_jobs_computed, help="Number of jobs to use for compiling"
         )  # ty:ignore[invalid-assignment]
+        self.pipeline_tests = loader.add_bool_option(
+            "pipeline-tests",
+            group=loader.tests_group,
+            help="When building and testing (e.g. with --build-and-test), run the tests for each target on a "
+            "separate worker as soon as the target and its dependencies have been built instead of waiting for all "
+            "targets to be built first. Tests are run one at a time in the order in which targets finish building.",
+        )
+        self.use_jobserver = loader.add_bool_option(
+            "jobserver",
+            help="Create a single GNU make jobserver for the whole run and share it between all make, ninja and bmake "
+            "invocations so that the total number of jobs stays within --make-jobs, even when building targets in "
+            "parallel. Build tools that do not support the jobserver protocol fall back to passing -j.",
+        )
+        self.parallel_targets: int = loader.add_option(
+            "parallel-targets",
+            type=int,
+            default=1,
+            group=loader.dependencies_group,
+            help="Build up to N targets at the same time if they do not depend on each other. The --make-jobs budget "
+            "is shared between the targets that are built concurrently.",
+        )  # ty:ignore[invalid-assignment]
 
         # configurable paths
         self.source_root = loader.add_path_option(
@@ -351,7 +351,11 @@ class CommandLineConfigOption(ConfigOptionBase[T]):
     def _load_from_commandline(self) -> "Optional[_LoadedConfigValue]":
         assert self._loader._parsed_args  # load() must have been called before using this object
         # FIXME: check the fallback name here
-        assert hasattr(self._loader._parsed_args, self.action.dest)
+        if not hasattr(self._loader._parsed_args, self.action.dest):
+            # Options for lazily imported project modules can be registered after the command line has been parsed.
+            # Those modules are only imported lazily if none of their options were passed on the command line.
+            assert self._loader.lazily_loaded_option_names, "Option " + self.name + " added after parsing arguments"
+            return None
         result = getattr(self._loader._parsed_args, self.action.dest)  # from command line
         if result is None:
             return None
@@ -469,6 +473,9 @@ class ArgparseSetGivenAction(argparse.Action):
 
 class CommandLineConfigLoader(ConfigLoaderBase):
     _parsed_args: argparse.Namespace
+    # Names of valid options that belong to project modules which have not been imported (yet). These are not
+    # reported as unknown when they are used in the config file.
+    lazily_loaded_option_names: "typing.AbstractSet[str]" = frozenset()
 
     show_all_help: bool = (
         any(s in sys.argv for s in ("--help-all", "--help-hidden")) or ConfigLoaderBase.is_completing_arguments
@@ -853,6 +860,8 @@ class JsonAndCommandLineConfigLoader(CommandLineConfigLoader):
                 error_message(errmsg)
                 raise ValueError(errmsg)
             return True
+        if fullname in self.lazily_loaded_option_names:
+            return True
         error_message("Unknown config option '", fullname, "' in ", self._config_path, sep="")
         if self.unknown_config_option_is_error:
             raise ValueError("Unknown config option '" + fullname + "'")
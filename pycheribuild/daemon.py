@@ -0,0 +1,238 @@
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+# A daemon that keeps all project modules loaded and command line options registered. Every request is handled by a
+# forked child process which then loads the JSON config and command line arguments of the client, so each invocation
+# behaves exactly like running cheribuild.py directly (but skips the expensive startup).
+# The client side is imported by cheribuild-client.py, so this module must only import fast to load modules at the top
+# level (the rest of pycheribuild is only imported by the daemon).
+import array
+import io
+import json
+import os
+import signal
+import socket
+import sys
+import typing
+from typing import Optional
+
+from .completion import sources_cache_key, user_cache_dir
+
+__all__ = ["client_main", "daemon_main", "default_socket_path", "run_in_daemon"]
+
+CHERIBUILD_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cheribuild.py")
+
+
+def default_socket_path() -> str:
+    return os.getenv("CHERIBUILD_DAEMON_SOCKET") or os.path.join(user_cache_dir(), "daemon.sock")
+
+
+def _send_message(conn: socket.socket, **kwargs) -> None:
+    conn.sendall(json.dumps(kwargs).encode("utf-8") + b"\n")
+
+
+def _receive_request(conn: socket.socket) -> "tuple[dict[str, typing.Any], list[int]]":
+    fds = array.array("i")
+    data, ancdata, _, _ = conn.recvmsg(65536, socket.CMSG_SPACE(3 * fds.itemsize))
+    if not data:
+        raise EOFError("Client closed the connection")
+    for level, kind, fd_data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(fd_data[: len(fd_data) - (len(fd_data) % fds.itemsize)])
+    while not data.endswith(b"\n"):
+        chunk = conn.recv(65536)
+        if not chunk:
+            raise ValueError("Incomplete request")
+        data += chunk
+    return json.loads(data), list(fds)
+
+
+def _handle_request(conn: socket.socket, prepared) -> "typing.NoReturn":
+    # Runs in the forked child: make it look like cheribuild.py was started by the client.
+    exit_code = 1
+    try:
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        # Start a new session to detach from the terminal that the daemon was started from (the client forwards
+        # signals to our process group instead).
+        os.setsid()
+        request, fds = _receive_request(conn)
+        if len(fds) != 3:
+            raise ValueError("Expected stdin, stdout and stderr file descriptors, got " + str(fds))
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for target_fd, fd in enumerate(fds):
+            os.dup2(fd, target_fd)
+            os.close(fd)
+        typing.cast(io.TextIOWrapper, sys.stdout).reconfigure(line_buffering=sys.stdout.isatty())
+        typing.cast(io.TextIOWrapper, sys.stderr).reconfigure(line_buffering=True)
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["env"])
+        sys.argv = [CHERIBUILD_SCRIPT, *request["args"]]
+        _send_message(conn, pid=os.getpid())
+        from .__main__ import main
+
+        try:
+            main(prepared)
+            exit_code = 0
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                exit_code = e.code or 0
+            else:
+                print(e.code, file=sys.stderr)
+    except EOFError:
+        pass  # Only checking whether the daemon is running
+    except BaseException as e:  # noqa: BLE001
+        print("cheribuild daemon: failed to handle request:", e, file=sys.stderr)
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            _send_message(conn, exit=exit_code)
+        except (OSError, ValueError):
+            pass
+        os._exit(exit_code)
+
+
+def serve(socket_path: str) -> None:
+    """Load all targets and options, then handle client requests until the pycheribuild sources change."""
+    from .__main__ import register_targets_and_options
+
+    if os.path.exists(socket_path):
+        if run_in_daemon(socket_path, None) is not None:
+            sys.exit(f"cheribuild daemon is already running (socket {socket_path})")
+        os.unlink(socket_path)  # Stale socket left behind by a daemon that was killed
+    os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+    sources_key = sources_cache_key()
+    prepared = register_targets_and_options(allow_lazy_loading=False)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o077)  # Only the current user may connect to the daemon
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(old_umask)
+    server.listen()
+    # Reap finished request handlers automatically and make sure SIGTERM also removes the socket.
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print("cheribuild daemon listening on", socket_path, flush=True)
+    try:
+        while True:
+            conn, _ = server.accept()
+            if sources_cache_key() != sources_key:
+                # The loaded modules are out of date, let the client run cheribuild.py instead and exit.
+                _send_message(conn, stale=True)
+                conn.close()
+                print("cheribuild sources changed, exiting.", flush=True)
+                return
+            pid = os.fork()
+            if pid == 0:
+                server.close()
+                _handle_request(conn, prepared)
+            conn.close()
+    finally:
+        server.close()
+        os.unlink(socket_path)
+
+
+def run_in_daemon(socket_path: str, args: "Optional[list[str]]") -> "Optional[int]":
+    """
+    Run cheribuild with args in the daemon listening on socket_path and return the exit code. Returns None if the
+    daemon is not running or is out of date. If args is None, only check whether a daemon is listening.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        return None
+    with sock:
+        if args is None:
+            return 0
+        request = json.dumps({"args": args, "cwd": os.getcwd(), "env": dict(os.environ)}).encode("utf-8") + b"\n"
+        stdio_fds = array.array("i", [sys.stdin.fileno(), sys.stdout.fileno(), sys.stderr.fileno()])
+        try:
+            sent = sock.sendmsg([request], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, stdio_fds)])
+            sock.sendall(request[sent:])
+        except OSError:
+            return None  # The daemon exited after accepting the connection because it was out of date.
+        pid = None
+        old_handlers = {}
+
+        def forward_signal(signum, _frame) -> None:
+            if pid is not None:
+                try:
+                    os.killpg(pid, signum)
+                except ProcessLookupError:
+                    pass
+
+        try:
+            for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+                old_handlers[signum] = signal.signal(signum, forward_signal)
+            for line in sock.makefile("rb"):
+                message = json.loads(line)
+                if message.get("stale"):
+                    return None
+                if "pid" in message:
+                    pid = message["pid"]
+                if "exit" in message:
+                    return message["exit"]
+        finally:
+            for signum, handler in old_handlers.items():
+                signal.signal(signum, handler)
+    print("cheribuild daemon: connection closed unexpectedly", file=sys.stderr)
+    return 1
+
+
+def client_main() -> None:
+    """Forward the command line to a running daemon or run cheribuild.py directly if there is none."""
+    args = sys.argv[1:]
+    # Tab-completion is handled by cheribuild.py using the completion index instead.
+    if "_ARGCOMPLETE" not in os.environ:
+        exit_code = run_in_daemon(default_socket_path(), args)
+        if exit_code is not None:
+            sys.exit(exit_code)
+    os.execv(sys.executable, [sys.executable, CHERIBUILD_SCRIPT, *args])
+
+
+def daemon_main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Keep all cheribuild targets loaded in memory to speed up cheribuild-client.py invocations."
+    )
+    parser.add_argument(
+        "--socket",
+        default=default_socket_path(),
+        help="The path of the UNIX socket to listen on (default: %(default)s, can be changed by setting the "
+        "CHERIBUILD_DAEMON_SOCKET environment variable)",
+    )
+    args = parser.parse_args()
+    sys.argv = [CHERIBUILD_SCRIPT]  # Don't let our arguments affect the option registration
+    try:
+        serve(args.socket)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,118 @@
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import typing
+from typing import Hashable, Optional
+
+if typing.TYPE_CHECKING:  # no-combine
+    from .targets import Target  # no-combine
+
+__all__ = ["DependencyGraph"]
+
+
+class DependencyGraph:
+    """
+    The (memoized) dependency graph of the targets for one configuration. Every target name is mapped to a small
+    integer id and both the direct dependencies (the adjacency lists) and the transitive dependencies are stored in
+    arrays indexed by that id. There is one set of arrays per set of dependency flags (e.g. with/without toolchain
+    dependencies), so resolving the dependencies of all targets only expands every target once per set of flags.
+    """
+
+    # The key used for the unfiltered dependencies (see SimpleProject.cached_full_dependencies()).
+    FULL_DEPENDENCIES: "tuple[bool, bool, bool]" = (True, True, True)
+
+    def __init__(self) -> None:
+        self._ids: "dict[str, int]" = {}
+        self._targets: "list[Optional[Target]]" = []
+        self._adjacency: "dict[Hashable, list[Optional[list[int]]]]" = {}
+        self._closure_ids: "dict[Hashable, list[Optional[list[int]]]]" = {}
+        self._closures: "dict[Hashable, list[Optional[list[Target]]]]" = {}
+
+    def __len__(self) -> int:
+        return len(self._targets)
+
+    def node_id(self, name: str) -> int:
+        result = self._ids.get(name)
+        if result is None:
+            result = len(self._targets)
+            self._ids[name] = result
+            self._targets.append(None)
+        return result
+
+    def add_target(self, target: "Target") -> int:
+        result = self.node_id(target.name)
+        self._targets[result] = target
+        return result
+
+    def target(self, node_id: int) -> "Target":
+        result = self._targets[node_id]
+        assert result is not None, "Node " + str(node_id) + " was never added as a dependency"
+        return result
+
+    @staticmethod
+    def _lookup(arrays: "dict[Hashable, list[Optional[list]]]", node_id: int, key: Hashable) -> "Optional[list]":
+        values = arrays.get(key)
+        if values is None or node_id >= len(values):
+            return None
+        return values[node_id]
+
+    @staticmethod
+    def _store(arrays: "dict[Hashable, list[Optional[list]]]", node_id: int, key: Hashable, value: list) -> None:
+        values = arrays.setdefault(key, [])
+        if node_id >= len(values):
+            values.extend([None] * (node_id + 1 - len(values)))
+        values[node_id] = value
+
+    def direct_dependency_ids(self, node_id: int, key: Hashable) -> "Optional[list[int]]":
+        return self._lookup(self._adjacency, node_id, key)
+
+    def closure_ids(self, node_id: int, key: Hashable) -> "Optional[list[int]]":
+        """Return the ids of the transitive dependencies of node_id for key or None if they are not known yet."""
+        return self._lookup(self._closure_ids, node_id, key)
+
+    def closure(self, node_id: int, key: Hashable) -> "Optional[list[Target]]":
+        return self._lookup(self._closures, node_id, key)
+
+    def set_dependencies(
+        self, node_id: int, key: Hashable, dependency_ids: "list[int]", *, recursive: bool = True
+    ) -> "list[Target]":
+        """
+        Record the direct dependencies of node_id for key and return its transitive dependencies. Each dependency is
+        followed by its own transitive dependencies, so the transitive dependencies of all dependency_ids must have
+        been recorded already (unless recursive is False).
+        """
+        # Use a dict as an ordered set to avoid quadratic "if dep not in result" checks
+        result: "dict[int, None]" = {}
+        for dep in dependency_ids:
+            result[dep] = None
+            if recursive:
+                dep_closure = self.closure_ids(dep, key)
+                assert dep_closure is not None, "Dependencies of " + self.target(dep).name + " not resolved yet"
+                result.update(dict.fromkeys(dep_closure))
+        closure_ids = list(result)
+        closure = [self.target(dep) for dep in closure_ids]
+        self._store(self._adjacency, node_id, key, dependency_ids)
+        self._store(self._closure_ids, node_id, key, closure_ids)
+        self._store(self._closures, node_id, key, closure)
+        return closure
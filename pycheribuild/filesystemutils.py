@@ -28,18 +28,256 @@
 # SUCH DAMAGE.
 #
 
+import errno
 import os
+import queue
 import shutil
+import stat
 import subprocess
+import sys
 import threading
+import time
 import typing
 from pathlib import Path
 from typing import Callable, Optional
 
+from .probe_cache import file_hash_cache
 from .processutils import print_command, run_command
 from .utils import AnsiColour, ConfigBase, ThreadJoiner, fatal_error, status_update, warning_message
 
 
+class _TreeDeletion:
+    """The state of one directory tree that is being deleted by the ParallelDeleter."""
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.removed = 0  # number of files and directories that have been removed so far
+        self.errors: "list[OSError]" = []
+        # Directories that have been scanned, mapped to the number of subdirectories that still need to be removed.
+        self.pending_subdirs: "dict[str, int]" = {}
+        self.parents: "dict[str, str]" = {}
+
+
+class ParallelDeleter:
+    """
+    A bounded pool of threads that delete directory trees. Each directory is scanned with os.scandir() by one of the
+    workers, which unlinks all files and queues the subdirectories so that they are processed in parallel. Directories
+    are removed once all their subdirectories are gone. All async_clean_directory() calls share the same pool, so
+    cleaning multiple build directories at once does not result in an unbounded number of threads hammering the disk.
+    """
+
+    def __init__(self, num_workers: int) -> None:
+        self.num_workers = num_workers
+        # LIFO order processes the tree depth-first, which keeps the number of partially deleted directories small.
+        self._queue: "queue.LifoQueue[tuple[_TreeDeletion, str]]" = queue.LifoQueue()
+        self._workers: "list[threading.Thread]" = []
+        self._lock = threading.Lock()
+        self._active: "dict[str, _TreeDeletion]" = {}
+
+    def delete(self, path: Path) -> _TreeDeletion:
+        """Start deleting path in the background (use the returned object's done event to wait for completion)."""
+        with self._lock:
+            if not self._workers:
+                for i in range(self.num_workers):
+                    worker = threading.Thread(target=self._worker, name=f"Deleter thread {i}", daemon=True)
+                    worker.start()
+                    self._workers.append(worker)
+            tree = _TreeDeletion(str(path))
+            self._active[tree.root] = tree
+        self._queue.put((tree, tree.root))
+        return tree
+
+    def wait(self, tree: _TreeDeletion) -> None:
+        tree.done.wait()
+        with self._lock:
+            if self._active.get(tree.root) is tree:
+                del self._active[tree.root]
+
+    def num_removed(self, path: Path) -> "Optional[int]":
+        """Returns the number of files and directories removed so far if path is currently being deleted."""
+        with self._lock:
+            tree = self._active.get(str(path))
+        return tree.removed if tree is not None else None
+
+    def _worker(self) -> None:
+        while True:
+            tree, path = self._queue.get()
+            try:
+                self._scan_directory(tree, path)
+            except BaseException as e:  # noqa: BLE001
+                # Should not happen, but we must not leave the waiting thread hanging.
+                tree.errors.append(OSError(f"Unexpected error deleting {path}: {e}"))
+                tree.done.set()
+
+    def _scan_directory(self, tree: _TreeDeletion, path: str) -> None:
+        subdirs = []
+        errors = []
+        removed = 0
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        else:
+                            os.unlink(entry.path)
+                            removed += 1
+                    except OSError as e:
+                        errors.append(e)
+        except OSError as e:
+            errors.append(e)
+        with tree.lock:
+            tree.removed += removed
+            tree.errors.extend(errors)
+            tree.pending_subdirs[path] = len(subdirs)
+            for subdir in subdirs:
+                tree.parents[subdir] = path
+        if not subdirs:
+            self._remove_directory(tree, path)
+        for subdir in subdirs:
+            self._queue.put((tree, subdir))
+
+    @staticmethod
+    def _remove_directory(tree: _TreeDeletion, path: "Optional[str]") -> None:
+        # Remove path and then all parents whose subdirectories have all been removed now.
+        while path is not None:
+            try:
+                os.rmdir(path)
+                error = None
+            except OSError as e:
+                error = e
+            with tree.lock:
+                if error is not None:
+                    tree.errors.append(error)
+                else:
+                    tree.removed += 1
+                del tree.pending_subdirs[path]
+                parent = tree.parents.pop(path, None)
+                if parent is None:
+                    tree.done.set()
+                    return
+                tree.pending_subdirs[parent] -= 1
+                if tree.pending_subdirs[parent] != 0:
+                    return
+            path = parent
+
+
+_deletion_pool: "Optional[ParallelDeleter]" = None
+_deletion_pool_lock = threading.Lock()
+
+
+def deletion_pool() -> ParallelDeleter:
+    global _deletion_pool  # noqa: PLW0603
+    with _deletion_pool_lock:
+        if _deletion_pool is None:
+            # Deleting is bound by file system metadata updates, so more threads than this rarely help.
+            _deletion_pool = ParallelDeleter(num_workers=max(2, min(8, os.cpu_count() or 1)))
+        return _deletion_pool
+
+
+class FileCopyEngine:
+    """
+    Copies files using the cheapest mechanism that the file systems involved support: a reflink (FICLONE on Linux,
+    which is free on Btrfs/XFS), os.copy_file_range() (an in-kernel copy that can also clone blocks on e.g. ZFS/NFS),
+    a hardlink (only if requested and the source file is read-only, i.e. it is not expected to be modified in place),
+    and finally a normal read()/write() copy. Mechanisms that fail with an "unsupported" error are not retried for the
+    same pair of devices.
+    """
+
+    # _IOW(0x94, 9, int) from <linux/fs.h>
+    FICLONE = 0x40049409
+    # Errors that indicate that a copy mechanism is not supported for this pair of files/file systems.
+    _unsupported_errnos = frozenset(
+        {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY, errno.EPERM, errno.EBADF}
+    )
+
+    def __init__(self) -> None:
+        self._unsupported: "set[tuple[str, int, int]]" = set()
+        self.stats: "dict[str, int]" = {"reflink": 0, "copy_file_range": 0, "hardlink": 0, "copy": 0}
+
+    def _is_supported(self, method: str, src_dev: int, dst_dev: int) -> bool:
+        return (method, src_dev, dst_dev) not in self._unsupported
+
+    def _mark_unsupported(self, method: str, src_dev: int, dst_dev: int, e: OSError) -> bool:
+        if e.errno not in self._unsupported_errnos:
+            return False
+        self._unsupported.add((method, src_dev, dst_dev))
+        return True
+
+    def _try_reflink(self, fsrc: typing.BinaryIO, fdst: typing.BinaryIO, src_dev: int, dst_dev: int) -> bool:
+        if not sys.platform.startswith("linux") or not self._is_supported("reflink", src_dev, dst_dev):
+            return False
+        import fcntl
+
+        try:
+            fcntl.ioctl(fdst.fileno(), self.FICLONE, fsrc.fileno())
+            return True
+        except OSError as e:
+            if not self._mark_unsupported("reflink", src_dev, dst_dev, e):
+                raise
+            return False
+
+    def _try_copy_file_range(
+        self, fsrc: typing.BinaryIO, fdst: typing.BinaryIO, size: int, src_dev: int, dst_dev: int
+    ) -> bool:
+        if not hasattr(os, "copy_file_range") or not self._is_supported("copy_file_range", src_dev, dst_dev):
+            return False
+        copied = 0
+        try:
+            while True:
+                n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), max(size - copied, 1024 * 1024))
+                if n == 0:
+                    break
+                copied += n
+            return True
+        except OSError as e:
+            # Only fall back if nothing has been copied yet (otherwise the file offsets would be wrong).
+            if copied != 0 or not self._mark_unsupported("copy_file_range", src_dev, dst_dev, e):
+                raise
+            return False
+
+    def copy_file(self, src: Path, dst: Path, *, allow_hardlink=False, copy_metadata=True) -> str:
+        """
+        Copy the contents of src (following symlinks) to dst and return the name of the mechanism that was used.
+        An existing dst is replaced instead of being written to, so that hardlinks to it are not modified.
+        :param allow_hardlink: Create a hardlink instead of a copy if src is read-only
+        :param copy_metadata: Also copy permission bits and timestamps (like shutil.copy2())
+        """
+        src_stat = os.stat(str(src))
+        if os.path.realpath(str(src)) == os.path.realpath(str(dst)):
+            raise shutil.SameFileError(f"{src} and {dst} are the same file")
+        if os.path.lexists(str(dst)):
+            os.unlink(str(dst))
+        if allow_hardlink and not (src_stat.st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)):
+            dst_dev = os.stat(str(dst.parent)).st_dev
+            if self._is_supported("hardlink", src_stat.st_dev, dst_dev):
+                try:
+                    os.link(str(src), str(dst))
+                    self.stats["hardlink"] += 1
+                    return "hardlink"
+                except OSError as e:
+                    if not self._mark_unsupported("hardlink", src_stat.st_dev, dst_dev, e):
+                        raise
+        with open(str(src), "rb") as fsrc, open(str(dst), "wb") as fdst:
+            dst_dev = os.fstat(fdst.fileno()).st_dev
+            if self._try_reflink(fsrc, fdst, src_stat.st_dev, dst_dev):
+                method = "reflink"
+            elif self._try_copy_file_range(fsrc, fdst, src_stat.st_size, src_stat.st_dev, dst_dev):
+                method = "copy_file_range"
+            else:
+                shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+                method = "copy"
+        if copy_metadata:
+            shutil.copystat(str(src), str(dst))
+        self.stats[method] += 1
+        return method
+
+
+file_copy_engine = FileCopyEngine()
+
+
 class FileSystemUtils:
     def __init__(self, config: ConfigBase) -> None:
         self.config = config
@@ -52,7 +290,27 @@ class FileSystemUtils:
     def _delete_directories(self, *dirs) -> None:
         # http://stackoverflow.com/questions/5470939/why-is-shutil-rmtree-so-slow
         # shutil.rmtree(path) # this is slooooooooooooooooow for big trees
-        run_command("rm", "-rf", *dirs, config=self.config)
+        # Instead of a single-threaded rm -rf we delete directories using the shared pool of deleter threads and only
+        # fall back to rm -rf for anything that could not be removed that way (e.g. read-only directories).
+        print_command("rm", "-rf", *dirs, config=self.config)
+        if self.config.pretend:
+            return
+        remaining = []
+        trees = []
+        pool = deletion_pool()
+        for d in dirs:
+            if os.path.isdir(d) and not os.path.islink(d):
+                trees.append(pool.delete(Path(d)))
+            elif os.path.lexists(d):
+                remaining.append(d)
+        for tree in trees:
+            pool.wait(tree)
+            if tree.errors and os.path.lexists(tree.root):
+                if self.config.verbose:
+                    status_update("Parallel delete of", tree.root, "failed:", tree.errors[0])
+                remaining.append(tree.root)
+        if remaining:
+            run_command("rm", "-rf", *remaining, config=self.config, print_verbose_only=True)
 
     def clean_directory(self, path: Path, keep_root=False, ensure_dir_exists=True) -> None:
         """After calling this function path will be an empty directory
@@ -69,6 +327,8 @@ class FileSystemUtils:
             self.makedirs(path)
 
     class DeleterThread(threading.Thread):
+        progress_interval = 10.0
+
         def __init__(self, parent: "FileSystemUtils", path: Path):
             super().__init__(name="Deleting " + str(path))
             self.path = path
@@ -84,6 +344,19 @@ class FileSystemUtils:
             except Exception as e:
                 warning_message("Could not remove directory", self.path, e)
 
+        def join(self, timeout: "Optional[float]" = None) -> None:
+            # Report progress when someone is waiting for the deletion to complete (e.g. via ThreadJoiner).
+            if timeout is not None:
+                return super().join(timeout)
+            while True:
+                start = time.monotonic()
+                super().join(self.progress_interval)
+                if not self.is_alive():
+                    return
+                removed = deletion_pool().num_removed(self.path)
+                if removed is not None and time.monotonic() - start >= self.progress_interval:
+                    status_update("Still deleting", self.path, "-", removed, "files and directories removed")
+
     def async_clean_directory(
         self, path: Path, *, keep_root=False, keep_dirs: "Optional[list[str]]" = None
     ) -> ThreadJoiner:
@@ -145,10 +418,29 @@ class FileSystemUtils:
             deleter_thread = FileSystemUtils.DeleterThread(self, tempdir)
         return ThreadJoiner(deleter_thread)
 
-    def copy_directory(self, src_path: Path, dst_path: Path) -> None:
-        print_command("cp", "-r", src_path, dst_path, print_verbose_only=True, config=self.config)
+    def copy_directory(
+        self, src_path: Path, dst_path: Path, *, symlinks=False, dirs_exist_ok=False, hardlink_read_only_files=False
+    ) -> None:
+        """
+        Recursively copy src_path to dst_path (using reflinks or in-kernel copies where possible).
+        :param symlinks: Copy symlinks as symlinks instead of copying the files they point to (like cp -a)
+        :param dirs_exist_ok: Merge into an existing dst_path instead of failing
+        :param hardlink_read_only_files: Hardlink read-only files instead of copying them (only safe if the
+        destination files are never modified in place)
+        """
+        print_command("cp", "-a" if symlinks else "-r", src_path, dst_path, print_verbose_only=True, config=self.config)
         if not self.config.pretend:
-            shutil.copytree(str(src_path), str(dst_path))
+
+            def copy_function(src: str, dst: str) -> None:
+                file_copy_engine.copy_file(Path(src), Path(dst), allow_hardlink=hardlink_read_only_files)
+
+            shutil.copytree(
+                str(src_path),
+                str(dst_path),
+                symlinks=symlinks,
+                copy_function=copy_function,
+                dirs_exist_ok=dirs_exist_ok,
+            )
 
     def delete_file(self, file: Path, print_verbose_only=False, warn_if_missing=False) -> None:
         print_command("rm", "-f", file, print_verbose_only=print_verbose_only, config=self.config)
@@ -290,7 +582,15 @@ class FileSystemUtils:
         run_command([*cmd, str(src), str(dest)], config=self.config)
 
     def install_file(
-        self, src: Path, dest: Path, *, force=False, create_dirs=True, print_verbose_only=True, mode=None
+        self,
+        src: Path,
+        dest: Path,
+        *,
+        force=False,
+        create_dirs=True,
+        print_verbose_only=True,
+        mode=None,
+        hardlink_read_only_files=False,
     ) -> None:
         if force:
             print_command("cp", "-f", src, dest, print_verbose_only=print_verbose_only, config=self.config)
@@ -309,8 +609,11 @@ class FileSystemUtils:
             self.makedirs(dest.parent)
         if dest.is_symlink():
             dest.unlink()
-        # noinspection PyArgumentList
-        shutil.copy2(str(src), str(dest), follow_symlinks=False)
+        if src.is_symlink():
+            # noinspection PyArgumentList
+            shutil.copy2(str(src), str(dest), follow_symlinks=False)
+        else:
+            file_copy_engine.copy_file(src, dest, allow_hardlink=hardlink_read_only_files)
         if mode is not None:
             print_command("chmod", oct(mode), dest, print_verbose_only=print_verbose_only, config=self.config)
             dest.chmod(mode)
@@ -385,6 +688,21 @@ class FileSystemUtils:
                 "ln", "-fsn", tool_path.name, target + tool_name, cwd=cwd, print_verbose_only=True, config=self.config
             )
 
+    @staticmethod
+    def walk_files(directory: Path) -> "typing.Iterator[Path]":
+        """Yields all regular files (but not symlinks) below directory. This is faster than os.walk() + stat()."""
+        pending = [str(directory)]
+        while pending:
+            try:
+                with os.scandir(pending.pop()) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            yield Path(entry.path)
+            except OSError as e:
+                warning_message("Could not list directory contents:", e)
+
     @staticmethod
     # Not cached since another target could write to this dir: @functools.lru_cache(maxsize=20)
     def is_nonexistent_or_empty_dir(d: Path) -> bool:
@@ -401,23 +719,60 @@ class FileSystemUtils:
     def realpath(p: Path) -> Path:
         return p.resolve(strict=False)
 
-    def _hashsum(self, file: Path, algorithm: str) -> str:
-        # Based on https://stackoverflow.com/a/44873382/894271
+    @staticmethod
+    def _compute_hashsum(file: Path, algorithm: str) -> str:
         import hashlib  # rarely need, so imported on demand to reduce startup time
+        import mmap
 
         h = hashlib.new(algorithm)
-        b = bytearray(128 * 1024)
-        mv = memoryview(b)
+        with file.open("rb", buffering=0) as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return h.hexdigest()  # empty files cannot be mmap()ed
+            # Hashing the mapped file avoids copying it through a userspace buffer. Large chunks are passed to
+            # hashlib since it releases the GIL while hashing, which allows hashing multiple files in parallel.
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                chunk_size = 16 * 1024 * 1024
+                with memoryview(mm) as mv:
+                    for offset in range(0, size, chunk_size):
+                        h.update(mv[offset : offset + chunk_size])
+        return h.hexdigest()
+
+    def _lookup_hashsum(self, file: Path, algorithm: str) -> "tuple[str, bool]":
+        """Returns the hash of file and whether it had to be computed (i.e. should be added to the cache)."""
         if not file.exists():
             fatal_error("Cannot hash", file, "since it does not exist", pretend=self.config.pretend)
             if self.config.pretend:
-                return "0"
-        with file.open("rb", buffering=0) as f:
-            # PyCharm thinks .readinto is not supported.
-            # noinspection PyUnresolvedReferences
-            for n in iter(lambda: f.readinto(mv), 0):  # pytype: disable=wrong-arg-types
-                h.update(mv[:n])  # pytype: disable=wrong-arg-types
-        return h.hexdigest()
+                return "0", False
+        # The cache entries are keyed by path, size, modification time and inode, so modified files are rehashed.
+        cached = file_hash_cache.get("file-hashes", file, algorithm)
+        if isinstance(cached, str):
+            return cached, False
+        return self._compute_hashsum(file, algorithm), True
+
+    def _hashsum(self, file: Path, algorithm: str) -> str:
+        result, computed = self._lookup_hashsum(file, algorithm)
+        if computed:
+            file_hash_cache.set("file-hashes", file, algorithm, result)
+        return result
+
+    def hashsums(self, files: "typing.Iterable[Path]", algorithm: str, max_workers=None) -> "dict[Path, str]":
+        """Hash multiple files in parallel (using the persistent cache where possible)."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        files = list(files)
+        if max_workers is None:
+            max_workers = min(len(files), os.cpu_count() or 1)
+        if max_workers <= 1:
+            results = [self._lookup_hashsum(f, algorithm) for f in files]
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hash") as executor:
+                results = list(executor.map(lambda f: self._lookup_hashsum(f, algorithm), files))
+        # Every cache update rewrites the whole file, so add all new hashes at once.
+        file_hash_cache.update(
+            "file-hashes", {f: {algorithm: result} for f, (result, computed) in zip(files, results) if computed}
+        )
+        return {f: result for f, (result, _) in zip(files, results)}
 
     def sha256sum(self, file: Path) -> str:
         return self._hashsum(file, "sha256")
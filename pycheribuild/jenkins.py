@@ -369,13 +369,8 @@ def create_tarball(cheri_config) -> None:
 def strip_binaries(_: JenkinsConfig, project: SimpleProject, directory: Path) -> None:
     status_update("Tarball directory size before stripping ELF files:")
     project.run_cmd("du", "-sh", directory)
-    for root, dirs, filelist in os.walk(str(directory)):
-        for file in filelist:
-            # Try to shrink the size by stripping all elf binaries
-            filepath = Path(root, file)
-            if filepath.is_symlink():
-                continue
-            project.maybe_strip_elf_file(filepath)
+    # Try to shrink the size by stripping all elf binaries
+    project.maybe_strip_elf_files((f, None) for f in project.walk_files(directory))
     status_update("Tarball directory size after stripping ELF files:")
     project.run_cmd("du", "-sh", directory)
 
@@ -0,0 +1,120 @@
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import atexit
+import os
+import shutil
+import tempfile
+import threading
+import typing
+from pathlib import Path
+from typing import Optional
+
+from .utils import status_update
+
+if typing.TYPE_CHECKING:  # no-combine
+    from .config.chericonfig import CheriConfig  # no-combine
+
+__all__ = ["Jobserver", "JobserverClientArgs", "get_jobserver"]
+
+
+class JobserverClientArgs(typing.NamedTuple):
+    """The extra arguments needed to connect a build tool to the jobserver."""
+
+    flags: "list[str]"
+    env: "dict[str, str]"
+    pass_fds: "tuple[int, ...]"
+
+
+class Jobserver:
+    """
+    A GNU make compatible jobserver (https://www.gnu.org/software/make/manual/html_node/POSIX-Jobserver.html) that is
+    shared by all build tools started by cheribuild. The jobserver starts with jobs - 1 tokens in a named pipe and
+    every client that wants to run an additional job has to read a token first (each client has one implicit token).
+    Tools that support the make 4.4 FIFO protocol (GNU make >= 4.4 and ninja >= 1.13) only need the FIFO path, older
+    GNU make versions and bmake need the file descriptors for the pipe to be inherited.
+    """
+
+    def __init__(self, jobs: int) -> None:
+        assert jobs > 0, jobs
+        self.jobs = jobs
+        self._tempdir = Path(tempfile.mkdtemp(prefix="cheribuild-jobserver-"))
+        self.fifo_path = self._tempdir / "fifo"
+        os.mkfifo(str(self.fifo_path), 0o600)
+        # Opening the read end of a FIFO blocks until there is a writer, so open it non-blocking first.
+        # Keeping both ends open in this process ensures that clients never see EOF on the FIFO.
+        self.read_fd = os.open(str(self.fifo_path), os.O_RDONLY | os.O_NONBLOCK)
+        self.write_fd = os.open(str(self.fifo_path), os.O_WRONLY)
+        os.set_blocking(self.read_fd, True)
+        os.set_inheritable(self.read_fd, False)
+        os.set_inheritable(self.write_fd, False)
+        if jobs > 1:
+            os.write(self.write_fd, b"+" * (jobs - 1))
+
+    def close(self) -> None:
+        for fd in (self.read_fd, self.write_fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        shutil.rmtree(str(self._tempdir), ignore_errors=True)
+
+    def gnu_make_fifo_client_args(self) -> JobserverClientArgs:
+        # Used by GNU make >= 4.4 and ninja >= 1.13
+        return JobserverClientArgs(
+            flags=[], env={"MAKEFLAGS": f" -j{self.jobs} --jobserver-auth=fifo:{self.fifo_path}"}, pass_fds=()
+        )
+
+    def gnu_make_pipe_client_args(self) -> JobserverClientArgs:
+        # Used by GNU make 4.2 and 4.3 (which only understand the --jobserver-auth=R,W syntax)
+        return JobserverClientArgs(
+            flags=[],
+            env={"MAKEFLAGS": f" -j{self.jobs} --jobserver-auth={self.read_fd},{self.write_fd}"},
+            pass_fds=(self.read_fd, self.write_fd),
+        )
+
+    def bmake_client_args(self) -> JobserverClientArgs:
+        # bmake uses the same token protocol but expects the pipe file descriptors to be passed using -J.
+        return JobserverClientArgs(
+            flags=["-j" + str(self.jobs), "-J", f"{self.read_fd},{self.write_fd}"],
+            env={},
+            pass_fds=(self.read_fd, self.write_fd),
+        )
+
+
+_jobserver: "Optional[Jobserver]" = None
+_jobserver_lock = threading.Lock()
+
+
+def get_jobserver(config: "CheriConfig") -> "Optional[Jobserver]":
+    """Return the jobserver shared by all build tools (created on first use) or None if it is disabled."""
+    global _jobserver  # noqa: PLW0603
+    if not config.use_jobserver or config.pretend:
+        return None
+    with _jobserver_lock:
+        if _jobserver is None:
+            status_update("Starting jobserver with", config.make_jobs, "jobs")
+            _jobserver = Jobserver(config.make_jobs)
+            atexit.register(_jobserver.close)
+        return _jobserver
@@ -29,12 +29,18 @@
 #
 
 import collections.abc
+import contextlib
 import fnmatch
+import gc
+import hashlib
 import io
+import marshal
 import os
+import re
 import shlex
 import stat
 import sys
+import tempfile
 import typing
 from collections import OrderedDict
 from pathlib import Path, PurePath, PurePosixPath
@@ -75,40 +81,106 @@ class MtreePath(PurePosixPath):
 
         return s_dest
 
+    @staticmethod
+    def unescape(s: str) -> str:
+        # Decode the \ooo (VIS_OCTAL) and backslash-escaped characters written by strsvis(3), i.e. the inverse of
+        # escape(). The octal escapes are UTF-8 bytes, so decode all of them together.
+        if "\\" not in s:
+            return s
+        result = bytearray()
+        i = 0
+        while i < len(s):
+            if s[i] == "\\" and i + 1 < len(s):
+                octal = s[i + 1 : i + 4]
+                if len(octal) == 3 and all(c in "01234567" for c in octal):
+                    result.append(int(octal, 8))
+                    i += 4
+                    continue
+                i += 1  # \\ or another escaped character
+            result += s[i].encode("utf-8")
+            i += 1
+        return result.decode("utf-8", errors="surrogateescape")
+
+
+# Attributes whose values repeat for almost every entry (e.g. uname=root). Interning them saves a lot of memory when
+# loading a METALOG with 100k+ entries.
+_INTERNED_ATTRIBUTES = frozenset({"type", "uname", "gname", "mode", "flags"})
+# Ignore some tags that makefs doesn't like: sometimes there will be time with nanoseconds in the manifest, makefs
+# can't handle that and the tags= key is not supported either.
+_IGNORED_ATTRIBUTES = frozenset({"tags", "time"})
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    # Loading a parsed METALOG creates a few hundred thousand objects (but no reference cycles), so avoid repeatedly
+    # running the garbage collector while doing so. This more than halves the time needed to load the cache.
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
 
 class MtreeEntry:
-    def __init__(self, path: MtreePath, attributes: "dict[str, str]"):
-        self.path = path
+    __slots__ = ("_path", "_path_str", "attributes")
+
+    def __init__(self, path: "Union[MtreePath, str]", attributes: "dict[str, str]"):
+        # Creating a MtreePath is expensive, so entries parsed from a file only store the (normalized) string and
+        # create the path object on demand.
+        if isinstance(path, MtreePath):
+            self._path: "Optional[MtreePath]" = path
+            self._path_str = str(path)
+        else:
+            self._path = None
+            self._path_str = path
         self.attributes = attributes
 
+    @property
+    def path(self) -> MtreePath:
+        if self._path is None:
+            self._path = MtreePath(self._path_str)
+        return self._path
+
+    @property
+    def path_parts(self) -> "tuple[str, ...]":
+        return () if self._path_str == "." else tuple(self._path_str[2:].split("/"))
+
     def is_dir(self) -> bool:
         return self.attributes.get("type") == "dir"
 
     def is_file(self) -> bool:
         return self.attributes.get("type") == "file"
 
+    @staticmethod
+    def _normalize_path(path: str) -> str:
+        if path == ".":
+            return path
+        assert path[:2] == "./"
+        rest = path[2:]
+        # os.path.normpath() is slow, so only call it if the path could be non-normalized
+        if not rest or rest[0] in "./" or rest[-1] == "/" or "//" in rest or "/." in rest:
+            rest = os.path.normpath(rest)
+        return "./" + rest
+
     @classmethod
     def parse(cls, line: str, contents_root: "Optional[Path]" = None) -> "MtreeEntry":
-        elements = shlex.split(line)
-        path = elements[0]
+        # shlex.split() is slow and only needed for lines that contain quotes or escapes
+        elements = shlex.split(line) if ('"' in line or "'" in line or "\\" in line) else line.split()
         # Ensure that the path is normalized:
-        if path != ".":
-            # print("Before:", path)
-            assert path[:2] == "./"
-            path = path[:2] + os.path.normpath(path[2:])
-            # print("After:", path)
-        path = MtreePath(path)
-        attr_dict = OrderedDict()  # keep them in insertion order
-        for k, v in map(lambda s: s.split(sep="=", maxsplit=1), elements[1:]):
-            # ignore some tags that makefs doesn't like
-            # sometimes there will be time with nanoseconds in the manifest, makefs can't handle that
-            # also the tags= key is not supported
-            if k in ("tags", "time"):
+        path = cls._normalize_path(elements[0])
+        attr_dict: "dict[str, str]" = {}  # keep them in insertion order
+        for element in elements[1:]:
+            k, v = element.split("=", 1)
+            if k in _IGNORED_ATTRIBUTES:
                 continue
-            # convert relative contents=keys to absolute ones
-            if contents_root and k == "contents" and not os.path.isabs(v):
+            if k in _INTERNED_ATTRIBUTES:
+                v = sys.intern(v)
+            elif contents_root and k == "contents" and not os.path.isabs(v):
+                # convert relative contents=keys to absolute ones
                 v = str(contents_root / v)
-            attr_dict[k] = v
+            attr_dict[sys.intern(k)] = v
         return MtreeEntry(path, attr_dict)
         # FIXME: use contents=
 
@@ -116,7 +188,7 @@ class MtreeEntry:
     def parse_all_dirs_in_mtree(cls, mtree_file: Path) -> "list[MtreeEntry]":
         with mtree_file.open("r", encoding="utf-8") as f:
             result = []
-            for line in f.readlines():
+            for line in f:
                 if " type=dir" in line:
                     try:
                         result.append(MtreeEntry.parse(line))
@@ -125,7 +197,7 @@ class MtreeEntry:
             return result
 
     def __str__(self) -> str:
-        components = [MtreePath.escape(str(self.path))]
+        components = [MtreePath.escape(self._path_str)]
         for k, v in self.attributes.items():
             components.append(k + "=" + MtreePath.escape(v))
         return " ".join(components)
@@ -137,7 +209,31 @@ class MtreeEntry:
 class MtreeSubtree(collections.abc.MutableMapping):
     def __init__(self):
         self.entry: "Optional[MtreeEntry]" = None
-        self.children: "dict[str, MtreeSubtree]" = OrderedDict()
+        self.children: "dict[str, MtreeSubtree]" = {}
+
+    @staticmethod
+    def _key_parts(key) -> "tuple[str, ...]":
+        if isinstance(key, str):
+            s = key[2:] if key.startswith("./") else key
+            # Fast path for normalized relative paths (avoids creating a MtreePath for every lookup)
+            if s and s[0] not in "./" and s[-1] != "/" and "//" not in s and "/./" not in s and not s.endswith("/."):
+                return tuple(s.split("/"))
+            key = MtreePath(key)
+        elif not isinstance(key, PurePath):
+            raise TypeError
+        return key.parts
+
+    def _get_subtree(self, parts: "typing.Iterable[str]", create: bool) -> "Optional[MtreeSubtree]":
+        node = self
+        for part in parts:
+            child = node.children.get(part)
+            if child is None:
+                if not create:
+                    return None
+                child = MtreeSubtree()
+                node.children[part] = child
+            node = child
+        return node
 
     @staticmethod
     def _split_key(key):
@@ -153,37 +249,53 @@ class MtreeSubtree(collections.abc.MutableMapping):
         return key.parts[0], MtreePath(*key.parts[1:])
 
     def __getitem__(self, key):
-        split = self._split_key(key)
-        if split is None:
-            if self.entry is None:
-                raise KeyError
-            return self.entry
-        return self.children[split[0]][split[1]]
+        node = self._get_subtree(self._key_parts(key), create=False)
+        if node is None or node.entry is None:
+            raise KeyError(key)
+        return node.entry
 
     def __setitem__(self, key, value):
-        split = self._split_key(key)
-        if split is None:
-            self.entry = value
-            return
-        if split[0] not in self.children:
-            self.children[split[0]] = MtreeSubtree()
-        self.children[split[0]][split[1]] = value
+        self._get_subtree(self._key_parts(key), create=True).entry = value
 
     def __delitem__(self, key):
-        split = self._split_key(key)
-        if split is None:
-            if self.entry is None:
-                raise KeyError
-            self.entry = None
-            return
-        del self.children[split[0]][split[1]]
+        node = self._get_subtree(self._key_parts(key), create=False)
+        if node is None or node.entry is None:
+            raise KeyError(key)
+        node.entry = None
 
-    def __iter__(self):
+    def clear(self) -> None:
+        # The MutableMapping implementation removes one entry at a time, which is quadratic for this tree.
+        self.entry = None
+        self.children = {}
+
+    def _iter_entries(self, prefix: "tuple[str, ...]") -> "Iterator[tuple[tuple[str, ...], MtreeEntry]]":
         if self.entry is not None:
-            yield MtreePath()
+            yield prefix, self.entry
         for k, v in self.children.items():
-            for k2 in v:
-                yield MtreePath(k, k2)
+            yield from v._iter_entries((*prefix, k))
+
+    def _serialize(self) -> tuple:
+        # Nested tuples/dicts of strings that can be saved with marshal (used for the parsed METALOG cache).
+        if self.entry is None:
+            return None, None, {k: v._serialize() for k, v in self.children.items()}
+        return self.entry._path_str, self.entry.attributes, {k: v._serialize() for k, v in self.children.items()}
+
+    def _merge_serialized(self, data: tuple, *, verbose: bool) -> None:
+        path_str, attributes, children = data
+        if path_str is not None:
+            if self.entry is not None and verbose and attributes.get("type") != "dir":
+                warning_message("Found duplicate definition for", path_str)
+            self.entry = MtreeEntry(path_str, attributes)
+        for k, v in children.items():
+            child = self.children.get(k)
+            if child is None:
+                child = MtreeSubtree()
+                self.children[k] = child
+            child._merge_serialized(v, verbose=verbose)
+
+    def __iter__(self):
+        for parts, _ in self._iter_entries(()):
+            yield MtreePath(*parts)
 
     def __len__(self):
         ret = int(self.entry is not None)
@@ -241,6 +353,9 @@ class MtreeSubtree(collections.abc.MutableMapping):
 
 
 class MtreeFile:
+    # Bump this whenever the format of the parsed METALOG cache changes.
+    CACHE_VERSION = 1
+
     def __init__(
         self,
         *,
@@ -253,8 +368,22 @@ class MtreeFile:
         if file:
             self.load(file, contents_root=contents_root, append=False)
 
-    def load(self, file: "Union[io.StringIO,Path,typing.IO]", *, append: bool, contents_root: "Optional[Path]" = None):
+    def load(
+        self,
+        file: "Union[io.StringIO,Path,typing.IO]",
+        *,
+        append: bool,
+        contents_root: "Optional[Path]" = None,
+        cache_dir: "Optional[Path]" = None,
+    ):
+        """
+        Load the entries from file. If cache_dir is set (and file is a Path), the parsed entries are also saved to
+        a file in cache_dir so that later loads of the same (unmodified) file can skip parsing it.
+        """
         if isinstance(file, Path):
+            if cache_dir is not None and "_TEST_SKIP_METALOG" not in os.environ:
+                self._load_with_cache(file, cache_dir, append=append, contents_root=contents_root)
+                return
             with file.open("r") as f:
                 self.load(f, contents_root=contents_root, append=append)
                 return
@@ -263,26 +392,77 @@ class MtreeFile:
         if "_TEST_SKIP_METALOG" in os.environ:
             status_update("Not parsing", file, "in test mode")
             return  # avoid parsing all metalog files in the basic sanity checks
-        for line in file.readlines():
+        # Parse the file line-by-line instead of reading it into memory first (METALOG.world has 100k+ lines).
+        for line in file:
             line = line.strip()
-            if not line or line.startswith("#"):
+            if not line or line[0] == "#":
                 continue
             try:
-                entry = MtreeEntry.parse(line, contents_root)
-                key = entry.path
-                keystr = str(key)
-                assert keystr == "." or os.path.normpath(keystr[2:]) == keystr[2:]
-                if key in self._mtree:
-                    # Currently the FreeBSD build system can produce duplicate directory entries in the mtree file
-                    # when installing in parallel. Ignore those duplicates by default since it makes the output
-                    # rather noisy. There are also a few duplicate files (mostly in /etc), so suppress it for all
-                    # duplicates (in non-verbose mode) until the build system has been fixed
-                    if self.verbose and entry.attributes.get("type") != "dir":
-                        warning_message("Found duplicate definition for", entry.path)
-                self._mtree[key] = entry
+                self._add_parsed_entry(MtreeEntry.parse(line, contents_root))
             except Exception as e:
                 warning_message("Could not parse line", line, "in mtree file", file, ":", e)
 
+    def _add_parsed_entry(self, entry: MtreeEntry) -> None:
+        node = self._mtree._get_subtree(entry.path_parts, create=True)
+        assert node is not None
+        if node.entry is not None:
+            # Currently the FreeBSD build system can produce duplicate directory entries in the mtree file
+            # when installing in parallel. Ignore those duplicates by default since it makes the output
+            # rather noisy. There are also a few duplicate files (mostly in /etc), so suppress it for all
+            # duplicates (in non-verbose mode) until the build system has been fixed
+            if self.verbose and entry.attributes.get("type") != "dir":
+                warning_message("Found duplicate definition for", entry.path)
+        node.entry = entry
+
+    @staticmethod
+    def cache_path(file: Path, cache_dir: Path) -> Path:
+        # All METALOG files have one of a few names, so use a hash of the absolute path to tell them apart.
+        path_hash = hashlib.sha256(str(file.absolute()).encode("utf-8")).hexdigest()[:16]
+        return cache_dir / f"{file.name}-{path_hash}.cache"
+
+    def _load_with_cache(
+        self, file: Path, cache_dir: Path, *, append: bool, contents_root: "Optional[Path]"
+    ) -> None:
+        st = file.stat()
+        # The cache is only valid for exactly this file and contents root (relative contents= values are expanded).
+        cache_key = (self.CACHE_VERSION, st.st_size, st.st_mtime_ns, str(contents_root) if contents_root else "")
+        cache_file = self.cache_path(file, cache_dir)
+        cached = None
+        try:
+            with _gc_paused():
+                # marshal.load() reads the file in tiny chunks, reading the whole file first is a lot faster.
+                cached = marshal.loads(cache_file.read_bytes())
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+        if not isinstance(cached, tuple) or len(cached) != 2 or cached[0] != cache_key:
+            # Parse the file into an empty tree so that the cache only contains the entries from this file.
+            parsed = MtreeFile(verbose=self.verbose, file=file, contents_root=contents_root)
+            try:
+                cache_dir.mkdir(parents=True, exist_ok=True)
+                # Write to a unique temporary file and rename it since multiple disk images can be built at the same
+                # time (either by other cheribuild processes or by other threads when using --parallel-targets).
+                fd, tmp = tempfile.mkstemp(prefix=cache_file.name + ".", dir=str(cache_dir))
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        f.write(marshal.dumps((cache_key, parsed._mtree._serialize())))
+                    os.replace(tmp, str(cache_file))
+                except OSError:
+                    with contextlib.suppress(OSError):
+                        os.unlink(tmp)
+                    raise
+            except OSError as e:
+                warning_message("Could not save parsed mtree file to", cache_file, e)
+            if not append:
+                self._mtree = parsed._mtree
+                return
+            cached = (cache_key, parsed._mtree._serialize())
+        elif self.verbose:
+            status_update("Using cached entries for", file, "from", cache_file)
+        if not append:
+            self._mtree.clear()
+        with _gc_paused():
+            self._mtree._merge_serialized(cached[1], verbose=self.verbose)
+
     @staticmethod
     def _ensure_mtree_mode_fmt(mode: "Union[str, int]") -> str:
         if not isinstance(mode, str):
@@ -455,21 +635,26 @@ class MtreeFile:
         for glob in globs + exceptions:
             # glob must be anchored at the root (./) or start with a pattern
             assert glob[:2] == "./" or glob[:1] == "?" or glob[:1] == "*"
-        paths_to_remove = set()
-        for path, entry in self._mtree.items():
-            for glob in globs:
-                if fnmatch.fnmatch(path, glob):
-                    delete = True
-                    for exception in exceptions:
-                        if fnmatch.fnmatch(path, exception):
-                            delete = False
-                            break
-                    if delete:
-                        paths_to_remove.add(path)
-        for path in paths_to_remove:
+        if not globs:
+            return  # An empty regex would match (and therefore remove) everything
+        # Combine all patterns into a single regex instead of calling fnmatch() for every path and pattern.
+        glob_re = self._compile_globs(globs)
+        exceptions_re = self._compile_globs(exceptions) if exceptions else None
+        entries_to_remove = []
+        for parts, entry in self._mtree._iter_entries(()):
+            path = entry._path_str
+            if glob_re.match(path) and not (exceptions_re and exceptions_re.match(path)):
+                entries_to_remove.append((parts, path))
+        for parts, path in entries_to_remove:
             if print_status:
                 status_update("Deleting", path, "from mtree", file=sys.stderr)
-            self._mtree.pop(path)
+            node = self._mtree._get_subtree(parts, create=False)
+            assert node is not None
+            node.entry = None
+
+    @staticmethod
+    def _compile_globs(globs: "list[str]") -> "typing.Pattern[str]":
+        return re.compile("|".join(fnmatch.translate(glob) for glob in globs))
 
     def __repr__(self) -> str:
         import pprint
@@ -484,8 +669,9 @@ class MtreeFile:
                 self.write(f, pretend=pretend)
                 return
         output.write("#mtree 2.0\n")
-        for path in sorted(self._mtree.keys()):
-            output.write(str(self._mtree[path]))
+        # Sorting the path components gives the same order as sorting the MtreePath keys but is a lot faster.
+        for _, entry in sorted(self._mtree._iter_entries(()), key=lambda item: item[0]):
+            output.write(str(entry))
             output.write("\n")
         output.write("# END\n")
 
@@ -0,0 +1,148 @@
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import json
+import os
+import tempfile
+import threading
+import typing
+from pathlib import Path
+from typing import Optional, Union
+
+__all__ = ["PersistentProbeCache", "executable_fingerprint", "file_hash_cache", "probe_cache"]
+
+
+def executable_fingerprint(executable: "Union[str, Path]") -> "Optional[str]":
+    """
+    Identifies the current version of a program (its resolved path, size, modification time and inode), so that
+    cached results are invalidated automatically when it is reinstalled or rebuilt.
+    """
+    realpath = os.path.realpath(str(executable))
+    try:
+        st = os.stat(realpath)
+    except OSError:
+        return None
+    return f"{realpath}:{st.st_size}:{st.st_mtime_ns}:{st.st_ino}"
+
+
+class PersistentProbeCache:
+    """
+    A JSON file that stores the results of probing external programs (e.g. the compiler version, include directories
+    and supported flags) across cheribuild invocations. Results are grouped by namespace and by the fingerprint of the
+    program, so entries for outdated binaries are never used. The cache is disabled until configure() is called.
+    """
+
+    format_version = 1
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self.path: "Optional[Path]" = None
+        self.read_only = False
+        self._data: "Optional[dict[str, dict[str, dict[str, typing.Any]]]]" = None
+        self._lock = threading.Lock()  # Targets can be built in parallel
+
+    def configure(self, path: "Optional[Path]", *, read_only: bool = False) -> None:
+        with self._lock:
+            self.path = path
+            self.read_only = read_only
+            self._data = None
+
+    def _read_file(self) -> "dict[str, dict[str, dict[str, typing.Any]]]":
+        assert self.path is not None
+        try:
+            with self.path.open(encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict) and data.pop("version", None) == self.format_version:
+                return data
+        except (OSError, ValueError):
+            pass
+        return {}
+
+    def _namespace(self, namespace: str) -> "dict[str, dict[str, typing.Any]]":
+        if self._data is None:
+            self._data = self._read_file()
+        return self._data.setdefault(namespace, {})
+
+    def get(self, namespace: str, executable: "Union[str, Path]", key: str) -> "Optional[typing.Any]":
+        if self.path is None:
+            return None
+        fingerprint = executable_fingerprint(executable)
+        if fingerprint is None:
+            return None
+        with self._lock:
+            return self._namespace(namespace).get(fingerprint, {}).get(key)
+
+    def set(self, namespace: str, executable: "Union[str, Path]", key: str, value: typing.Any) -> None:
+        self.set_many(namespace, executable, {key: value})
+
+    def set_many(self, namespace: str, executable: "Union[str, Path]", values: "dict[str, typing.Any]") -> None:
+        self.update(namespace, {executable: values})
+
+    def update(
+        self, namespace: str, values_by_executable: "dict[Union[str, Path], dict[str, typing.Any]]"
+    ) -> None:
+        """Add the values for multiple executables (or files) while only rewriting the cache file once."""
+        if self.path is None:
+            return
+        new_entries: "dict[str, dict[str, typing.Any]]" = {}
+        for executable, values in values_by_executable.items():
+            fingerprint = executable_fingerprint(executable)
+            if fingerprint is not None and values:
+                new_entries.setdefault(fingerprint, {}).update(values)
+        if not new_entries:
+            return
+        with self._lock:
+            cached = self._namespace(namespace)
+            for fingerprint, values in new_entries.items():
+                cached.setdefault(fingerprint, {}).update(values)
+            if self.read_only:
+                return
+            # Merge with the current file contents since other cheribuild processes may have updated it.
+            data = self._read_file()
+            entries = data.setdefault(namespace, {})
+            new_realpaths = {fingerprint.rsplit(":", 3)[0] for fingerprint in new_entries}
+            for old in [k for k in entries if k not in new_entries and k.rsplit(":", 3)[0] in new_realpaths]:
+                del entries[old]  # Drop the results for previous versions of this executable.
+            for fingerprint, values in new_entries.items():
+                entries.setdefault(fingerprint, {}).update(values)
+            self._write_file(data)
+            self._data = data
+
+    def _write_file(self, data: "dict[str, typing.Any]") -> None:
+        assert self.path is not None
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(prefix=self.path.name, dir=str(self.path.parent))
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"version": self.format_version, **data}, f, sort_keys=True)
+            os.replace(tmp, str(self.path))
+        except OSError:
+            pass  # The cache is only an optimization
+
+
+# The global cache instances (configured by cheribuild's main() based on the --cache-tool-probes option).
+probe_cache = PersistentProbeCache("cheribuild-probe-cache.json")
+# The hashes of downloaded files and disk image inputs are stored separately since there can be many thousands of
+# them, and every write has to rewrite the whole file.
+file_hash_cache = PersistentProbeCache("cheribuild-file-hash-cache.json")
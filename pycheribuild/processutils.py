@@ -37,6 +37,7 @@ import functools
 import io
 import os
 import re
+import selectors
 import shlex
 import shutil
 import signal
@@ -44,12 +45,17 @@ import subprocess
 import sys
 import tempfile
 import termios
+import threading
+import time
 import typing
 from pathlib import Path
 from subprocess import CompletedProcess
 from typing import Callable, Iterable, Optional, Sequence, Union
 
 from .colour import AnsiColour, coloured
+from .probe_cache import probe_cache
+from .profiling import profiler
+from .resource_usage import resource_usage
 from .utils import ConfigBase, OSInfo, Type_T, fatal_error, status_update, warning_message
 
 __all__ = [
@@ -58,13 +64,17 @@ __all__ = [
     "cached_get_homebrew_prefix",
     "check_call_handle_noexec",
     "commandline_to_str",
+    "current_environ",
     "extract_version",
     "get_compiler_info",
     "get_program_version",
     "get_version_output",
+    "getenv",
     "is_debugger_attached",
     "keep_terminal_sane",
     "latest_system_clang_tool",
+    "multiplex_process_output",
+    "per_thread_environment",
     "popen",
     "popen_handle_noexec",
     "print_command",
@@ -77,7 +87,50 @@ __all__ = [
 def __filter_env(env: "dict[str, str]") -> "dict[str, str]":
     result: "dict[str, str]" = dict()
     for k, v in env.items():
-        if k not in os.environ or os.environ[k] != v:
+        if getenv(k) != v:
+            result[k] = v
+    return result
+
+
+# When building multiple targets at the same time (--parallel-targets or --pipeline-tests), set_env() must not modify
+# os.environ since that is shared by all threads. Instead, each thread records its changes and passes the resulting
+# environment to the commands that it starts.
+_thread_environ = threading.local()
+_per_thread_environ_enabled = False
+
+
+def _thread_env_overrides() -> "dict[str, Optional[str]]":
+    return getattr(_thread_environ, "overrides", {})
+
+
+@contextlib.contextmanager
+def per_thread_environment():
+    """Make set_env() only change the environment of the current thread (for commands started by processutils)."""
+    global _per_thread_environ_enabled  # noqa: PLW0603
+    old_value = _per_thread_environ_enabled
+    _per_thread_environ_enabled = True
+    try:
+        yield
+    finally:
+        _per_thread_environ_enabled = old_value
+
+
+def getenv(key: str, default: "Optional[str]" = None) -> "Optional[str]":
+    """Like os.getenv(), but also includes the changes made by set_env() in the current thread."""
+    overrides = _thread_env_overrides()
+    if key in overrides:
+        value = overrides[key]
+        return default if value is None else value
+    return os.environ.get(key, default)
+
+
+def current_environ() -> "dict[str, str]":
+    """Returns a copy of os.environ that includes the changes made by set_env() in the current thread."""
+    result = os.environ.copy()
+    for k, v in _thread_env_overrides().items():
+        if v is None:
+            result.pop(k, None)
+        else:
             result[k] = v
     return result
 
@@ -96,20 +149,29 @@ def set_env(*, print_verbose_only=True, config: ConfigBase, **environ):
 
     """
     changed_values: dict[str, Optional[str]] = dict()
+    old_overrides = _thread_env_overrides()
+    new_overrides = dict(old_overrides) if _per_thread_environ_enabled else None
     if environ:
         should_print_update = not print_verbose_only or config.verbose
         for k, v in environ.items():
             # make sure all environment variables are converted to string
             new_value = str(v)
-            old_value = os.getenv(k, None)
+            old_value = getenv(k, None)
             if should_print_update:
                 print_command("export", k + "=" + new_value, print_verbose_only=print_verbose_only, config=config)
             if new_value != old_value:
-                changed_values[k] = old_value
-                os.environ[k] = new_value
+                if new_overrides is not None:
+                    new_overrides[k] = new_value
+                else:
+                    changed_values[k] = old_value
+                    os.environ[k] = new_value
+    if new_overrides is not None:
+        _thread_environ.overrides = new_overrides
     try:
         yield
     finally:
+        if new_overrides is not None:
+            _thread_environ.overrides = old_overrides
         for var, prev_value in changed_values.items():
             if prev_value is None:
                 del os.environ[var]
@@ -220,6 +282,56 @@ def suppress_sigttou(suppress=True):
             signal.signal(signal.SIGTTOU, sighandler)
 
 
+def multiplex_process_output(
+    proc: subprocess.Popen,
+    *,
+    on_stdout: "Callable[[bytes], None]",
+    on_stderr: "Optional[Callable[[bytes], None]]" = None,
+    on_refresh: "Optional[Callable[[], None]]" = None,
+    refresh_interval: float = 0.1,
+    chunk_size: int = 256 * 1024,
+) -> None:
+    """
+    Read the stdout and stderr pipes of proc in a single event loop until both are closed.
+    The output is read in large chunks and the callbacks receive blocks of one or more complete lines (only the final
+    block may lack a trailing newline). on_refresh is called at most every refresh_interval seconds (and once at the
+    end), which allows batching expensive terminal updates instead of flushing after every line.
+    """
+    callbacks: "dict[int, Callable[[bytes], None]]" = {}
+    if proc.stdout is not None:
+        callbacks[proc.stdout.fileno()] = on_stdout
+    if proc.stderr is not None:
+        assert on_stderr is not None, "stderr is a pipe but no callback was provided"
+        callbacks[proc.stderr.fileno()] = on_stderr
+    partial_lines: "dict[int, bytes]" = {fd: b"" for fd in callbacks}
+    next_refresh = time.monotonic() + refresh_interval
+    with selectors.DefaultSelector() as selector:
+        for fd in callbacks:
+            selector.register(fd, selectors.EVENT_READ)
+        while selector.get_map():
+            timeout = max(0.0, next_refresh - time.monotonic()) if on_refresh is not None else None
+            for key, _ in selector.select(timeout):
+                fd = typing.cast(int, key.fd)
+                data = os.read(fd, chunk_size)
+                if not data:
+                    selector.unregister(fd)
+                    if partial_lines[fd]:
+                        callbacks[fd](partial_lines[fd])
+                        partial_lines[fd] = b""
+                    continue
+                end = data.rfind(b"\n")
+                if end == -1:
+                    partial_lines[fd] += data
+                    continue
+                callbacks[fd](partial_lines[fd] + data[: end + 1])
+                partial_lines[fd] = data[end + 1 :]
+            if on_refresh is not None and time.monotonic() >= next_refresh:
+                on_refresh()
+                next_refresh = time.monotonic() + refresh_interval
+    if on_refresh is not None:
+        on_refresh()
+
+
 @contextlib.contextmanager
 def keep_terminal_sane(gave_tty_control=False, command: "Optional[Sequence[str | Path]]" = None):
     # Programs such as QEMU can change the terminal state and if they don't exit cleanly this state is
@@ -307,15 +419,80 @@ def _make_called_process_error(retcode, args, *, stdout=None, stderr=None, cwd=N
     return err
 
 
+class _ThreadEnvPopen(subprocess.Popen):
+    """A Popen that uses the environment of the current thread (see per_thread_environment()) if env is not given."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        if kwargs.get("env") is None and _thread_env_overrides():
+            kwargs["env"] = current_environ()
+        super().__init__(*args, **kwargs)
+
+
+class _ResourceTrackingPopen(_ThreadEnvPopen):
+    """A Popen that reaps the child using os.wait4() to record its resource usage (CPU time, peak RSS, I/O)."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        self._start_time = time.perf_counter()
+        super().__init__(*args, **kwargs)
+
+    def _reap(self, wait_flags: int) -> None:
+        """Reap the child using os.wait4() and record its resource usage (sets self.returncode if it has exited)."""
+        try:
+            pid, sts, rusage = os.wait4(self.pid, wait_flags)
+        except ChildProcessError:
+            # Already reaped elsewhere or SIGCHLD is ignored: let Popen handle it (the usage can't be recorded).
+            return
+        if pid != self.pid:
+            return
+        self.returncode = -os.WTERMSIG(sts) if os.WIFSIGNALED(sts) else os.WEXITSTATUS(sts)
+        resource_usage.record(
+            commandline_to_str(self.args) if isinstance(self.args, (list, tuple)) else str(self.args),
+            rusage,
+            wall_time=time.perf_counter() - self._start_time,
+            exit_code=self.returncode,
+        )
+
+    def poll(self) -> Optional[int]:
+        if self.returncode is None:
+            self._reap(os.WNOHANG)
+        return super().poll()
+
+    # Popen.communicate() and Popen.__exit__() also use this method to wait for the process.
+    def wait(self, timeout: Optional[float] = None) -> int:
+        # Waits with a timeout use the normal Popen implementation, so a process that exits during such a wait is not
+        # recorded. All commands run by cheribuild itself are waited for without a timeout.
+        if self.returncode is None and timeout is None:
+            self._reap(0)
+        return super().wait(timeout)
+
+
+def _popen(cmdline: "Sequence[str | Path]", **kwargs) -> subprocess.Popen:
+    popen_cls = _ResourceTrackingPopen if resource_usage.enabled else _ThreadEnvPopen
+    return popen_cls(cmdline, **kwargs)
+
+
+def _check_call(cmdline: "Sequence[str | Path]", **kwargs) -> int:
+    # Like subprocess.check_call() but records the resource usage of the command (if enabled).
+    with _popen(cmdline, **kwargs) as p:
+        try:
+            retcode = p.wait()
+        except BaseException:
+            p.kill()
+            raise
+    if retcode:
+        raise subprocess.CalledProcessError(retcode, cmdline)
+    return 0
+
+
 def check_call_handle_noexec(cmdline: "Sequence[str | Path]", **kwargs):
     try:
         with keep_terminal_sane(command=cmdline):
-            return subprocess.check_call(cmdline, **kwargs)
+            return _check_call(cmdline, **kwargs)
     except PermissionError as e:
         interpreter = get_interpreter(cmdline)
         if interpreter is not None:
             with keep_terminal_sane(command=cmdline):
-                return subprocess.check_call([*interpreter, *cmdline], **kwargs)
+                return _check_call([*interpreter, *cmdline], **kwargs)
         raise _make_called_process_error(
             e.errno, cmdline, cwd=kwargs.get("cwd", None), stderr=str(e).encode("utf-8")
         ) from e
@@ -327,11 +504,11 @@ def check_call_handle_noexec(cmdline: "Sequence[str | Path]", **kwargs):
 
 def popen_handle_noexec(cmdline: "Sequence[str | Path]", **kwargs) -> subprocess.Popen:
     try:
-        return subprocess.Popen(cmdline, **kwargs)
+        return _popen(cmdline, **kwargs)
     except PermissionError as e:
         interpreter = get_interpreter(cmdline)
         if interpreter is not None:
-            return subprocess.Popen([*interpreter, *cmdline], **kwargs)
+            return _popen([*interpreter, *cmdline], **kwargs)
         raise _make_called_process_error(
             e.errno, cmdline, cwd=kwargs.get("cwd", None), stderr=str(e).encode("utf-8")
         ) from e
@@ -461,7 +638,7 @@ def run_command(
     if env is not None:
         env_arg: "dict[str, str]" = {k: str(v) for k, v in env.items()}  # make sure everything is a string
         if not replace_env:
-            new_env = os.environ.copy()
+            new_env = current_environ()
             new_env.update(env_arg)
             env_arg = new_env
         kwargs["env"] = env_arg
@@ -548,8 +725,8 @@ class CompilerInfo:
         self.default_target = default_target
         self.config = config
         self._resource_dir: "Optional[Path]" = None
-        self._supported_warning_flags: "dict[str, bool]" = {}
-        self._supported_sanitizer_flags: "dict[tuple[str, tuple[str, ...]], bool]" = {}
+        # Maps the base flags used for probing to the results for each candidate flag
+        self._supported_flags: "dict[tuple[str, ...], dict[str, bool]]" = {}
         self._include_dirs: "dict[tuple[str, ...], list[Path]]" = {}
         assert compiler in ("unknown compiler", "clang", "apple-clang", "gcc"), "unknown type: " + compiler
 
@@ -558,6 +735,10 @@ class CompilerInfo:
         if not self._resource_dir:
             if not self.path.exists():
                 return Path("/unknown/resource/dir")  # avoid failing in jenkins
+            cached = probe_cache.get("compiler-info", self.path, "resource-dir")
+            if cached is not None:
+                self._resource_dir = Path(cached)
+                return self._resource_dir
             # Clang 5.0 added the -print-resource-dir flag
             if self.is_clang and self.version >= (5, 0):
                 resource_dir = (
@@ -590,27 +771,49 @@ class CompilerInfo:
                 match = re.compile(rb'"-cc1".+"-resource-dir" "([^"]+)"').search(cc1_cmd.stderr)
                 assert match is not None, f"Could not find -resource dir in {cc1_cmd.stderr}"
                 self._resource_dir = Path(match.group(1).decode("utf-8"))
+            probe_cache.set("compiler-info", self.path, "resource-dir", str(self._resource_dir))
         return self._resource_dir
 
+    @staticmethod
+    def _include_dirs_cache_key(basic_flags: "list[str]") -> str:
+        # Directories that don't exist are not included in the search list, so we have to re-probe if the sysroot
+        # was (re)created since the result was cached.
+        sysroots = [f[len("--sysroot=") :] for f in basic_flags if f.startswith("--sysroot=")]
+        sysroots += [basic_flags[i + 1] for i, f in enumerate(basic_flags[:-1]) if f in ("--sysroot", "-isysroot")]
+        stamps = []
+        for sysroot in sysroots:
+            try:
+                stamps.append(str(os.stat(sysroot).st_mtime_ns))
+            except OSError:
+                stamps.append("missing")
+        return "include-dirs\0" + "\0".join([*basic_flags, *stamps])
+
     def get_include_dirs(self, basic_flags: "list[str]") -> "list[Path]":
         include_dirs = self._include_dirs.get(tuple(basic_flags), None)
         if include_dirs is None:
             if not self.path.exists():
                 return [Path("/unknown/include/dir")]  # avoid failing in jenkins
+            cache_key = self._include_dirs_cache_key(basic_flags)
+            cached = probe_cache.get("compiler-info", self.path, cache_key)
+            if cached:
+                include_dirs = [Path(d) for d in cached]
+                self._include_dirs[tuple(basic_flags)] = include_dirs
+                return list(include_dirs)
             # pretend to compile an existing source file and capture the -resource-dir output
-            output = run_command(
-                self.path,
-                "-E",
-                "-Wp,-v",
-                "-xc",
-                "/dev/null",
-                *basic_flags,
-                config=self.config,
-                stdout=subprocess.DEVNULL,
-                capture_error=True,
-                print_verbose_only=True,
-                run_in_pretend_mode=True,
-            ).stderr
+            with profiler.phase("include dirs", "compiler probe", compiler=str(self.path)):
+                output = run_command(
+                    self.path,
+                    "-E",
+                    "-Wp,-v",
+                    "-xc",
+                    "/dev/null",
+                    *basic_flags,
+                    config=self.config,
+                    stdout=subprocess.DEVNULL,
+                    capture_error=True,
+                    print_verbose_only=True,
+                    run_in_pretend_mode=True,
+                ).stderr
             found_start = False
             include_dirs = []
             for line in io.BytesIO(output).readlines():
@@ -627,44 +830,112 @@ class CompilerInfo:
             if self.config.verbose:
                 print("Include paths for", self.path, basic_flags, "are", include_dirs)
             self._include_dirs[tuple(basic_flags)] = include_dirs
+            if include_dirs:
+                probe_cache.set("compiler-info", self.path, cache_key, [str(d) for d in include_dirs])
         return list(include_dirs)
 
-    def _supports_flag(self, flag: str, other_args: "list[str]") -> bool:
+    # Diagnostics that name a rejected command line flag (probes are run with LC_ALL=C to avoid localized quotes).
+    _rejected_flag_re = re.compile(
+        rb"(?:unknown warning option|unknown argument:?|unrecognized command[- ]line option|unsupported option)"
+        rb" '([^']+)'"
+    )
+
+    def _run_flag_probe(self, flags: "list[str]", other_args: "list[str]") -> "tuple[bool, set[str]]":
+        """Returns whether the compiler accepted all flags and the flags it reported as unknown/unsupported."""
         try:
-            if not self.path.exists():
-                return False  # avoid failing in jenkins
-            result = run_command(
-                self.path,
-                *other_args,
-                flag,
-                print_verbose_only=True,
-                run_in_pretend_mode=True,
-                capture_error=True,
-                allow_unexpected_returncode=True,
-                config=self.config,
-            )
+            with profiler.phase("supports flag", "compiler probe", compiler=str(self.path), flag=" ".join(flags)):
+                result = run_command(
+                    self.path,
+                    *other_args,
+                    *flags,
+                    print_verbose_only=True,
+                    run_in_pretend_mode=True,
+                    capture_error=True,
+                    allow_unexpected_returncode=True,
+                    config=self.config,
+                    env={"LC_ALL": "C"},
+                )
         except (subprocess.CalledProcessError, OSError) as e:
-            warning_message("Failed to check for", flag, "support:", e)
-            return False
-        return result.returncode == 0
-
-    def supports_sanitizer_flag(self, sanitzer_flag: str, arch_flags: "list[str]"):
-        result = self._supported_sanitizer_flags.get((sanitzer_flag, tuple(*arch_flags)))
-        if result is None:
-            assert sanitzer_flag.startswith("-fsanitize")
-            result = self._supports_flag(
-                sanitzer_flag, [*arch_flags, "-c", "-xc", "/dev/null", "-Werror", "-o", "/dev/null"]
+            warning_message("Failed to check for", " ".join(flags), "support:", e)
+            return False, set(flags)
+        if result.returncode == 0:
+            return True, set()
+        return False, {m.group(1).decode("utf-8") for m in self._rejected_flag_re.finditer(result.stderr)}
+
+    def _probe_flags(self, flags: "list[str]", other_args: "list[str]", results: "dict[str, bool]") -> None:
+        # Try all flags at once, then drop the ones that the compiler reported as unknown. If the compiler failed
+        # without telling us which flag was the problem, bisect the remaining flags.
+        while flags:
+            success, rejected = self._run_flag_probe(flags, other_args)
+            if success:
+                results.update((flag, True) for flag in flags)
+                return
+            if rejected.intersection(other_args):
+                # The base flags are invalid (e.g. -Werror=unknown-warning-option for GCC), so all probes will fail.
+                results.update((flag, False) for flag in flags)
+                return
+            rejected.intersection_update(flags)
+            if rejected:
+                results.update((flag, False) for flag in rejected)
+                flags = [flag for flag in flags if flag not in rejected]
+                continue
+            if len(flags) == 1:
+                results[flags[0]] = False
+                return
+            middle = len(flags) // 2
+            self._probe_flags(flags[:middle], other_args, results)
+            self._probe_flags(flags[middle:], other_args, results)
+            return
+
+    def _supported_flags_subset(self, flags: "typing.Iterable[str]", other_args: "list[str]") -> "set[str]":
+        """
+        Return the subset of flags that the compiler accepts (when added to other_args). All flags that have not been
+        checked before are tested using as few compiler invocations as possible and the results are cached per
+        (compiler, other_args) both in memory and in the persistent probe cache.
+        """
+        flags = list(dict.fromkeys(flags))
+        if not self.path.exists():
+            return set()  # avoid failing in jenkins
+        known = self._supported_flags.setdefault(tuple(other_args), {})
+        cache_prefix = "supports-flag\0" + "".join(arg + "\0" for arg in other_args)
+        unknown = []
+        for flag in flags:
+            if flag not in known:
+                cached = probe_cache.get("compiler-info", self.path, cache_prefix + flag)
+                if cached is None:
+                    unknown.append(flag)
+                else:
+                    known[flag] = cached
+        if unknown:
+            new_results: "dict[str, bool]" = {}
+            self._probe_flags(unknown, other_args, new_results)
+            known.update(new_results)
+            probe_cache.set_many(
+                "compiler-info", self.path, {cache_prefix + flag: value for flag, value in new_results.items()}
             )
-            self._supported_sanitizer_flags[sanitzer_flag, tuple(*arch_flags)] = result
-        return result
+        return {flag for flag in flags if known[flag]}
+
+    def supported_sanitizer_flags(
+        self, sanitizer_flags: "typing.Iterable[str]", arch_flags: "list[str]"
+    ) -> "set[str]":
+        sanitizer_flags = list(sanitizer_flags)
+        assert all(flag.startswith("-fsanitize") for flag in sanitizer_flags), sanitizer_flags
+        return self._supported_flags_subset(
+            sanitizer_flags, [*arch_flags, "-c", "-xc", "/dev/null", "-Werror", "-o", "/dev/null"]
+        )
+
+    def supports_sanitizer_flag(self, sanitzer_flag: str, arch_flags: "list[str]") -> bool:
+        return sanitzer_flag in self.supported_sanitizer_flags([sanitzer_flag], arch_flags)
+
+    def supported_warning_flags(self, flags: "typing.Iterable[str]") -> "set[str]":
+        flags = list(flags)
+        assert all(flag.startswith("-W") for flag in flags), flags
+        return self._supported_flags_subset(
+            flags, ["-fsyntax-only", "-xc", "/dev/null", "-Werror=unknown-warning-option"]
+        )
 
     def supports_warning_flag(self, flag: str) -> bool:
-        result = self._supported_warning_flags.get(flag)
-        if result is None:
-            assert flag.startswith("-W")
-            result = self._supports_flag(flag, ["-fsyntax-only", "-xc", "/dev/null", "-Werror=unknown-warning-option"])
-            self._supported_warning_flags[flag] = result
-        return result
+        return flag in self.supported_warning_flags([flag])
 
     # noinspection PyPep8Naming
     def supports_Og_flag(self) -> bool:  # noqa: N802
@@ -776,6 +1047,12 @@ def get_compiler_info(compiler: "Union[str, Path]", *, config: ConfigBase) -> Co
             _cached_compiler_infos[compiler] = _cached_compiler_infos[compiler_realpath]
         compiler = compiler_realpath
     if compiler not in _cached_compiler_infos:
+        cached = probe_cache.get("compiler-info", compiler, "version")
+        if cached is not None:
+            kind, version_list, version_str, target_string = cached
+            result = CompilerInfo(compiler, kind, tuple(version_list), version_str, target_string, config=config)
+            _cached_compiler_infos[compiler] = result
+            return result
         clang_version_pattern = re.compile(rb"clang version (\d+)\.(\d+)\.?(\d+)?")
         gcc_version_pattern = re.compile(rb"gcc version (\d+)\.(\d+)\.?(\d+)?")
         apple_llvm_version_pattern = re.compile(rb"Apple (?:clang|LLVM) version (\d+)\.(\d+)\.?(\d+)?")
@@ -786,16 +1063,17 @@ def get_compiler_info(compiler: "Union[str, Path]", *, config: ConfigBase) -> Co
         try:
             # Use -v instead of --version to support both gcc and clang
             # Note: for clang-cpp/cpp we need to have stdin as devnull
-            version_cmd = run_command(
-                compiler,
-                "-v",
-                capture_error=True,
-                print_verbose_only=True,
-                run_in_pretend_mode=True,
-                config=config,
-                stdin=subprocess.DEVNULL,
-                capture_output=True,
-            )
+            with profiler.phase("version", "compiler probe", compiler=str(compiler)):
+                version_cmd = run_command(
+                    compiler,
+                    "-v",
+                    capture_error=True,
+                    print_verbose_only=True,
+                    run_in_pretend_mode=True,
+                    config=config,
+                    stdin=subprocess.DEVNULL,
+                    capture_output=True,
+                )
         except subprocess.CalledProcessError as e:
             stderr = e.stderr if e.stderr else b"FAILED: " + str(e).encode("utf-8")
             version_cmd = CompletedProcess(e.cmd, e.returncode, e.output, stderr)
@@ -829,6 +1107,7 @@ def get_compiler_info(compiler: "Union[str, Path]", *, config: ConfigBase) -> Co
         # Don't cache the result if the -v command failed (e.g. compiler doesn't exist yet)
         if executed_sucessfully:
             _cached_compiler_infos[compiler] = result
+            probe_cache.set("compiler-info", compiler, "version", [kind, list(version), version_str, target_string])
         return result
     return _cached_compiler_infos[compiler]
 
@@ -866,8 +1145,16 @@ def cached_get_homebrew_prefix(package: "Optional[str]", config: ConfigBase) ->
 def get_version_output(program: Path, command_args: "Optional[Iterable[str]]" = None, *, config: ConfigBase) -> "bytes":
     if command_args is None:
         command_args = ["--version"]
+    command_args = list(command_args)
     if program == Path():
         raise ValueError("Empty path?")
+    # The output is cached across runs (keyed by the executable's fingerprint, so updating the program invalidates it).
+    executable = str(program) if program.is_absolute() else shutil.which(str(program), path=getenv("PATH"))
+    cache_key = "\0".join(command_args)
+    if executable is not None:
+        cached = probe_cache.get("version-output", executable, cache_key)
+        if cached is not None:
+            return cached.encode("utf-8", errors="surrogateescape")
     prog = run_command(
         [str(program), *command_args],
         config=config,
@@ -877,6 +1164,8 @@ def get_version_output(program: Path, command_args: "Optional[Iterable[str]]" =
         run_in_pretend_mode=True,
         raise_in_pretend_mode=True,
     )
+    if executable is not None:
+        probe_cache.set("version-output", executable, cache_key, prog.stdout.decode("utf-8", errors="surrogateescape"))
     return prog.stdout
 
 
@@ -0,0 +1,159 @@
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import contextlib
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+import typing
+from pathlib import Path
+from typing import Optional
+
+__all__ = ["ProfileEvent", "Profiler", "profile_run", "profiler"]
+
+
+class ProfileEvent(typing.NamedTuple):
+    name: str
+    category: str
+    start: float  # Seconds since the profiler was created
+    wall: float
+    cpu: float  # CPU time used by the thread that ran the phase (excluding any child processes)
+    thread: int
+    args: "dict[str, str]"
+
+
+class Profiler:
+    """
+    Records the wall-clock and CPU time spent in cheribuild's own phases (config loading, option registration,
+    dependency resolution, project setup, etc.). Nothing is recorded until start() has been called.
+    """
+
+    def __init__(self) -> None:
+        self.origin = time.perf_counter()
+        self.events: "list[ProfileEvent]" = []
+        self.enabled = False
+        self.cprofile: "Optional[cProfile.Profile]" = None
+
+    def start(self, *, use_cprofile: bool) -> None:
+        """Start recording events (and if use_cprofile is set, also start cProfile for the current thread)."""
+        self.enabled = True
+        if use_cprofile and self.cprofile is None:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    @contextlib.contextmanager
+    def phase(self, name: str, category: str = "cheribuild", **args: str) -> "typing.Iterator[None]":
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            # list.append() is atomic, so no locking is needed when building targets in parallel.
+            self.events.append(
+                ProfileEvent(
+                    name,
+                    category,
+                    start - self.origin,
+                    time.perf_counter() - start,
+                    time.thread_time() - cpu_start,
+                    threading.get_native_id(),
+                    args,
+                )
+            )
+
+    def chrome_trace(self) -> "dict[str, typing.Any]":
+        """The recorded events in the Chrome trace event format (can be loaded in chrome://tracing or Perfetto)."""
+        pid = os.getpid()
+        trace_events = [
+            {
+                "name": f"{e.args['target']}: {e.name}" if "target" in e.args else e.name,
+                "cat": e.category,
+                "ph": "X",
+                "ts": round(e.start * 1e6),
+                "dur": round(e.wall * 1e6),
+                "pid": pid,
+                "tid": e.thread,
+                "args": {**e.args, "cpu_ms": round(e.cpu * 1000, 3)},
+            }
+            for e in self.events
+        ]
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.chrome_trace()), encoding="utf-8")
+
+    def format_summary(self, limit: int = 30) -> str:
+        """A flat table of the total (inclusive) time spent in each kind of phase, most expensive first."""
+        totals: "dict[tuple[str, str], list[float]]" = {}
+        for e in self.events:
+            total = totals.setdefault((e.category, e.name), [0, 0.0, 0.0])
+            total[0] += 1
+            total[1] += e.wall
+            total[2] += e.cpu
+        rows = [["Phase", "Calls", "Wall", "CPU"]]
+        for (category, name), (calls, wall, cpu) in sorted(totals.items(), key=lambda kv: -kv[1][1])[:limit]:
+            rows.append([f"{category}: {name}", str(int(calls)), f"{wall:.3f}s", f"{cpu:.3f}s"])
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        lines = [
+            "  ".join(cell.ljust(widths[i]) if i == 0 else cell.rjust(widths[i]) for i, cell in enumerate(row)).rstrip()
+            for row in rows
+        ]
+        lines.append(f"Total runtime: {time.perf_counter() - self.origin:.3f}s")
+        return "\n".join(lines)
+
+
+# The global profiler instance that is used by all of cheribuild.
+profiler = Profiler()
+
+
+@contextlib.contextmanager
+def profile_run(output_prefix: Path, *, use_cprofile: bool) -> "typing.Iterator[None]":
+    """
+    Write the events recorded by the global profiler to <output_prefix>.trace.json and print a summary once the
+    body exits. If use_cprofile is set, cheribuild is also run under cProfile and the stats are saved to
+    <output_prefix>.prof (which can be viewed with e.g. snakeviz).
+    Profiling will normally have been started before parsing the command line, otherwise it is started here.
+    """
+    profiler.start(use_cprofile=use_cprofile)
+    try:
+        yield
+    finally:
+        cprofile = profiler.cprofile
+        if cprofile is not None:
+            cprofile.disable()
+        trace_path = output_prefix.with_name(output_prefix.name + ".trace.json")
+        profiler.write_chrome_trace(trace_path)
+        print(profiler.format_summary(), file=sys.stderr)
+        print("Chrome trace of cheribuild's internal phases written to", trace_path, file=sys.stderr)
+        if cprofile is not None:
+            prof_path = output_prefix.with_name(output_prefix.name + ".prof")
+            cprofile.dump_stats(str(prof_path))
+            print("cProfile statistics written to", prof_path, file=sys.stderr)
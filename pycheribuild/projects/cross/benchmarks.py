@@ -123,7 +123,7 @@ class BuildMibench(BenchmarkMixin, CrossCompileProject):
 
     def _create_benchmark_dir(self, bench_dir: Path, *, keep_both_sizes: bool):
         self.makedirs(bench_dir)
-        self.run_cmd("cp", "-av", self.bundle_dir, bench_dir, cwd=self.build_dir)
+        self.copy_directory(self.bundle_dir, bench_dir / self.bundle_dir.name, symlinks=True, dirs_exist_ok=True)
         # Remove all the .dump files from the tarball
         if self.config.verbose:
             self.run_cmd("find", bench_dir, "-name", "*.dump", "-print")
@@ -290,13 +290,11 @@ class BuildOlden(BenchmarkMixin, CrossCompileProject):
         if is_jenkins_build():
             self._create_benchmark_dir(self.install_dir)
         else:
-            # Note: no trailing slash to ensure bin/ subdir exists
-            self.run_cmd("cp", "-av", self.source_dir / "bin", self.install_dir, cwd=self.build_dir)
+            self.copy_directory(self.source_dir / "bin", self.install_dir / "bin", symlinks=True, dirs_exist_ok=True)
 
     def _create_benchmark_dir(self, bench_dir: Path):
         self.makedirs(bench_dir)
-        # Note: no trailing slash to ensure bin/ subdir exists
-        self.run_cmd("cp", "-av", self.source_dir / "bin", bench_dir, cwd=self.build_dir)
+        self.copy_directory(self.source_dir / "bin", bench_dir / "bin", symlinks=True, dirs_exist_ok=True)
         # Remove all the .dump files from the tarball
         self.run_cmd("find", bench_dir, "-name", "*.dump", "-delete")
         self.run_cmd("du", "-sh", bench_dir)
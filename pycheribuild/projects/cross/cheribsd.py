@@ -59,12 +59,13 @@ from ..simple_project import (
     SimpleProject,
     TargetAliasWithDependencies,
     _clear_line_sequence,
-    flush_stdio,
 )
 from ...config.compilation_targets import CompilationTargets, FreeBSDTargetInfo
 from ...config.loader import ConfigOptionHandle
 from ...config.target_info import AutoVarInit, CompilerType, CrossCompileTarget
-from ...processutils import latest_system_clang_tool, print_command
+from ...filesystemutils import file_copy_engine
+from ...mtree import MtreePath
+from ...processutils import getenv, latest_system_clang_tool, print_command
 from ...utils import OSInfo, ThreadJoiner, is_jenkins_build
 
 
@@ -890,10 +891,12 @@ class BuildFreeBSD(BuildFreeBSDBase):
 
     def _stdout_filter(self, line: bytes) -> None:
         if line.startswith(b">>> "):  # major status update
+            if self._pending_progress_line is not None:
+                self._pending_progress_line = None
             if self._last_stdout_line_can_be_overwritten:
                 sys.stdout.buffer.write(_clear_line_sequence)
             sys.stdout.buffer.write(line)
-            flush_stdio(sys.stdout)
+            self._flush_stdout()
             self._last_stdout_line_can_be_overwritten = False
         elif line.startswith(b"===> "):  # new subdirectory
             self._line_not_important_stdout_filter(line)
@@ -1441,53 +1444,97 @@ class BuildFreeBSD(BuildFreeBSDBase):
         # contents of contrib/bmake/VERSION
         return make_cmd
 
-    def _query_make_var(self, args, var) -> Optional[Path]:
+    # Every query has to parse all of the FreeBSD make infrastructure, so the paths that are derived from the build
+    # configuration are fetched in a single bmake invocation and cached for the rest of the run.
+    _buildenv_make_vars: "tuple[str, ...]" = (".OBJDIR", "KRNLOBJDIR")
+    _make_var_cache: "ClassVar[dict[tuple[typing.Any, ...], dict[str, Optional[Path]]]]" = {}
+
+    def _query_make_vars(self, args: MakeOptions, variables: "typing.Sequence[str]") -> "dict[str, Optional[Path]]":
+        """Returns the values of the (path) variables in the buildworld environment described by args."""
+        result: "dict[str, Optional[Path]]" = dict.fromkeys(variables)
+        try:
+            bmake_binary = self.find_real_bmake_binary()
+        except FileNotFoundError:
+            self.verbose_print("Cannot query buildenv path if bmake hasn't been bootstrapped")
+            return result
+        if not self.source_dir.exists():
+            assert self.config.pretend, "This should only happen when running in a test environment"
+            return result
+        query_args = args.copy()
+        query_args.set_command(bmake_binary)
+        make_args = [
+            *query_args.all_commandline_args(self.config),
+            "BUILD_WITH_STRICT_TMPPATH=0",
+            "-f",
+            self.source_dir / "Makefile.inc1",
+            "-m",
+            self.source_dir / "share/mk",
+            "showconfig",
+            "-D_NO_INCLUDE_COMPILERMK",  # avoid calling ${CC} --version
+        ]
+        fingerprint = (
+            str(bmake_binary),
+            str(self.source_dir),
+            tuple(map(str, make_args)),
+            tuple(sorted(query_args.env_vars.items())),
+        )
+        cached = self._make_var_cache.setdefault(fingerprint, {})
+        missing = [var for var in variables if var not in cached]
+        if missing:
+            values = self.__run_make_var_query(bmake_binary, make_args, query_args.env_vars, missing)
+            if values is not None:  # Don't cache failed queries, they will be retried next time.
+                cached.update(values)
+        result.update((var, cached.get(var)) for var in variables)
+        return result
+
+    def __run_make_var_query(
+        self, bmake_binary: Path, make_args: "list[str | Path]", env: "dict[str, str]", variables: "list[str]"
+    ) -> "Optional[dict[str, Optional[Path]]]":
+        """Returns the values of variables (None for values that are not absolute paths) or None on failure."""
+        result: "dict[str, Optional[Path]]" = dict.fromkeys(variables)
+        var_args: "list[str]" = []
+        for var in variables:
+            var_args.extend(["-V", var])
         try:
-            try:
-                bmake_binary = self.find_real_bmake_binary()
-            except FileNotFoundError:
-                self.verbose_print("Cannot query buildenv path if bmake hasn't been bootstrapped")
-                return None
-            query_args = args.copy()
-            query_args.set_command(bmake_binary)
-            bw_flags = [
-                *query_args.all_commandline_args(self.config),
-                "BUILD_WITH_STRICT_TMPPATH=0",
-                "-f",
-                self.source_dir / "Makefile.inc1",
-                "-m",
-                self.source_dir / "share/mk",
-                "showconfig",
-                "-D_NO_INCLUDE_COMPILERMK",  # avoid calling ${CC} --version
-                "-V",
-                var,
-            ]
-            if not self.source_dir.exists():
-                assert self.config.pretend, "This should only happen when running in a test environment"
-                return None
             # https://github.com/freebsd/freebsd/commit/1edb3ba87657e28b017dffbdc3d0b3a32999d933
             cmd = self.run_cmd(
-                [bmake_binary, *bw_flags],
-                env=query_args.env_vars,
+                [bmake_binary, *make_args, *var_args],
+                env=env,
                 cwd=self.source_dir,
                 run_in_pretend_mode=True,
                 capture_output=True,
                 print_verbose_only=True,
             )
-            lines = cmd.stdout.strip().split(b"\n")
-            last_line = lines[-1].decode("utf-8").strip()
-            if last_line.startswith("/") and cmd.returncode == 0:
-                self.verbose_print("BUILDENV var", var, "was", last_line)
-                return Path(last_line)
-            self.warning("Failed to query", var, "-- output was:", lines)
-            return None
         except subprocess.CalledProcessError as e:
-            self.warning("Could not query make variable", var, "for buildworld root objdir: ", e)
+            self.warning("Could not query make variables", variables, "for buildworld root objdir: ", e)
+            return None
+        # bmake prints one line per -V flag (in order) after any other output. Only remove the final newline since
+        # empty variables result in empty lines.
+        lines = cmd.stdout.split(b"\n")
+        if lines[-1] == b"":
+            del lines[-1]
+        if cmd.returncode != 0 or len(lines) < len(variables):
+            self.warning("Failed to query", variables, "-- output was:", lines)
             return None
+        for var, line in zip(variables, lines[-len(variables) :]):
+            value = line.decode("utf-8").strip()
+            if value.startswith("/"):
+                self.verbose_print("BUILDENV var", var, "was", value)
+                result[var] = Path(value)
+            else:
+                self.verbose_print("Failed to query", var, "-- value was:", value)
+        return result
+
+    def _query_make_var(self, args: MakeOptions, var: str) -> Optional[Path]:
+        return self._query_make_vars(args, [var])[var]
+
+    def _query_buildenv_path(self, var: str) -> Optional[Path]:
+        assert var in self._buildenv_make_vars, var
+        return self._query_make_vars(self.buildworld_args, self._buildenv_make_vars)[var]
 
     @cached_property
     def objdir(self) -> Path:
-        result = self._query_make_var(self.buildworld_args, ".OBJDIR")
+        result = self._query_buildenv_path(".OBJDIR")
         if result is None:
             result = Path()
         if self.realpath(result) == self.realpath(self.source_dir):
@@ -1502,7 +1549,7 @@ class BuildFreeBSD(BuildFreeBSDBase):
         return result
 
     def kernel_objdir(self, config) -> Optional[Path]:
-        result = self.objdir / "sys"
+        result = self._query_buildenv_path("KRNLOBJDIR") or self.objdir / "sys"
         if result.exists():
             return Path(result) / config
         self.warning("Could not infer buildkernel objdir")
@@ -2280,7 +2327,7 @@ class BuildFreeBSDReleaseMixin(ReleaseMixinBase):
             self.objdir / "tmp/obj-tools/usr.sbin/makefs",
         ]
         release_args.set_env(
-            PATH=":".join(map(str, extra_path_entries)) + ":" + release_args.env_vars.get("PATH", os.getenv("PATH", ""))
+            PATH=":".join(map(str, extra_path_entries)) + ":" + release_args.env_vars.get("PATH", getenv("PATH", ""))
         )
 
         # DESTDIR for install target is where to install the media, as you'd
@@ -2332,16 +2379,26 @@ class BuildCheriBsdSysrootArchive(SimpleProject):
     def dependencies(cls, _: CheriConfig) -> "tuple[str, ...]":
         return (cls.rootfs_source_class.target,)
 
+    # The parts of the rootfs (as listed in METALOG.world) that are copied to the sysroot
+    sysroot_paths: "ClassVar[tuple[str, ...]]" = (
+        "./lib",
+        "./usr/include",
+        "./usr/lib",
+        "./usr/libdata",
+        "./usr/lib32",
+        "./usr/lib64",
+        "./usr/lib64c",
+        "./usr/lib64cb",
+        "./usr/lib128",
+        "./usr/lib128g",
+    )
+
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
-        # GNU tar doesn't accept --include (and doesn't handle METALOG). bsdtar appears to be available
-        # on FreeBSD and macOS by default. On Linux it is not always installed by default.
-        self.bsdtar_cmd = "bsdtar"
         self.install_dir = self.target_info.sdk_root_dir
 
     def check_system_dependencies(self) -> None:
         super().check_system_dependencies()
-        self.check_required_system_tool("bsdtar", cheribuild_target="bsdtar", apt="libarchive-tools")
         if (
             not OSInfo.IS_FREEBSD
             and not self.remote_path
@@ -2385,28 +2442,6 @@ class BuildCheriBsdSysrootArchive(SimpleProject):
     def create_sysroot(self) -> None:
         # we need to add include files and libraries to the sysroot directory
         self.makedirs(self.cross_sysroot_path / "usr")
-        # use tar+untar to copy all necessary files listed in metalog to the sysroot dir
-        # Since we are using the metalog argument we need to use BSD tar and not GNU tar!
-        bsdtar_path = shutil.which(str(self.bsdtar_cmd))
-        if not bsdtar_path:
-            bsdtar_path = str(self.bsdtar_cmd)
-        tar_cmd = [
-            bsdtar_path,
-            "cf",
-            "-",
-            "--include=./lib/",
-            "--include=./usr/include/",
-            "--include=./usr/lib/",
-            "--include=./usr/libdata/",
-            "--include=./usr/lib32",
-            "--include=./usr/lib64",
-            "--include=./usr/lib64c",
-            "--include=./usr/lib64cb",
-            "--include=./usr/lib128",
-            "--include=./usr/lib128g",
-            # only pack those files that are mentioned in METALOG
-            "@METALOG.world",
-        ]
         rootfs_target = self.rootfs_source_class.get_instance(self)
         rootfs_dir = rootfs_target.real_install_root_dir
         if not (rootfs_dir / "lib/libc.so.7").is_file():
@@ -2416,11 +2451,7 @@ class BuildCheriBsdSysrootArchive(SimpleProject):
                 "does not contain libc.so.7",
                 fixit_hint="Run `cheribuild.py " + rootfs_target.target + "` first",
             )
-        print_command(tar_cmd, cwd=rootfs_dir, config=self.config)
-        if not self.config.pretend:
-            tar_cwd = str(rootfs_dir)
-            with subprocess.Popen(tar_cmd, stdout=subprocess.PIPE, cwd=tar_cwd) as tar:
-                self.run_cmd(["tar", "xf", "-"], stdin=tar.stdout, cwd=self.cross_sysroot_path)
+        self._copy_metalog_files(rootfs_dir, rootfs_dir / "METALOG.world", self.cross_sysroot_path)
         if not (self.cross_sysroot_path / "lib/libc.so.7").is_file():
             self.fatal(self.cross_sysroot_path, "is missing the libc library, install seems to have failed!")
 
@@ -2431,6 +2462,87 @@ class BuildCheriBsdSysrootArchive(SimpleProject):
         )
         self.info("Successfully populated sysroot")
 
+    @classmethod
+    def _parse_sysroot_metalog(cls, metalog: Path) -> "list[tuple[str, Optional[str], Optional[str]]]":
+        """Return the (path, type, symlink target) of all METALOG entries below sysroot_paths."""
+        result = []
+        prefixes = tuple(p + "/" for p in cls.sysroot_paths)
+        with metalog.open("r", encoding="utf-8") as f:
+            for line in f:
+                if not line.startswith(prefixes) and line.split(" ", 1)[0] not in cls.sysroot_paths:
+                    continue
+                # Paths and link targets are vis(3)-encoded, so they never contain whitespace.
+                path, *attributes = line.split()
+                attr_dict = dict(attr.split("=", 1) for attr in attributes if "=" in attr)
+                entry_type = attr_dict.get("type")
+                if entry_type not in (None, "dir", "file", "link"):
+                    raise ValueError(f"unsupported entry type {entry_type} for {path}")
+                link = attr_dict.get("link")
+                result.append(
+                    (
+                        os.path.normpath(MtreePath.unescape(path)),
+                        entry_type,
+                        MtreePath.unescape(link) if link is not None else None,
+                    )
+                )
+        return result
+
+    def _copy_metalog_files(self, rootfs_dir: Path, metalog: Path, dest_dir: Path) -> None:
+        # Copy all files below sysroot_paths that are listed in the METALOG to the sysroot. This used to be done with
+        # bsdtar+tar, but copying the files individually allows using reflinks/copy_file_range instead of copying
+        # multiple GB through a pipe. Files are never hardlinked, so modifying the sysroot can't change the rootfs.
+        if dest_dir.resolve() == rootfs_dir.resolve():
+            return  # The sysroot is the rootfs directory, nothing to copy.
+        self.info("Copying files listed in", metalog, "to", dest_dir)
+        entries: "list[tuple[str, Optional[str], Optional[str]]]" = []
+        if not self.config.pretend:
+            try:
+                entries = self._parse_sysroot_metalog(metalog)
+            except ValueError as e:
+                self.warning("Cannot copy the files listed in", metalog, "directly:", e, "-- falling back to bsdtar")
+                self._copy_metalog_files_with_bsdtar(rootfs_dir, metalog, dest_dir)
+                return
+        # Remove the files from the previous sysroot first, so that files which no longer exist in the rootfs (e.g.
+        # headers that have been removed) do not remain in the sysroot.
+        for path in self.sysroot_paths:
+            self.clean_directory(dest_dir / path, ensure_dir_exists=False)
+        for relpath, entry_type, link in entries:
+            src = rootfs_dir / relpath
+            dest = dest_dir / relpath
+            if entry_type == "dir":
+                dest.mkdir(parents=True, exist_ok=True)
+                continue
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            if entry_type == "link" or (entry_type is None and src.is_symlink()):
+                if dest.is_symlink() or dest.exists():
+                    dest.unlink()
+                os.symlink(link or os.readlink(str(src)), str(dest))
+            elif src.is_file():
+                file_copy_engine.copy_file(src, dest)
+            else:
+                self.warning("Sysroot file", src, "listed in", metalog, "does not exist")
+
+    def _copy_metalog_files_with_bsdtar(self, rootfs_dir: Path, metalog: Path, dest_dir: Path) -> None:
+        # GNU tar doesn't accept --include (and doesn't handle METALOG). bsdtar appears to be available
+        # on FreeBSD and macOS by default. On Linux it is not always installed by default.
+        self.check_required_system_tool("bsdtar", cheribuild_target="bsdtar", apt="libarchive-tools")
+        for path in self.sysroot_paths:
+            self.clean_directory(dest_dir / path, ensure_dir_exists=False)
+        # use tar+untar to copy all necessary files listed in metalog to the sysroot dir
+        # Since we are using the metalog argument we need to use BSD tar and not GNU tar!
+        tar_cmd = [
+            shutil.which("bsdtar", path=getenv("PATH")) or "bsdtar",
+            "cf",
+            "-",
+            *("--include=" + path + "/" for path in self.sysroot_paths),
+            # only pack those files that are mentioned in METALOG
+            "@" + str(metalog),
+        ]
+        print_command(tar_cmd, cwd=rootfs_dir, config=self.config)
+        if not self.config.pretend:
+            with subprocess.Popen(tar_cmd, stdout=subprocess.PIPE, cwd=str(rootfs_dir)) as tar:
+                self.run_cmd(["tar", "xf", "-"], stdin=tar.stdout, cwd=dest_dir)
+
     def process(self) -> None:
         if self.config.skip_world:
             self.info("Not building sysroot because --skip-world was passed")
@@ -28,7 +28,6 @@
 # SUCH DAMAGE.
 #
 
-import os
 import typing
 from pathlib import Path
 from typing import Sequence, Union
@@ -51,6 +50,7 @@ from ..project import (
 )
 from ..simple_project import SimpleProject
 from ...config.compilation_targets import CompilationTargets
+from ...processutils import getenv
 from ...utils import AnsiColour, coloured
 
 __all__ = [
@@ -194,7 +194,7 @@ class CrossCompileAutotoolsProject(CrossCompileMixin, AutotoolsProject):
     def process(self):
         if not self.compiling_for_host():
             # We run all these commands with $PATH containing $CHERI_SDK/bin to ensure the right tools are used
-            with self.set_env(PATH=str(self.sdk_bindir) + ":" + os.getenv("PATH", "")):
+            with self.set_env(PATH=str(self.sdk_bindir) + ":" + getenv("PATH", "")):
                 super().process()
         else:
             # when building the native target we just rely on the host tools in /usr/bin
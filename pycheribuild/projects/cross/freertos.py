@@ -29,7 +29,6 @@
 # OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
 # SUCH DAMAGE.
 #
-import os
 import typing
 from typing import ClassVar
 
@@ -37,6 +36,7 @@ from .compiler_rt import BuildCompilerRtBuiltins
 from .crosscompileproject import CompilationTargets, CrossCompileAutotoolsProject, DefaultInstallDir, GitRepository
 from ..project import ComputedDefaultValue
 from ..run_qemu import LaunchQEMUBase
+from ...processutils import getenv
 
 
 class BuildFreeRTOS(CrossCompileAutotoolsProject):
@@ -175,7 +175,7 @@ class BuildFreeRTOS(CrossCompileAutotoolsProject):
             self.fatal(self.demo + " Demo doesn't support/have " + self.demo_app)
 
         with self.set_env(
-            PATH=str(self.sdk_bindir) + ":" + os.getenv("PATH", ""),
+            PATH=str(self.sdk_bindir) + ":" + getenv("PATH", ""),
             # Add compiler-rt location to the search path
             LDFLAGS="-L" + str(BuildCompilerRtBuiltins.get_install_dir(self) / "lib"),
         ):
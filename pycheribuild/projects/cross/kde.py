@@ -26,7 +26,6 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 
-import os
 import shlex
 import tempfile
 from pathlib import Path
@@ -46,6 +45,7 @@ from ..simple_project import BoolConfigOption, TargetAliasWithDependencies
 from ...colour import AnsiColour, coloured
 from ...config.chericonfig import BuildType
 from ...config.compilation_targets import CompilationTargets
+from ...processutils import getenv
 from ...utils import OSInfo, is_case_sensitive_dir
 
 
@@ -223,7 +223,7 @@ class BuildGettext(CrossCompileAutotoolsProject):
                 [
                     str(self.get_homebrew_prefix("gnu-sed") / "libexec/gnubin"),
                     str(self.get_homebrew_prefix("bison") / "bin"),
-                    os.getenv("PATH", ""),
+                    getenv("PATH", ""),
                 ]
             )
         with self.set_env(**new_env):
@@ -1281,7 +1281,7 @@ class BuildLCMS2(CrossCompileAutotoolsProject):
                 libtool_prefix = self.get_homebrew_prefix("libtool")
                 self.create_symlink(libtool_prefix / "bin/glibtool", Path(td) / "libtool", relative=False)
                 self.create_symlink(libtool_prefix / "bin/glibtoolize", Path(td) / "libtoolize", relative=False)
-                with self.set_env(PATH=td + ":" + os.getenv("PATH", "")):
+                with self.set_env(PATH=td + ":" + getenv("PATH", "")):
                     super().process()
         else:
             super().process()
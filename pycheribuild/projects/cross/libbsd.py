@@ -24,10 +24,9 @@
 # SUCH DAMAGE.
 #
 
-import os
-
 from .crosscompileproject import CrossCompileAutotoolsProject, DefaultInstallDir, GitRepository, MakeCommandKind
 from ...config.compilation_targets import CompilationTargets
+from ...processutils import getenv
 from ...utils import OSInfo, classproperty
 
 
@@ -75,7 +74,7 @@ class BuildLibbsd(CrossCompileAutotoolsProject):
             self.install_file(sofile, self.install_dir / "rootfs/lib/" / sofile.name, create_dirs=True)
 
     def process(self):
-        new_path = os.getenv("PATH", "")
+        new_path = getenv("PATH", "")
         # Needed until https://gitlab.freedesktop.org/libbsd/libbsd/-/merge_requests/35 lands
         if OSInfo.IS_MAC:
             # /usr/bin/sed on macOS is not compatible, uses hardcoded 'sed' instead of AC_PROG_SED:
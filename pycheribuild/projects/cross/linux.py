@@ -43,7 +43,7 @@ from ..run_qemu import LaunchQEMUBase
 from ...config.chericonfig import CheriConfig, RiscvCheriISA
 from ...config.compilation_targets import CompilationTargets, LinuxGccTargetInfo
 from ...config.target_info import CPUArchitecture
-from ...processutils import get_compiler_info
+from ...processutils import get_compiler_info, getenv
 from ...utils import OSInfo, classproperty
 
 
@@ -178,7 +178,7 @@ class BuildLinux(CrossCompileAutotoolsProject):
             # We must use GNU sed (which is only available as gsed on macos, use the homebrew local tools dir.
             self.check_required_system_tool("gsed", homebrew="gnu-sed")
             gnu_sed_path = self.get_homebrew_prefix("gnu-sed") / "libexec/gnubin"
-            self.make_args.set_env(PATH=str(gnu_sed_path) + ":" + os.getenv("PATH", ""))
+            self.make_args.set_env(PATH=str(gnu_sed_path) + ":" + getenv("PATH", ""))
             # self.download_file(
             #     self.build_dir / "macos-compat/elf.h",
             #     "https://gist.githubusercontent.com/mlafeldt/3885346/raw/b6166a889846dc0612f4227fa3d32554870bb922/elf.h",
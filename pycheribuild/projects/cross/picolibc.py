@@ -23,13 +23,12 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
-import os
-
 from .crosscompileproject import CrossCompileMesonProject, GitRepository
 from ..build_qemu import BuildQEMU
 from ..project import CompilerLanguage, DefaultInstallDir
 from ...config.compilation_targets import CompilationTargets, PicolibcBaremetalTargetInfo
 from ...config.target_info import CPUArchitecture
+from ...processutils import getenv
 
 
 class BuildPicoLibc(CrossCompileMesonProject):
@@ -154,7 +153,7 @@ default_ram_size   = '{hex(layout.dram_size)}'
     def run_tests(self):
         if not self.compiling_for_host():
             qemu = BuildQEMU.qemu_binary_for_target(self.crosscompile_target, self.config)
-            new_env = dict(PATH=str(qemu.parent) + ":" + os.getenv("PATH", ""), QEMU_BIN=qemu)
+            new_env = dict(PATH=str(qemu.parent) + ":" + getenv("PATH", ""), QEMU_BIN=qemu)
             if self.crosscompile_target.cpu_architecture == CPUArchitecture.ARM32:
                 new_env["QEMU_CPU"] = "max"
             with self.set_env(**new_env, print_verbose_only=False):
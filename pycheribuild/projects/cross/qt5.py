@@ -27,7 +27,6 @@
 # OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
 # SUCH DAMAGE.
 #
-import os
 import shutil
 import tempfile
 from pathlib import Path
@@ -48,6 +47,7 @@ from .wayland import BuildWayland
 from .x11 import BuildLibXCB
 from ..project import default_source_dir_in_subdir
 from ..simple_project import BoolConfigOption, SimpleProject
+from ...processutils import getenv
 from ...utils import InstallInstructions
 
 
@@ -153,7 +153,7 @@ class BuildSharedMimeInfo(CrossCompileMesonProject):
     def configure(self, **kwargs):
         if not self.compiling_for_host():
             native_bin = self.get_instance(self, cross_target=CompilationTargets.NATIVE).install_dir / "bin"
-            self.configure_environment["PATH"] = str(native_bin) + ":" + os.getenv("PATH", "")
+            self.configure_environment["PATH"] = str(native_bin) + ":" + getenv("PATH", "")
         super().configure()
 
 
@@ -902,7 +902,7 @@ class BuildQtWayland(BuildQtModuleWithQMake):
     def process(self):
         wayland_native = BuildWayland.get_instance(self, cross_target=CompilationTargets.NATIVE)
         # This build relies in wayland-scanner being found in $PATH
-        with self.set_env(PATH=str(wayland_native.install_dir / "bin") + ":" + os.getenv("PATH", "")):
+        with self.set_env(PATH=str(wayland_native.install_dir / "bin") + ":" + getenv("PATH", "")):
             super().process()
 
 
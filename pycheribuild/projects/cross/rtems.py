@@ -29,10 +29,9 @@
 # OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
 # SUCH DAMAGE.
 #
-import os
-
 from .crosscompileproject import CompilationTargets, CrossCompileProject, DefaultInstallDir, GitRepository
 from ..run_qemu import LaunchQEMUBase
+from ...processutils import getenv
 
 
 class BuildRtems(CrossCompileProject):
@@ -82,7 +81,7 @@ class BuildRtems(CrossCompileProject):
 
     def process(self):
         with self.set_env(
-            PATH=str(self.sdk_bindir) + ":" + os.getenv("PATH", ""),
+            PATH=str(self.sdk_bindir) + ":" + getenv("PATH", ""),
             CFLAGS="--sysroot=" + str(self.sdk_sysroot),
             LDFLAGS="--sysroot=" + str(self.sdk_sysroot),
         ):
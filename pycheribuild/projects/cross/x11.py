@@ -25,7 +25,6 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
-import os
 import shutil
 import subprocess
 from pathlib import Path
@@ -35,7 +34,7 @@ from .freetype import BuildFreeType2
 from ..project import DefaultInstallDir, GitRepository, Project
 from ...config.chericonfig import BuildType
 from ...config.compilation_targets import CompilationTargets
-from ...processutils import DoNotQuoteStr, get_program_version
+from ...processutils import DoNotQuoteStr, get_program_version, getenv
 from ...utils import OSInfo
 
 
@@ -342,7 +341,7 @@ class BuildLibXKBCommon(X11MesonProject):
         )
 
     def process(self):
-        newpath = os.getenv("PATH", "")
+        newpath = getenv("PATH", "")
         if OSInfo.IS_MAC:
             # /usr/bin/bison on macOS is not compatible with this build system
             newpath = str(self.get_homebrew_prefix("bison")) + "/bin:" + newpath
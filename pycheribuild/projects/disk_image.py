@@ -53,7 +53,7 @@ from .project import (
 )
 from .simple_project import BoolConfigOption, SimpleProject
 from ..config.compilation_targets import CompilationTargets
-from ..mtree import MtreeFile, MtreePath
+from ..mtree import MtreeEntry, MtreeFile, MtreePath
 from ..qemu_utils import QemuOptions
 from ..utils import AnsiColour, coloured, include_file, include_local_file
 
@@ -238,6 +238,8 @@ class BuildDiskImageBase(SimpleProject):
         # MIPS needs big-endian disk images
         self.big_endian = self.compiling_for_mips(include_purecap=True)
         self.stripped_contents: "dict[Union[str,PurePath], PurePath]" = {}
+        # mtree entries added by add_from_mtree() that should be stripped (grouped by their contents= path)
+        self._pending_strip: "dict[MtreePath, list[MtreeEntry]]" = {}
 
     @cached_property
     def source_project(self) -> BuildFreeBSD:
@@ -345,25 +347,50 @@ class BuildDiskImageBase(SimpleProject):
             if entry is None and self.config.pretend:
                 return  # We would get a fatal error for non-pretend runs
             contents = MtreePath(entry.attributes.get("contents", entry.path))
-            if contents not in self.stripped_contents:
-                stripped_path = self.tmpdir / entry.path
-                file = self.rootfs_dir / contents
-                if not self.maybe_strip_elf_file(file, output_path=stripped_path):
-                    stripped_path = contents
-                self.stripped_contents[contents] = stripped_path
-                self.stripped_contents[stripped_path] = stripped_path
+            if contents in self.stripped_contents:
+                self._use_stripped_contents(entry, self.stripped_contents[contents])
             else:
-                stripped_path = self.stripped_contents[contents]
-            if stripped_path != contents:
-                entry.attributes["contents"] = str(stripped_path)
-                self.verbose_print("Stripped ELF binary", mtree_path, "at", stripped_path)
+                # Stripping one file at a time is slow, so this is deferred until strip_pending_files() is called.
+                self._pending_strip.setdefault(contents, []).append(entry)
+
+    def _use_stripped_contents(self, entry: MtreeEntry, stripped_path: PurePath) -> None:
+        if stripped_path != MtreePath(entry.attributes.get("contents", entry.path)):
+            entry.attributes["contents"] = str(stripped_path)
+            self.verbose_print("Stripped ELF binary", entry.path, "at", stripped_path)
+
+    def strip_pending_files(self) -> None:
+        """Strip all ELF files that were added using add_from_mtree() (using a single batch of llvm-strip jobs)."""
+        if not self._pending_strip:
+            return
+        pending = self._pending_strip
+        self._pending_strip = {}
+        outputs = {contents: self.tmpdir / entries[0].path for contents, entries in pending.items()}
+        stripped = self.maybe_strip_elf_files(
+            ((self.rootfs_dir / contents, out) for contents, out in outputs.items()),
+            # Avoid stripping thousands of unchanged binaries every time the image is rebuilt.
+            cache_dir=self.config.build_root / "strip-cache" if self.config.strip_cache else None,
+        )
+        for contents, entries in pending.items():
+            stripped_path = outputs[contents] if self.rootfs_dir / contents in stripped else contents
+            self.stripped_contents[contents] = stripped_path
+            self.stripped_contents[stripped_path] = stripped_path
+            for entry in entries:
+                self._use_stripped_contents(entry, stripped_path)
+
+    @property
+    def metalog_cache_dir(self) -> Optional[Path]:
+        # The parsed METALOG files are cached in the build root (instead of the rootfs) to avoid adding files to it.
+        if self.config.pretend:
+            return None
+        return self.config.build_root / "metalog-cache"
 
     def prepare_rootfs(self):
         assert self.tmpdir is not None
         # skip parsing the metalog in the git push hook since it takes a long time and isn't that useful
         for metalog in self.input_metalogs:
             if metalog.exists() and not os.getenv("_TEST_SKIP_METALOG"):
-                self.mtree.load(metalog, append=True)
+                # All disk image flavours use the same METALOG files, so only the first one needs to parse them.
+                self.mtree.load(metalog, append=True, cache_dir=self.metalog_cache_dir)
             else:
                 self.fatal("Could not find required input mtree file", metalog)
 
@@ -1008,6 +1035,7 @@ class BuildDiskImageBase(SimpleProject):
                 self.add_unlisted_files_to_metalog()
             # Add/symlink GDB (if requested).
             self.add_gdb()
+            self.strip_pending_files()
             # finally create the disk image
             self.make_disk_image(manifest_file=self.tmpdir / "METALOG")
         self._tmpdir = None
@@ -1368,7 +1396,7 @@ class BuildMinimalCheriBSDDiskImage(BuildDiskImageBase):
 
         for metalog in [self.rootfs_dir / "METALOG.world", self.rootfs_dir / "METALOG.kernel"]:
             if metalog.exists() and not os.getenv("_TEST_SKIP_METALOG"):
-                self.ref_mtree.load(metalog, append=True)
+                self.ref_mtree.load(metalog, append=True, cache_dir=self.metalog_cache_dir)
             else:
                 self.fatal("Could not find required reference mtree file", metalog)
 
@@ -25,7 +25,6 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
-import os
 import platform
 import shutil
 import tempfile
@@ -44,6 +43,7 @@ from .project import (
 from .simple_project import SimpleProject
 from ..config.chericonfig import BuildType, CheriConfig
 from ..config.compilation_targets import CompilationTargets
+from ..processutils import getenv
 from ..utils import OSInfo
 
 
@@ -375,7 +375,7 @@ subprocess.check_call(["{self.CC}", "-B{fake_cc_dir}"] + args + ["-fuse-ld=bfd",
             EDK2_TOOLCHAIN="CLANG38",
             VERBOSE=1,
             IASL_PREFIX=str(iasl.parent) + "/",
-            PATH=str(fake_cc_dir) + ":" + os.getenv("PATH", ""),
+            PATH=str(fake_cc_dir) + ":" + getenv("PATH", ""),
         ):
             platform_desc = "Platform/ARM/Morello/MorelloPlatformFvp.dsc"
             if not (self.source_dir / "edk2-platforms" / platform_desc).exists():
@@ -30,7 +30,9 @@
 import contextlib
 import copy
 import datetime
+import hashlib
 import inspect
+import json
 import os
 import re
 import shutil
@@ -74,11 +76,13 @@ from ..config.target_info import (
     DefaultInstallDir,
     TargetInfo,
 )
+from ..jobserver import JobserverClientArgs, get_jobserver
 from ..processutils import (
     CompilerInfo,
     commandline_to_str,
     get_program_version,
     get_version_output,
+    getenv,
 )
 from ..ssh_utils import ssh_host_accessible_cached
 from ..utils import (
@@ -866,10 +870,11 @@ class Project(SimpleProject):
         if self.config.use_cheri_ubsan and self.crosscompile_target.is_hybrid_or_purecap_cheri():
             compiler = self.get_compiler_info(self.target_info.c_compiler)
             # This needs to be checked late since we depend on the --target/-mabi flags for the -fsanitize= check.
-            if compiler.supports_sanitizer_flag("-fsanitize=cheri", result):
-                result.append("-fsanitize=cheri")
-                if not self.config.use_cheri_ubsan_runtime:
-                    result.append("-fsanitize-trap=cheri")
+            sanitizer_flags = ["-fsanitize=cheri"]
+            if not self.config.use_cheri_ubsan_runtime:
+                sanitizer_flags.append("-fsanitize-trap=cheri")
+            if compiler.supported_sanitizer_flags(sanitizer_flags, result) == set(sanitizer_flags):
+                result.extend(sanitizer_flags)
             else:
                 self.warning("Compiler", compiler.path, "does not support -fsanitize=cheri, please update your SDK")
         if self.compiling_for_host():
@@ -1125,11 +1130,10 @@ class Project(SimpleProject):
             # Make underaligned capability loads/stores an error and require an explicit cast:
             self.cross_warning_flags.append("-Werror=pass-failed")
         if self.crosscompile_target.is_cheri_purecap():
-            # The morello compiler still uses the old flag name
-            supports_new_flag = cc_info.supports_warning_flag("-Werror=cheri-prototypes")
-            self.cross_warning_flags.append(
-                "-Werror=cheri-prototypes" if supports_new_flag else "-Werror=mips-cheri-prototypes"
-            )
+            # The morello compiler still uses the old flag name (check both names with a single compiler invocation)
+            new_flag, old_flag = "-Werror=cheri-prototypes", "-Werror=mips-cheri-prototypes"
+            supported = cc_info.supported_warning_flags([new_flag, old_flag])
+            self.cross_warning_flags.append(new_flag if new_flag in supported else old_flag)
         if self.CC.exists() and cc_info.is_clang:
             self.cross_warning_flags += ["-Werror=undefined-internal"]
 
@@ -1236,6 +1240,7 @@ class Project(SimpleProject):
         options: MakeOptions,
         parallel: bool = True,
         compilation_db_name: "Optional[str]" = None,
+        jobserver_args: "Optional[JobserverClientArgs]" = None,
     ):
         assert options is not None
         assert make_command is not None
@@ -1265,11 +1270,16 @@ class Project(SimpleProject):
                 options.set(MAKE=commandline_to_str([options.command, *compdb_extra_args]))
             make_command = options.command
 
+        jobs = self.config.make_jobs if parallel else None
+        if jobserver_args is not None:
+            # The build tool gets its job slots from the shared jobserver, passing -j would override it.
+            jobs = None
+            options.add_flags(*jobserver_args.flags)
         all_args = [
             make_command,
             *options.get_commandline_args(
                 targets=make_targets,
-                jobs=self.config.make_jobs if parallel else None,
+                jobs=jobs,
                 config=self.config,
                 verbose=self.config.verbose,
                 continue_on_error=self.config.pass_dash_k_to_make,
@@ -1279,6 +1289,42 @@ class Project(SimpleProject):
             all_args = ["nice", *all_args]
         return all_args
 
+    def _jobserver_client_args(self, options: MakeOptions, parallel: bool) -> "Optional[JobserverClientArgs]":
+        """Returns the arguments needed to connect the build tool to the --jobserver or None if not supported."""
+        if not parallel:
+            return None
+        jobserver = get_jobserver(self.config)
+        if jobserver is None:
+            return None
+        kind = options.kind
+        command = options.command
+        if kind == MakeCommandKind.CMake:
+            kind = options.subkind
+            command = "ninja" if kind == MakeCommandKind.Ninja else "make"
+        if kind == MakeCommandKind.BsdMake:
+            return jobserver.bmake_client_args()
+        tool_path = shutil.which(command, path=getenv("PATH"))
+        if tool_path is None:
+            return None
+        if kind == MakeCommandKind.Ninja:
+            # Ninja 1.13 added support for the FIFO-based jobserver client protocol
+            ninja_version = get_program_version(
+                Path(tool_path), regex=b"(\\d+)\\.(\\d+)\\.?(\\d+)?", config=self.config
+            )
+            return jobserver.gnu_make_fifo_client_args() if ninja_version >= (1, 13) else None
+        if kind == MakeCommandKind.GnuMake or (
+            kind == MakeCommandKind.DefaultMake
+            and b"GNU Make" in get_version_output(Path(tool_path), config=self.config)
+        ):
+            make_version = get_program_version(
+                Path(tool_path), regex=b"GNU Make (\\d+)\\.(\\d+)\\.?(\\d+)?", config=self.config
+            )
+            if make_version >= (4, 4):
+                return jobserver.gnu_make_fifo_client_args()
+            elif make_version >= (4, 2):
+                return jobserver.gnu_make_pipe_client_args()
+        return None
+
     def get_make_commandline(
         self,
         make_targets: "list[str]",
@@ -1291,7 +1337,14 @@ class Project(SimpleProject):
             options = self.make_args
         if not make_command:
             make_command = self.make_args.command
-        return self._get_make_commandline(make_targets, make_command, options, parallel, compilation_db_name)
+        return self._get_make_commandline(
+            make_targets,
+            make_command,
+            options,
+            parallel,
+            compilation_db_name,
+            jobserver_args=self._jobserver_client_args(options, parallel),
+        )
 
     def run_make(
         self,
@@ -1313,8 +1366,16 @@ class Project(SimpleProject):
         make_targets_list: "list[str]" = (
             [] if make_targets is None else ([make_targets] if isinstance(make_targets, str) else make_targets)
         )
+        # Determining the jobserver arguments may require running the build tool to check its version, so only do it
+        # once for both the command line flags and the environment/file descriptors.
+        jobserver_args = self._jobserver_client_args(options, parallel)
         all_args = self._get_make_commandline(
-            make_targets_list, make_command, options, parallel=parallel, compilation_db_name=compilation_db_name
+            make_targets_list,
+            make_command,
+            options,
+            parallel=parallel,
+            compilation_db_name=compilation_db_name,
+            jobserver_args=jobserver_args,
         )
         if not cwd:
             cwd = self.build_dir
@@ -1332,6 +1393,10 @@ class Project(SimpleProject):
         if stdout_filter is _default_stdout_filter:
             stdout_filter = self._stdout_filter
         env = options.env_vars
+        pass_fds: "tuple[int, ...]" = ()
+        if jobserver_args is not None:
+            env = {**env, **jobserver_args.env}
+            pass_fds = jobserver_args.pass_fds
         self.run_with_logfile(
             all_args,
             logfile_path=self.build_dir / logfile_name,
@@ -1339,6 +1404,7 @@ class Project(SimpleProject):
             cwd=cwd,
             env=env,
             append_to_logfile=append_to_logfile,
+            pass_fds=pass_fds,
         )
         # if we create a compilation db, copy it to the source dir:
         if self.config.copy_compilation_db_to_source_dir and (self.build_dir / compilation_db_name).exists():
@@ -1563,14 +1629,13 @@ add_custom_target(cheribuild-full VERBATIM USES_TERMINAL COMMAND {command} {targ
         """
         self.info("Stripping all ELF files in", benchmark_dir)
         self.run_cmd("du", "-sh", benchmark_dir)
-        for root, dirnames, filenames in os.walk(str(benchmark_dir)):
-            for filename in filenames:
-                file = Path(root, filename)
-                if file.suffix == ".dump":
-                    # TODO: make this an error since we should have deleted them
-                    self.warning("Will copy a .dump file to the FPGA:", file)
-                # Try to reduce the amount of copied data
-                self.maybe_strip_elf_file(file)
+        files = list(self.walk_files(benchmark_dir))
+        for file in files:
+            if file.suffix == ".dump":
+                # TODO: make this an error since we should have deleted them
+                self.warning("Will copy a .dump file to the FPGA:", file)
+        # Try to reduce the amount of copied data
+        self.maybe_strip_elf_files((f, None) for f in files)
         self.run_cmd("du", "-sh", benchmark_dir)
 
     # @cached_property is important to only compute it once since we encode seconds in the file name:
@@ -1611,6 +1676,71 @@ add_custom_target(cheribuild-full VERBATIM USES_TERMINAL COMMAND {command} {targ
     def _last_clean_counter_path(self) -> Path:
         return Path(self.build_dir, ".cheribuild_last_clean_counter")
 
+    def _build_fingerprint_path(self) -> Path:
+        return Path(self.build_dir, ".cheribuild_build_fingerprint")
+
+    def _read_build_fingerprint(self) -> Optional[str]:
+        try:
+            return self._build_fingerprint_path().read_text(encoding="utf-8").strip()
+        except OSError:
+            return None
+
+    def compute_build_fingerprint(self) -> Optional[str]:
+        """
+        Returns a hash of all inputs of the build (source repository state, config options, compiler identity and the
+        fingerprints of the dependencies) or None if the inputs cannot be determined.
+        Used to skip targets that are already up-to-date with --skip-unchanged-targets.
+        """
+        if self.build_in_source_dir or self.repository is None:
+            return None
+        source_fingerprint = self.repository.source_fingerprint(self, self.source_dir)
+        if source_fingerprint is None:
+            return None
+        compilers = dict()
+        for compiler in (self.CC, self.CXX):
+            try:
+                resolved = compiler.resolve()
+                st = resolved.stat()
+                compilers[str(compiler)] = f"{resolved}:{st.st_size}:{st.st_mtime_ns}"
+            except OSError:
+                compilers[str(compiler)] = "<missing>"
+        dependencies = dict()
+        # Toolchain dependencies are already covered by the compiler identity.
+        for dep in self._direct_dependencies(
+            self.config,
+            include_toolchain_dependencies=False,
+            include_sdk_dependencies=True,
+            explicit_dependencies_only=False,
+        ):
+            dep_project = dep.get_or_create_project(None, self.config, caller=self)
+            dep_fingerprint = dep_project._read_build_fingerprint() if isinstance(dep_project, Project) else None
+            if dep_fingerprint is None:
+                self.verbose_print("Dependency", dep.name, "does not have a build fingerprint")
+                return None
+            dependencies[dep.name] = dep_fingerprint
+        options = dict()
+        for name, handle in self._config_loader.option_handles.items():
+            if name.startswith(self.target + "/"):
+                option = handle._get_option()
+                options[name] = option.__get__(self, type(self))
+        inputs = {
+            "target": self.target,
+            "build_configuration": self.build_configuration_suffix(),
+            "source": source_fingerprint,
+            "options": options,
+            "install_dir": self.install_dir,
+            "configure_args": self.configure_args,
+            "configure_environment": self.configure_environment,
+            "make_args": self.make_args.all_commandline_args(self.config),
+            "make_env": self.make_args.env_vars,
+            "cflags": self.default_compiler_flags(),
+            "ldflags": self.default_ldflags,
+            "compilers": compilers,
+            "dependencies": dependencies,
+        }
+
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
     def _parse_require_clean_build_counter(self) -> Optional[int]:
         require_clean_path = Path(self.source_dir, ".require_clean_build")
         if not require_clean_path.exists():
@@ -1695,17 +1825,18 @@ add_custom_target(cheribuild-full VERBATIM USES_TERMINAL COMMAND {command} {targ
                     f"{other_cls.target} reuses the same install prefix! This will cause conflicts: {other_install_dir}"
                 )
 
-        if self.skip_update:
-            # When --skip-update is set (or we don't have working internet) only check that the repository exists
-            if self.repository:
-                self.repository.ensure_cloned(
-                    self,
-                    src_dir=self.source_dir,
-                    base_project_source_dir=self.source_dir,
-                    skip_submodules=self.skip_git_submodules,
-                )
-        else:
-            self.update()
+        with self.timed_phase("update"):
+            if self.skip_update:
+                # When --skip-update is set (or we don't have working internet) only check that the repository exists
+                if self.repository:
+                    self.repository.ensure_cloned(
+                        self,
+                        src_dir=self.source_dir,
+                        base_project_source_dir=self.source_dir,
+                        skip_submodules=self.skip_git_submodules,
+                    )
+            else:
+                self.update()
         if not self._system_deps_checked:
             self.check_system_dependencies()
             assert self._system_deps_checked, "self._system_deps_checked must be set by now!"
@@ -1764,6 +1895,20 @@ add_custom_target(cheribuild-full VERBATIM USES_TERMINAL COMMAND {command} {targ
                     self.warning("Could not parse", last_clean_counter_path, "-> assuming clean build is required.", e)
                     self._force_clean = True
 
+        build_fingerprint: Optional[str] = None
+        if self.config.skip_unchanged_targets and not self.config.pretend:
+            build_fingerprint = self.compute_build_fingerprint()
+            if build_fingerprint is None:
+                self.verbose_print("Cannot determine build fingerprint for", self.target, "-> not skipping build")
+            elif not (self._force_clean or self.with_clean) and self._read_build_fingerprint() == build_fingerprint:
+                status_update("Skipping", self.display_name, "since it is up-to-date (build fingerprint unchanged)")
+                self.build_was_up_to_date = True
+                return
+        # Remove the old fingerprint so that an interrupted build (or one without --skip-unchanged-targets that changed
+        # the build inputs) is not treated as up-to-date by a later run.
+        if self._build_fingerprint_path().exists():
+            self.delete_file(self._build_fingerprint_path(), print_verbose_only=True)
+
         # run the rm -rf <build dir> in the background
         cleaning_task = self.clean() if (self._force_clean or self.with_clean) else ThreadJoiner(None)
         if cleaning_task is None:
@@ -1784,7 +1929,8 @@ add_custom_target(cheribuild-full VERBATIM USES_TERMINAL COMMAND {command} {targ
             # Configure step
             if (not self.config.skip_configure or self.config.configure_only) and self.should_run_configure():
                 status_update("Configuring", self.display_name, "... ")
-                self.configure()
+                with self.timed_phase("configure"):
+                    self.configure()
             if self.config.configure_only:
                 return
 
@@ -1798,7 +1944,8 @@ add_custom_target(cheribuild-full VERBATIM USES_TERMINAL COMMAND {command} {targ
                     )
                     # move any csetbounds stats from configuration (since they are not useful)
                 status_update("Building", self.display_name, "... ")
-                self.compile()
+                with self.timed_phase("compile"):
+                    self.compile()
 
             # Install step
             if not self.config.skip_install:
@@ -1806,7 +1953,11 @@ add_custom_target(cheribuild-full VERBATIM USES_TERMINAL COMMAND {command} {targ
                 if install_dir_kind == DefaultInstallDir.DO_NOT_INSTALL:
                     self.info("Not installing", self.target, "since install dir is set to DO_NOT_INSTALL")
                 else:
-                    self.install()
+                    with self.timed_phase("install"):
+                        self.install()
+
+            if build_fingerprint is not None and not self.config.skip_build and not self.config.skip_install:
+                self.write_file(self._build_fingerprint_path(), build_fingerprint, overwrite=True)
 
 
 # Shared between meson and CMake
@@ -81,6 +81,10 @@ class SourceRepository:
     def get_real_source_dir(self, caller: SimpleProject, base_project_source_dir: Path) -> Path:
         return base_project_source_dir
 
+    def source_fingerprint(self, current_project: "Project", src_dir: Path) -> Optional[str]:
+        """Returns a string that changes whenever the sources in src_dir change or None if this is not supported."""
+        return None
+
 
 class ExternallyManagedSourceRepository(SourceRepository):
     def ensure_cloned(self, current_project: "Project", src_dir: Path, **kwargs):
@@ -121,6 +125,9 @@ class ReuseOtherProjectRepository(SourceRepository):
             return base_project_source_dir
         return self.source_project.get_source_dir(caller, cross_target=self.dir_for_target) / self.subdirectory
 
+    def source_fingerprint(self, current_project: "Project", src_dir: Path) -> Optional[str]:
+        return self.source_project.repository.source_fingerprint(current_project, src_dir)
+
     def update(self, current_project: "Project", *, src_dir: Path, **kwargs):
         if self.do_update:
             src_proj = self.source_project.get_instance(current_project, cross_target=self.dir_for_target)
@@ -243,6 +250,59 @@ class GitRepository(SourceRepository):
         current_project.verbose_print(coloured(AnsiColour.blue, path, "is not tracked by git"))
         return False
 
+    def source_fingerprint(self, current_project: "Project", src_dir: Path) -> Optional[str]:
+        # Combine HEAD with the status of all modified and untracked files. Hashing the size and modification time of
+        # those files is a lot cheaper than hashing the contents and detects all changes that would cause make to
+        # rebuild them.
+        rev_parse = current_project.run_cmd(
+            "git",
+            "rev-parse",
+            "--show-toplevel",
+            "HEAD",
+            cwd=src_dir,
+            capture_output=True,
+            capture_error=True,
+            print_verbose_only=True,
+            allow_unexpected_returncode=True,
+        )
+        if rev_parse.returncode != 0:
+            return None
+        toplevel = Path(os.fsdecode(rev_parse.stdout.splitlines()[0]))
+        status = current_project.run_cmd(
+            "git",
+            "status",
+            "--porcelain=v1",
+            "-z",
+            "--untracked-files=all",
+            cwd=toplevel,
+            capture_output=True,
+            print_verbose_only=True,
+        )
+        import hashlib  # rarely need, so imported on demand to reduce startup time
+
+        h = hashlib.sha256(rev_parse.stdout)
+        entries = status.stdout.split(b"\0")
+        i = 0
+        while i < len(entries):
+            entry = entries[i]
+            i += 1
+            if not entry:
+                continue
+            h.update(entry)
+            if entry[:1] in (b"R", b"C"):
+                i += 1  # renames and copies are followed by the original path
+            try:
+                st = (toplevel / os.fsdecode(entry[3:])).lstat()
+                h.update(f"{st.st_size}:{st.st_mtime_ns}".encode())
+            except OSError:
+                h.update(b"<missing>")
+        if (toplevel / ".gitmodules").exists():
+            submodules = current_project.run_cmd(
+                "git", "submodule", "status", "--recursive", cwd=toplevel, capture_output=True, print_verbose_only=True
+            )
+            h.update(submodules.stdout)
+        return h.hexdigest()
+
     @staticmethod
     def get_branch_info(src_dir: Path, config: ConfigBase) -> "Optional[GitBranchInfo]":
         try:
@@ -31,6 +31,7 @@
 import os
 
 from .project import DefaultInstallDir, GitRepository, MakeCommandKind, Project
+from ..processutils import getenv
 from ..utils import OSInfo
 
 SMB_OUT_OF_SOURCE_BUILD_WORKS = False
@@ -147,7 +148,7 @@ class BuildSamba(Project):
                 + ":"
                 + ":".join([x + "/sbin" for x in homebrew_dirs])
                 + ":"
-                + os.getenv("PATH", ""),
+                + getenv("PATH", ""),
                 PKG_CONFIG_PATH=":".join([x + "/lib/pkgconfig" for x in homebrew_dirs])
                 + ":"
                 + os.getenv("PKG_CONFIG_PATH", ""),
@@ -28,6 +28,7 @@
 # SUCH DAMAGE.
 #
 import argparse
+import contextlib
 import errno
 import inspect
 import os
@@ -35,7 +36,7 @@ import shlex
 import shutil
 import subprocess
 import sys
-import threading
+import tempfile
 import time
 import typing
 from abc import ABC, ABCMeta
@@ -44,6 +45,7 @@ from pathlib import Path
 from types import MappingProxyType
 from typing import Callable, Optional, Sequence, TypeVar, Union
 
+from ..compressed_log import CompressedLogReader, CompressedLogWriter
 from ..config.chericonfig import CheriConfig, ComputedDefaultValue, MipsFloatAbi, RiscvFloatAbi
 from ..config.config_loader_base import ConfigLoaderBase, ConfigOptionHandle, DefaultValueOnlyConfigOption
 from ..config.target_info import (
@@ -54,16 +56,24 @@ from ..config.target_info import (
     CrossCompileTarget,
     TargetInfo,
 )
+from ..dependency_graph import DependencyGraph
+from ..filesystemutils import file_copy_engine
+from ..probe_cache import executable_fingerprint
 from ..processutils import (
     cached_get_homebrew_prefix,
     check_call_handle_noexec,
     commandline_to_str,
+    current_environ,
+    getenv,
     keep_terminal_sane,
+    multiplex_process_output,
     popen_handle_noexec,
     print_command,
     run_command,
     set_env,
 )
+from ..profiling import profiler
+from ..resource_usage import resource_usage
 from ..targets import MultiArchTarget, MultiArchTargetAlias, Target, target_manager
 from ..utils import (
     InstallInstructions,
@@ -729,13 +739,14 @@ class SimpleProjectBase(AbstractProject, ABC):
                 fatal_error("Cyclic dependency found:", " -> ".join(map(lambda c: c.target, cycle)), pretend=False)
         else:
             new_dependency_chain = [cls]
-        # look only in __dict__ to avoid parent class lookup
         cache_lookup_args = (include_dependencies, include_toolchain_dependencies, include_sdk_dependencies)
         # noinspection PyProtectedMember
-        cached_result = config._cached_deps.get(cls.target, dict()).get(cache_lookup_args, None)
+        graph = config._dependency_graph
+        node_id = graph.node_id(cls.target)
+        cached_result = graph.closure(node_id, cache_lookup_args)
         if cached_result is not None:
             return cached_result
-        result = []
+        dependency_ids: "dict[int, None]" = {}
         for target in cls._direct_dependencies(
             config,
             include_toolchain_dependencies=include_toolchain_dependencies,
@@ -745,25 +756,21 @@ class SimpleProjectBase(AbstractProject, ABC):
             if config.should_skip_dependency(target.name, cls.target):
                 continue
 
-            if target not in result:
-                result.append(target)
+            dependency_ids[graph.add_target(target)] = None
             if cls.direct_dependencies_only:
                 continue  # don't add recursive dependencies for e.g. "build-and-run"
-            # now recursively add the other deps:
-            recursive_deps = target.project_class._recursive_dependencies_impl(
+            # now recursively resolve the other deps:
+            target.project_class._recursive_dependencies_impl(
                 config,
                 include_dependencies=include_dependencies,
                 include_toolchain_dependencies=include_toolchain_dependencies,
                 include_sdk_dependencies=include_sdk_dependencies,
                 dependency_chain=new_dependency_chain,
             )
-            for r in recursive_deps:
-                if r not in result:
-                    result.append(r)
         # save the result to avoid recomputing it lots of times
-        # noinspection PyProtectedMember
-        config._cached_deps[cls.target][cache_lookup_args] = result
-        return result
+        return graph.set_dependencies(
+            node_id, cache_lookup_args, list(dependency_ids), recursive=not cls.direct_dependencies_only
+        )
 
     @classmethod
     def cached_full_dependencies(cls) -> "list[Target]":
@@ -776,8 +783,13 @@ class SimpleProjectBase(AbstractProject, ABC):
     @classmethod
     def _cache_full_dependencies(cls, config, *, allow_already_cached=False) -> None:
         assert allow_already_cached or cls.__dict__.get("_cached_full_deps", None) is None, "Already cached??"
+        # The flags must match DependencyGraph.FULL_DEPENDENCIES (used by TargetManager.sort_in_dependency_order()).
+        with_deps, with_toolchain_deps, with_sdk_deps = DependencyGraph.FULL_DEPENDENCIES
         cls._cached_full_deps = cls._recursive_dependencies_impl(
-            config, include_dependencies=True, include_toolchain_dependencies=True, include_sdk_dependencies=True
+            config,
+            include_dependencies=with_deps,
+            include_toolchain_dependencies=with_toolchain_deps,
+            include_sdk_dependencies=with_sdk_deps,
         )
 
     @classmethod
@@ -1267,8 +1279,22 @@ class SimpleProjectBase(AbstractProject, ABC):
         super().__init__(config, crosscompile_target=crosscompile_target)
         self._system_deps_checked = False
         self._last_stdout_line_can_be_overwritten = False
+        self._batch_stdout_updates = False  # Set while run_with_logfile() is processing the output
+        self._pending_progress_line: Optional[bytes] = None  # Progress line that will be shown on the next refresh
+        # Time spent in each phase of process() (reported to the build timing database)
+        self.phase_timings: "dict[str, float]" = {}
+        self.build_was_up_to_date = False  # Set if the build was skipped due to --skip-unchanged-targets
         assert not hasattr(self, "gitBranch"), "gitBranch must not be used: " + self.__class__.__name__
 
+    @contextlib.contextmanager
+    def timed_phase(self, phase: str) -> "typing.Iterator[None]":
+        starttime = time.time()
+        try:
+            with profiler.phase(phase, "project phase", target=self.target), resource_usage.context(phase=phase):
+                yield
+        finally:
+            self.phase_timings[phase] = self.phase_timings.get(phase, 0.0) + time.time() - starttime
+
     def _validate_cheribuild_target_for_system_deps(self, cheribuild_target: "Optional[str]"):
         if not cheribuild_target:
             return
@@ -1374,7 +1400,7 @@ class SimpleProjectBase(AbstractProject, ABC):
             if OSInfo.IS_MAC:
                 brew_prefix = self.get_homebrew_prefix(homebrew if homebrew is not None else package, optional=True)
                 if brew_prefix is not None:
-                    env["PKG_CONFIG_PATH"] = os.getenv("PKG_CONFIG_PATH", "") + ":" + str(brew_prefix / "lib/pkgconfig")
+                    env["PKG_CONFIG_PATH"] = getenv("PKG_CONFIG_PATH", "") + ":" + str(brew_prefix / "lib/pkgconfig")
             with self.set_env(**env):
                 self.run_cmd(["pkg-config", "--modversion", package], capture_output=True)
         except subprocess.CalledProcessError as e:
@@ -1448,40 +1474,42 @@ class SimpleProjectBase(AbstractProject, ABC):
         if not self.query_yes_no(message, default_result=default_result, **kwargs):
             self.fatal(error_message)
 
-    @staticmethod
-    def _handle_stderr(outfile, stream, file_lock, project: "SimpleProject"):
-        for err_line in stream:
-            with file_lock:
-                try:
-                    # noinspection PyProtectedMember
-                    if project._last_stdout_line_can_be_overwritten:
-                        sys.stdout.buffer.write(b"\n")
-                        flush_stdio(sys.stdout)
-                        project._last_stdout_line_can_be_overwritten = False
-                    sys.stderr.buffer.write(err_line)
-                    flush_stdio(sys.stderr)
-                    if project.config.write_logfile:
-                        outfile.write(err_line)
-                except ValueError:
-                    # Don't print a backtrace on ctrl+C (since that will exit the main thread and close the file)
-                    # ValueError: write to closed file
-                    continue
+    def _flush_stdout(self) -> None:
+        # While run_with_logfile() is running, stdout is flushed periodically instead of after every line.
+        if not self._batch_stdout_updates:
+            flush_stdio(sys.stdout)
 
-    def _line_not_important_stdout_filter(self, line: bytes) -> None:
-        # by default we don't keep any line persistent, just have updating output
+    def _write_progress_line(self, line: bytes) -> None:
         if self._last_stdout_line_can_be_overwritten:
             sys.stdout.buffer.write(_clear_line_sequence)
         sys.stdout.buffer.write(line[:-1])  # remove the newline at the end
         sys.stdout.buffer.write(b" ")  # add a space so that there is a gap before error messages
-        flush_stdio(sys.stdout)
         self._last_stdout_line_can_be_overwritten = True
 
+    def _line_not_important_stdout_filter(self, line: bytes) -> None:
+        # by default we don't keep any line persistent, just have updating output
+        if self._batch_stdout_updates:
+            # Only the most recent line will be visible, so there is no need to write the intermediate ones.
+            self._pending_progress_line = line
+            return
+        self._write_progress_line(line)
+        flush_stdio(sys.stdout)
+
     def _show_line_stdout_filter(self, line: bytes) -> None:
+        # Note: this is called for every line of output, so avoid the (slow) Project.__setattr__() if possible.
+        if self._pending_progress_line is not None:
+            self._pending_progress_line = None
         if self._last_stdout_line_can_be_overwritten:
             sys.stdout.buffer.write(b"\n")
+            self._last_stdout_line_can_be_overwritten = False
         sys.stdout.buffer.write(line)
+        self._flush_stdout()
+
+    def _refresh_batched_stdout(self) -> None:
+        if self._pending_progress_line is not None:
+            self._write_progress_line(self._pending_progress_line)
+            self._pending_progress_line = None
         flush_stdio(sys.stdout)
-        self._last_stdout_line_can_be_overwritten = False
 
     _stdout_filter: Optional[Callable[[bytes], None]] = None  # don't filter output by default
 
@@ -1499,6 +1527,7 @@ class SimpleProjectBase(AbstractProject, ABC):
         env: "Optional[dict[str, str]]" = None,
         append_to_logfile=False,
         stdin=subprocess.DEVNULL,
+        pass_fds: "Sequence[int]" = (),
     ) -> None:
         """
         Runs make and logs the output
@@ -1510,15 +1539,18 @@ class SimpleProjectBase(AbstractProject, ABC):
         :param stdout_filter a filter to use for standard output (a function that takes a single bytes argument)
         :param env the environment to pass to make
         :param stdin defaults to /dev/null, set to None to pass the current stdin.
+        :param pass_fds file descriptors that should be inherited by the process (e.g. for the jobserver)
         """
         print_command(args, cwd=cwd, env=env, config=self.config)
         # make sure that env is either None or a os.environ with the updated entries entries
         new_env: "Optional[dict[str, str]]" = None
         if env:
-            new_env = os.environ.copy()
+            new_env = current_environ()
             env = {k: str(v) for k, v in env.items()}  # make sure everything is a string
             new_env.update(env)
         if self.config.write_logfile:
+            if self.config.compress_logs:
+                logfile_path = logfile_path.with_name(logfile_path.name + ".xz")
             print("Saving build log to", logfile_path)
         else:
             logfile_path = Path(os.devnull)
@@ -1529,32 +1561,68 @@ class SimpleProjectBase(AbstractProject, ABC):
 
         if self.config.write_logfile and logfile_path.is_file() and not append_to_logfile:
             logfile_path.unlink()  # remove old logfile
+            if self.config.compress_logs:
+                CompressedLogReader.index_path_for(logfile_path).unlink(missing_ok=True)
 
         if not self.config.write_logfile:
             if stdout_filter is None:
                 # just run the process connected to the current stdout/stdin
-                check_call_handle_noexec(args, cwd=str(cwd), env=new_env)
+                check_call_handle_noexec(args, cwd=str(cwd), env=new_env, pass_fds=pass_fds)
             else:
                 with keep_terminal_sane(command=args):
-                    make = popen_handle_noexec(args, cwd=str(cwd), stdout=subprocess.PIPE, env=new_env)
+                    make = popen_handle_noexec(
+                        args, cwd=str(cwd), stdout=subprocess.PIPE, env=new_env, pass_fds=pass_fds
+                    )
                     self.__run_process_with_filtered_output(make, None, stdout_filter, args)
             return
 
-        # open file in append mode
-        with logfile_path.open("ab") as logfile:
+        if self.config.compress_logs:
+            # Compressed logs are written in independent frames with an index of errors/warnings for --show-log.
+            logfile_cm: "typing.ContextManager[typing.Any]" = CompressedLogWriter(
+                logfile_path, append=append_to_logfile
+            )
+        else:
+            # open file in append mode (with a large buffer since the output is written in big blocks)
+            logfile_cm = logfile_path.open("ab", buffering=1024 * 1024)
+        with logfile_cm as logfile:
             # print the command and then the logfile
             if append_to_logfile:
                 logfile.write(b"\n\n")
             if cwd:
                 logfile.write(("cd " + shlex.quote(str(cwd)) + " && ").encode("utf-8"))
             logfile.write(self.commandline_to_str(args).encode("utf-8") + b"\n\n")
+            if self.config.quiet and self.config.compress_logs:
+                # The output has to pass through the compressor, but there is no need to filter it.
+                make = popen_handle_noexec(
+                    args,
+                    cwd=str(cwd),
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    stdin=stdin,
+                    env=new_env,
+                    pass_fds=pass_fds,
+                )
+                multiplex_process_output(make, on_stdout=logfile.write)
+                retcode = make.wait()
+                if retcode:
+                    message = ("See " + logfile.name + " for details.").encode("utf-8")
+                    raise subprocess.CalledProcessError(retcode, args, None, stderr=message)
+                return
             if self.config.quiet:
                 # a lot more efficient than filtering every line
-                check_call_handle_noexec(args, cwd=str(cwd), stdout=logfile, stderr=logfile, stdin=stdin, env=new_env)
+                check_call_handle_noexec(
+                    args, cwd=str(cwd), stdout=logfile, stderr=logfile, stdin=stdin, env=new_env, pass_fds=pass_fds
+                )
                 return
             with keep_terminal_sane(command=args):
                 make = popen_handle_noexec(
-                    args, cwd=str(cwd), stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=stdin, env=new_env
+                    args,
+                    cwd=str(cwd),
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    stdin=stdin,
+                    env=new_env,
+                    pass_fds=pass_fds,
                 )
                 self.__run_process_with_filtered_output(make, logfile, stdout_filter, args)
 
@@ -1565,39 +1633,36 @@ class SimpleProjectBase(AbstractProject, ABC):
         stdout_filter: "Optional[Callable[[bytes], None]]",
         args: "Sequence[str | Path]",
     ):
-        logfile_lock = threading.Lock()  # we need a mutex so the logfile line buffer doesn't get messed up
-        stderr_thread = None
-        if logfile:
-            # use a thread to print stderr output and write it to logfile (not using a thread would block)
-            stderr_thread = threading.Thread(
-                target=self._handle_stderr, args=(logfile, proc.stderr, logfile_lock, self)
-            )
-            stderr_thread.start()
-        assert proc.stdout is not None
-        for line in proc.stdout:
-            with logfile_lock:  # make sure we don't interleave stdout and stderr lines
-                if logfile:
-                    logfile.write(line)
-                if stdout_filter:
-                    stdout_filter(line)
-                else:
-                    sys.stdout.buffer.write(line)
-                    flush_stdio(sys.stdout)
-        retcode = proc.wait()
-        if stderr_thread:
-            stderr_thread.join()
-        # Not sure if the remaining call is needed
-        remaining_err, remaining_out = proc.communicate()
-        if remaining_err:
-            print("Process had remaining stderr:", remaining_err)
-            sys.stderr.buffer.write(remaining_err)
+        def handle_stdout(lines: bytes) -> None:
             if logfile:
-                logfile.write(remaining_out)
-        if remaining_out:
-            print("Process had remaining stdout:", remaining_out)
-            sys.stdout.buffer.write(remaining_out)
+                logfile.write(lines)
+            if stdout_filter:
+                for line in lines.splitlines(keepends=True):
+                    stdout_filter(line)
+            else:
+                sys.stdout.buffer.write(lines)
+
+        def handle_stderr(lines: bytes) -> None:
             if logfile:
-                logfile.write(remaining_err)
+                logfile.write(lines)
+            # Show the most recent progress line before the error and make sure stdout and stderr are not interleaved.
+            self._refresh_batched_stdout()
+            if self._last_stdout_line_can_be_overwritten:
+                sys.stdout.buffer.write(b"\n")
+                flush_stdio(sys.stdout)
+                self._last_stdout_line_can_be_overwritten = False
+            sys.stderr.buffer.write(lines)
+            flush_stdio(sys.stderr)
+
+        self._batch_stdout_updates = True
+        try:
+            multiplex_process_output(
+                proc, on_stdout=handle_stdout, on_stderr=handle_stderr, on_refresh=self._refresh_batched_stdout
+            )
+        finally:
+            self._batch_stdout_updates = False
+            self._pending_progress_line = None
+        retcode = proc.wait()
         if stdout_filter and self._last_stdout_line_can_be_overwritten:
             # add the final new line after the filtering
             sys.stdout.buffer.write(b"\n")
@@ -1628,6 +1693,132 @@ class SimpleProjectBase(AbstractProject, ABC):
             self.warning("Failed to detect file type for", file, e)
         return False
 
+    def maybe_strip_elf_files(
+        self,
+        files: "typing.Iterable[tuple[Path, Optional[Path]]]",
+        *,
+        print_verbose_only=True,
+        cache_dir: "Optional[Path]" = None,
+    ) -> "set[Path]":
+        """
+        Batched version of maybe_strip_elf_file() for many (input, optional output path) pairs. The ELF headers are
+        read in parallel and llvm-strip is invoked with many files at once, running up to --make-jobs llvm-strip
+        processes in parallel. Files with a separate output path are copied first (using reflinks where possible)
+        and then stripped in place.
+        :param cache_dir: If set, stripped outputs are stored in this directory keyed by the hash of the input file
+        and the strip tool, and files with an output path are copied from there instead of being stripped again.
+        :return: the set of input files that were stripped.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        candidates = []
+        for file, output_path in files:
+            # NB: Must check if it's a symlink first (see maybe_strip_elf_file())
+            if not file.is_symlink() and file.is_file() and self.should_strip_elf_file(file):
+                candidates.append((file, output_path))
+        if not candidates:
+            return set()
+
+        def read_magic(file: Path) -> "Union[bytes, OSError]":
+            try:
+                with file.open("rb") as f:
+                    return f.read(4)
+            except OSError as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=min(32, len(candidates)), thread_name_prefix="elf-magic") as executor:
+            magics = list(executor.map(read_magic, (f for f, _ in candidates)))
+        elf_files = []
+        for (file, output_path), magic in zip(candidates, magics):
+            if isinstance(magic, OSError):
+                self.warning("Failed to detect file type for", file, magic)
+            elif magic == b"\x7fELF":
+                elf_files.append((file, output_path))
+
+        cache_keys: "dict[Path, str]" = {}
+        if cache_dir is not None and not self.config.pretend:
+            strip_tool = shutil.which(str(self.target_info.strip_tool), path=getenv("PATH"))
+            tool_id = executable_fingerprint(strip_tool) if strip_tool else None
+            if tool_id is not None:
+                import hashlib
+
+                inputs = [file for file, output_path in elf_files if output_path is not None]
+                for file, input_hash in self.hashsums(inputs, "sha256").items():
+                    # The strip tool is always run without any flags, so the tool and input identify the output.
+                    key = "\0".join((input_hash, tool_id))
+                    cache_keys[file] = hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+        stripped = set()
+        to_strip: "list[Path]" = []
+        to_cache: "list[tuple[Path, Path]]" = []
+        for file, output_path in elf_files:
+            stripped.add(file)
+            if output_path is None:
+                self.verbose_print("Stripping ELF binary", file)
+                to_strip.append(file)
+                continue
+            self.makedirs(output_path.parent)
+            cached = cache_dir / cache_keys[file][:2] / cache_keys[file] if file in cache_keys else None
+            if cached is not None and cached.is_file():
+                self.verbose_print("Using cached stripped ELF binary", cached, "for", file)
+                self.install_file(cached, output_path, force=True, print_verbose_only=True)
+                with contextlib.suppress(OSError):
+                    os.utime(str(cached))  # Mark as recently used so that it isn't pruned
+                continue
+            self.verbose_print("Stripping ELF binary", file)
+            self.install_file(file, output_path, force=True, print_verbose_only=True)
+            to_strip.append(output_path)
+            if cached is not None:
+                to_cache.append((output_path, cached))
+
+        def strip(chunk: "list[Path]") -> None:
+            self.run_cmd(self.target_info.strip_tool, *chunk, print_verbose_only=print_verbose_only)
+
+        # Split the files into chunks so that all jobs have something to do, but avoid very long command lines.
+        num_jobs = max(1, self.config.make_jobs)
+        chunk_size = max(1, min(100, -(-len(to_strip) // num_jobs)))
+        chunks = [to_strip[i : i + chunk_size] for i in range(0, len(to_strip), chunk_size)]
+        if chunks:
+            with ThreadPoolExecutor(max_workers=min(num_jobs, len(chunks)), thread_name_prefix="strip") as executor:
+                list(executor.map(strip, chunks))  # also re-raises any errors
+        if cache_dir is not None and cache_keys:
+            self._update_strip_cache(cache_dir, to_cache)
+        return stripped
+
+    def _update_strip_cache(self, cache_dir: Path, new_entries: "list[tuple[Path, Path]]") -> None:
+        try:
+            for stripped_file, cached in new_entries:
+                cached.parent.mkdir(parents=True, exist_ok=True)
+                # Use a unique temporary file and rename it since multiple disk images can be built at the same time
+                # (either by other cheribuild processes or by other threads when using --parallel-targets).
+                fd, tmp = tempfile.mkstemp(prefix=cached.name + ".", dir=str(cached.parent))
+                os.close(fd)
+                try:
+                    file_copy_engine.copy_file(stripped_file, Path(tmp))
+                    os.replace(tmp, str(cached))
+                except OSError:
+                    with contextlib.suppress(OSError):
+                        os.unlink(tmp)
+                    raise
+            # Checking every entry is expensive for large caches, so only do it once per cheribuild invocation.
+            if cache_dir not in SimpleProject._pruned_strip_caches:
+                SimpleProject._pruned_strip_caches.add(cache_dir)
+                self._prune_strip_cache(cache_dir)
+        except OSError as e:
+            self.warning("Could not update strip cache", cache_dir, e)
+
+    strip_cache_max_age = 30 * 24 * 60 * 60  # seconds
+    _pruned_strip_caches: "typing.ClassVar[set[Path]]" = set()
+
+    def _prune_strip_cache(self, cache_dir: Path) -> None:
+        # Remove the outputs that have not been used for a while to avoid filling up the disk. Cache hits update the
+        # modification time, so this only removes outputs that have not been used in strip_cache_max_age.
+        expiry = time.time() - self.strip_cache_max_age
+        for cached in self.walk_files(cache_dir):
+            with contextlib.suppress(FileNotFoundError):  # Could have been pruned by a concurrent build
+                if cached.stat().st_mtime < expiry:
+                    cached.unlink()
+
     def should_strip_elf_file(self, f: Path) -> bool:
         if f.suffix == ".o":
             # We musn't strip crt1.o, etc. sice if we do the linker can't find essential symbols such as __start
@@ -0,0 +1,145 @@
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import contextlib
+import json
+import sys
+import threading
+import time
+import typing
+from pathlib import Path
+from typing import Optional
+
+__all__ = ["CommandResourceUsage", "ResourceUsageRecorder", "resource_usage"]
+
+# ru_maxrss is reported in kilobytes on Linux and FreeBSD but in bytes on macOS.
+_MAXRSS_SCALE = 1 if sys.platform == "darwin" else 1024
+
+
+class CommandResourceUsage(typing.NamedTuple):
+    target: Optional[str]  # The target that was being processed when the command was run
+    phase: Optional[str]  # e.g. configure/compile/install or build/test/benchmark outside of Project.process()
+    command: str
+    exit_code: int
+    wall_time: float
+    user_time: float
+    system_time: float
+    max_rss: int  # Peak resident set size in bytes (of the largest process in the tree, not the sum)
+    block_input: int
+    block_output: int
+    voluntary_context_switches: int
+    involuntary_context_switches: int
+
+
+class ResourceUsageRecorder:
+    """
+    Collects the resource usage (as returned by os.wait4()) of every child process that cheribuild waits for and
+    associates it with the target and phase that were active in the thread that started the command.
+    """
+
+    filename = "cheribuild-resource-usage.json"
+
+    def __init__(self) -> None:
+        # Only enabled with --record-resource-usage (otherwise commands are reaped by the normal Popen.wait()).
+        self.enabled = False
+        self.commands: "list[CommandResourceUsage]" = []
+        self._context = threading.local()  # Targets can be built in parallel, so the current target is per-thread.
+
+    @contextlib.contextmanager
+    def context(self, *, target: "Optional[str]" = None, phase: "Optional[str]" = None) -> "typing.Iterator[None]":
+        """Attribute all commands run by the current thread in this scope to target (and phase)."""
+        old = (getattr(self._context, "target", None), getattr(self._context, "phase", None))
+        self._context.target = target if target is not None else old[0]
+        self._context.phase = phase if phase is not None else old[1]
+        try:
+            yield
+        finally:
+            self._context.target, self._context.phase = old
+
+    def record(self, command: str, rusage: "typing.Any", *, wall_time: float, exit_code: int) -> None:
+        # list.append() is atomic, so no locking is needed when building targets in parallel.
+        self.commands.append(
+            CommandResourceUsage(
+                target=getattr(self._context, "target", None),
+                phase=getattr(self._context, "phase", None),
+                command=command,
+                exit_code=exit_code,
+                wall_time=wall_time,
+                user_time=rusage.ru_utime,
+                system_time=rusage.ru_stime,
+                max_rss=rusage.ru_maxrss * _MAXRSS_SCALE,
+                block_input=rusage.ru_inblock,
+                block_output=rusage.ru_oublock,
+                voluntary_context_switches=rusage.ru_nvcsw,
+                involuntary_context_switches=rusage.ru_nivcsw,
+            )
+        )
+
+    def summarize(self) -> "dict[str, dict[str, dict[str, typing.Any]]]":
+        """Aggregate the recorded commands by target and phase (peak RSS is the maximum, everything else the sum)."""
+        result: "dict[str, dict[str, dict[str, typing.Any]]]" = {}
+        for cmd in self.commands:
+            phases = result.setdefault(cmd.target or "(none)", {})
+            totals = phases.setdefault(cmd.phase or "(none)", {"commands": 0, "max_rss": 0, "max_rss_command": None})
+            totals["commands"] += 1
+            for key in (
+                "wall_time",
+                "user_time",
+                "system_time",
+                "block_input",
+                "block_output",
+                "voluntary_context_switches",
+                "involuntary_context_switches",
+            ):
+                totals[key] = totals.get(key, 0) + getattr(cmd, key)
+            if cmd.max_rss > totals["max_rss"]:
+                totals["max_rss"] = cmd.max_rss
+                totals["max_rss_command"] = cmd.command
+        return result
+
+    def write_summary(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            "timestamp": time.time(),
+            "argv": sys.argv,
+            "targets": self.summarize(),
+            "commands": [cmd._asdict() for cmd in self.commands],
+        }
+        path.write_text(json.dumps(data, indent=1), encoding="utf-8")
+
+    def format_summary(self, limit: int = 5) -> str:
+        """The commands with the highest peak RSS and CPU time (including the average number of CPUs used)."""
+        lines = ["Commands with the highest peak RSS:"]
+        for cmd in sorted(self.commands, key=lambda c: -c.max_rss)[:limit]:
+            lines.append(f"  {cmd.max_rss / 2**30:7.2f} GiB  {cmd.target}/{cmd.phase}: {cmd.command[:100]}")
+        lines.append("Commands with the highest CPU time:")
+        for cmd in sorted(self.commands, key=lambda c: -(c.user_time + c.system_time))[:limit]:
+            cpu = cmd.user_time + cmd.system_time
+            parallelism = cpu / cmd.wall_time if cmd.wall_time > 0 else 0.0
+            lines.append(f"  {cpu:9.1f}s (x{parallelism:.1f})  {cmd.target}/{cmd.phase}: {cmd.command[:100]}")
+        return "\n".join(lines)
+
+
+# The global recorder that is updated by processutils for every command that cheribuild runs.
+resource_usage = ResourceUsageRecorder()
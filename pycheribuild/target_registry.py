@@ -0,0 +1,213 @@
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import importlib
+import json
+import os
+import sys
+import typing
+from pathlib import Path
+from typing import Optional
+
+from .completion import sources_cache_key, user_cache_dir
+from .config.loader import ConfigLoaderBase
+from .targets import TargetManager, _TargetAliasBase, target_manager
+
+__all__ = ["TargetRegistry", "import_all_project_modules", "project_module_names"]
+
+
+def project_module_names() -> "list[str]":
+    from . import projects
+    from .projects import cross
+
+    return [pkg.__name__ + "." + name for pkg in (projects, cross) for name in pkg.__all__]
+
+
+def import_all_project_modules() -> None:
+    for name in project_module_names():
+        importlib.import_module(name)
+
+
+class TargetRegistry:
+    """
+    A cache that maps all target names and config option names to the project module that defines them. Loading all
+    project modules (and registering the ~40000 per-target config options) takes multiple seconds, so quick queries such
+    as --list-targets and --get-config-option use this registry to only import the modules that they actually need.
+    The registry is regenerated by a normal cheribuild run whenever any of the pycheribuild sources change.
+    """
+
+    format_version = 1
+
+    def __init__(
+        self,
+        target_modules: "dict[str, str]",
+        listed_targets: "list[tuple[str, bool]]",
+        option_modules: "dict[str, Optional[str]]",
+    ) -> None:
+        self.target_modules = target_modules  # all target names (including aliases) -> module
+        self.listed_targets = listed_targets  # (name, is_hybrid) for all targets shown by --list-targets
+        self.option_modules = option_modules  # option name -> module (None for global options)
+
+    @staticmethod
+    def cache_dir() -> Path:
+        return Path(user_cache_dir())
+
+    @classmethod
+    def cache_path(cls, key: "Optional[str]" = None) -> Path:
+        return cls.cache_dir() / f"target-registry-{key or sources_cache_key()}.json"
+
+    @classmethod
+    def load(cls, path: "Optional[Path]" = None) -> "Optional[TargetRegistry]":
+        """Load the cached registry, returns None if it does not exist or is out of date."""
+        try:
+            with (path or cls.cache_path()).open(encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != cls.format_version:
+                return None
+            modules: "list[str]" = data["modules"]
+            option_modules: "dict[str, Optional[str]]" = {}
+            for index, names in data["options"].items():
+                option_modules.update(dict.fromkeys(names, modules[int(index)] if int(index) >= 0 else None))
+            return cls(
+                target_modules={name: modules[index] for name, index in data["targets"].items()},
+                listed_targets=[(name, bool(hybrid)) for name, hybrid in data["listed_targets"]],
+                option_modules=option_modules,
+            )
+        except (OSError, ValueError, KeyError, IndexError, TypeError, AttributeError):
+            return None
+
+    # noinspection PyProtectedMember
+    @classmethod
+    def generate(cls, manager: TargetManager, loader: ConfigLoaderBase) -> "TargetRegistry":
+        """Create the registry from the targets and options registered by importing all project modules."""
+        target_modules: "dict[str, str]" = {}
+        listed_targets: "list[tuple[str, bool]]" = []
+        for name, target in manager._all_targets.items():
+            target_modules[name] = target.project_class.__module__
+            if not isinstance(target, _TargetAliasBase):
+                listed_targets.append((name, manager.is_hybrid_target(target)))
+        for name, target in manager._targets_for_command_line_options_only.items():
+            target_modules[name] = target.project_class.__module__
+        option_modules: "dict[str, Optional[str]]" = {}
+        for name, handle in loader.option_handles.items():
+            option = handle._get_option()
+            module: "Optional[str]" = None
+            if option._owning_class is not None:
+                module = option._owning_class.__module__
+            elif "/" in name:
+                # Implicitly added fallback options such as cheribsd/build-options
+                module = target_modules.get(name[: name.rfind("/")])
+            option_modules[name] = module
+            # Also include the alternative names that are accepted on the command line and in the config file.
+            if option.shortname and len(option.shortname) > 1:
+                option_modules.setdefault(option.shortname.lstrip("-"), module)
+            for alias in getattr(option, "alias_names", None) or ():
+                option_modules.setdefault(alias, module)
+        # Finally add the remaining command line flags (e.g. actions such as --list-targets and negated booleans).
+        for option_string in getattr(loader, "_parser")._option_string_actions:
+            name = option_string[2:]
+            if option_string.startswith("--") and name not in option_modules:
+                option_modules[name] = target_modules.get(name[: name.rfind("/")]) if "/" in name else None
+        return cls(target_modules, listed_targets, option_modules)
+
+    def save(self, path: "Optional[Path]" = None) -> None:
+        modules = sorted(set(self.target_modules.values()))
+        module_index = {m: i for i, m in enumerate(modules)}
+        options: "dict[int, list[str]]" = {}
+        for name, module in self.option_modules.items():
+            options.setdefault(module_index.get(module, -1) if module is not None else -1, []).append(name)
+        data = {
+            "version": self.format_version,
+            "modules": modules,
+            "targets": {name: module_index[module] for name, module in self.target_modules.items()},
+            "listed_targets": self.listed_targets,
+            "options": options,
+        }
+        path = path or self.cache_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first to avoid other cheribuild instances reading a partially written registry.
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(data, separators=(",", ":")), encoding="utf-8")
+        tmp_path.replace(path)
+        for old in path.parent.glob("target-registry-*.json"):
+            if old != path:
+                old.unlink()
+
+    @classmethod
+    def update_cache(cls, manager: TargetManager, loader: ConfigLoaderBase) -> None:
+        """Regenerate the cached registry if it is missing or out of date (requires all modules to be loaded)."""
+        path = cls.cache_path()
+        if path.exists():
+            return
+        try:
+            cls.generate(manager, loader).save(path)
+        except OSError:
+            pass  # The cache is optional (e.g. the home directory could be read-only)
+
+    def listed_target_names(self, include_hybrid: bool) -> "list[str]":
+        return [name for name, hybrid in self.listed_targets if include_hybrid or not hybrid]
+
+    def modules_for_command_line(self, args: "typing.Sequence[str]") -> "Optional[set[str]]":
+        """
+        Return the modules needed for the options passed on the command line (including the option queried using
+        --get-config-option). Returns None if any of them is not known since we then need to load all modules to be
+        able to report the error.
+        """
+        result: "set[str]" = set()
+        option_names: "list[str]" = []
+        for i, arg in enumerate(args):
+            if arg == "--":
+                break
+            if not arg.startswith("--"):
+                continue  # positional arguments (e.g. option values) and single-character options
+            name = arg[2:].partition("=")[0]
+            option_names.append(name)
+            if name == "get-config-option":
+                if "=" in arg:
+                    option_names.append(arg.partition("=")[2])
+                elif i + 1 < len(args):
+                    option_names.append(args[i + 1])
+        for name in option_names:
+            if name not in self.option_modules:
+                return None
+            module = self.option_modules[name]
+            if module is not None:
+                result.add(module)
+        return result
+
+    def load_target_module(self, name: str) -> bool:
+        """Import the project module that defines target name. Used as the TargetManager.lazy_target_loader"""
+        module = self.target_modules.get(name)
+        if module is None:
+            return False
+        if module in sys.modules:
+            # The target should have been registered when the module was imported, but targets can also be added
+            # by other modules, so fall back to importing everything.
+            if all(m in sys.modules for m in project_module_names()):
+                return False
+            import_all_project_modules()
+        else:
+            importlib.import_module(module)
+        target_manager.register_command_line_options()
+        return True
@@ -28,17 +28,21 @@
 # SUCH DAMAGE.
 #
 import abc
+import concurrent.futures
 import heapq
 import os
 import sys
+import threading
 import time
 import typing
-from collections import OrderedDict
 from typing import Callable, Optional, Union, final
 
 from .config.chericonfig import CheriConfig
 from .config.target_info import AbstractProject, CrossCompileTarget
-from .processutils import set_env
+from .processutils import per_thread_environment, set_env
+from .profiling import profiler
+from .resource_usage import resource_usage
+from .timings import BuildTimingDatabase
 from .utils import (
     AnsiColour,
     add_error_context,
@@ -49,6 +53,10 @@ from .utils import (
     warning_message,
 )
 
+# Creating and setting up projects can instantiate (and set up) other projects, so when running targets in parallel
+# we have to ensure that only one thread modifies the project instances at any given time.
+_project_setup_lock = threading.RLock()
+
 
 class Target:
     instantiating_targets_should_warn: bool = True
@@ -87,8 +95,9 @@ class Target:
         # Note: MultiArchTarget uses cross_target to select the right project (e.g. libcxxrt-native needs
         # libunwind-native path)
         if self.__project is None:
-            self.__project = self.create_project(config)
-            self.cache_dependencies(config)
+            with profiler.phase("create project", "target", target=self.name):
+                self.__project = self.create_project(config)
+                self.cache_dependencies(config)
         assert self.__project is not None
         return self.__project
 
@@ -99,14 +108,17 @@ class Target:
     ) -> "AbstractProject":
         if caller is not None:
             assert caller._init_called, "Cannot call this inside __init__()"
-        project = self._get_or_create_project_no_setup(cross_target, config, caller)
-        self._check_system_deps(config, project)
-        if not project._setup_called:
-            project.setup()
-            assert project._setup_called, f"{self._project_class}: forgot to call super().setup()?"
-        if not project._setup_late_called:
-            project.setup_late()
-            assert project._setup_late_called, f"{self._project_class}: forgot to call super().setup_late()?"
+        with _project_setup_lock:
+            project = self._get_or_create_project_no_setup(cross_target, config, caller)
+            self._check_system_deps(config, project)
+            if not project._setup_called:
+                with profiler.phase("setup", "target", target=self.name):
+                    project.setup()
+                assert project._setup_called, f"{self._project_class}: forgot to call super().setup()?"
+            if not project._setup_late_called:
+                with profiler.phase("setup_late", "target", target=self.name):
+                    project.setup_late()
+                assert project._setup_late_called, f"{self._project_class}: forgot to call super().setup_late()?"
         return project
 
     def get_dependencies(self, config: CheriConfig) -> "list[Target]":
@@ -120,12 +132,13 @@ class Target:
     def _check_system_deps(self, config: CheriConfig, project: "AbstractProject"):
         if project._system_deps_checked:
             return
-        with set_env(PATH=config.dollar_path_with_other_tools, config=config):
-            # make sure all system dependencies exist first
-            project.check_system_dependencies()
-            assert project._system_deps_checked, (
-                f"{self._project_class}: forgot to call super().check_system_dependencies()?"
-            )
+        with profiler.phase("check system dependencies", "target", target=self.name):
+            with set_env(PATH=config.dollar_path_with_other_tools, config=config):
+                # make sure all system dependencies exist first
+                project.check_system_dependencies()
+                assert project._system_deps_checked, (
+                    f"{self._project_class}: forgot to call super().check_system_dependencies()?"
+                )
 
     def check_system_deps(self, config: CheriConfig) -> None:
         # check_system_deps should be called before setup()
@@ -145,10 +158,11 @@ class Target:
         return self.project_class(config, crosscompile_target=self.xtarget)
 
     # noinspection PyProtectedMember
-    def _do_run(self, config, msg: str, func: "Callable[[AbstractProject], typing.Any]"):
+    def _do_run(self, config, msg: str, func: "Callable[[AbstractProject], typing.Any]", action: str):
         assert self.__project is not None, "Should have been initialized in check_system_deps()"
         # noinspection PyProtectedMember
-        self.cache_dependencies(config)
+        with profiler.phase("cache dependencies", "target", target=self.name):
+            self.cache_dependencies(config)
         # instantiate the project and run it
         starttime = time.time()
         with add_error_context(coloured(AnsiColour.yellow, "(in target ", self.name, ")", sep="")):
@@ -156,16 +170,34 @@ class Target:
             new_env = {"PATH": project.config.dollar_path_with_other_tools}
             if project.config.clang_colour_diags:
                 new_env["CLANG_FORCE_COLOR_DIAGNOSTICS"] = "always"
-            with set_env(**new_env, config=config):
-                func(project)
-            status_update(msg, "for target '" + self.name + "' in", time.time() - starttime, "seconds")
+            with set_env(**new_env, config=config), profiler.phase(action, "target", target=self.name):
+                with resource_usage.context(target=self.name, phase=action):
+                    func(project)
+            duration = time.time() - starttime
+            status_update(msg, "for target '" + self.name + "' in", duration, "seconds")
+            self._record_timing(config, project, action, duration)
+
+    def _record_timing(self, config: CheriConfig, project: "AbstractProject", action: str, duration: float) -> None:
+        if not config.record_build_timings or config.pretend or getattr(self.project_class, "is_alias", False):
+            return
+        # Don't let builds that were skipped by --skip-unchanged-targets distort the recorded build times.
+        if action == "build" and getattr(project, "build_was_up_to_date", False):
+            return
+        suffix_fn = getattr(project, "build_configuration_suffix", None)
+        BuildTimingDatabase.for_config(config).record(
+            self.name,
+            config=suffix_fn() if suffix_fn is not None else "",
+            action=action,
+            seconds=duration,
+            phases=getattr(project, "phase_timings", None) if action == "build" else None,
+        )
 
     def execute(self, config: CheriConfig) -> None:
         if self._completed:
             # TODO: make this an error once I have a clean solution for the pseudo targets
             warning_message(self.name, "has already been executed!")
             return
-        self._do_run(config, msg="Built", func=lambda project: project.process())
+        self._do_run(config, msg="Built", func=lambda project: project.process(), action="build")
         self._completed = True
 
     def run_tests(self, config: "CheriConfig"):
@@ -173,7 +205,7 @@ class Target:
             # TODO: make this an error once I have a clean solution for the pseudo targets
             warning_message(self.name, "has already been tested!")
             return
-        self._do_run(config, msg="Ran tests", func=lambda project: project.run_tests())
+        self._do_run(config, msg="Ran tests", func=lambda project: project.run_tests(), action="test")
         self._tests_have_run = True
 
     def run_benchmarks(self, config: "CheriConfig"):
@@ -181,7 +213,7 @@ class Target:
             # TODO: make this an error once I have a clean solution for the pseudo targets
             warning_message(self.name, "has already been benchmarked!")
             return
-        self._do_run(config, msg="Ran benchmarks", func=lambda project: project.run_benchmarks())
+        self._do_run(config, msg="Ran benchmarks", func=lambda project: project.run_benchmarks(), action="benchmark")
         self._benchmarks_have_run = True
 
     def reset(self) -> None:
@@ -384,6 +416,10 @@ class TargetManager:
     def __init__(self) -> None:
         self._all_targets: "dict[str, Target]" = {}
         self._targets_for_command_line_options_only: "dict[str, MultiArchTargetAlias]" = {}
+        self._targets_with_options: "set[str]" = set()
+        # Called with the name of a target that has not been registered yet (used when lazily importing project
+        # modules). Returns True if this may have added the target.
+        self.lazy_target_loader: "Optional[Callable[[str], bool]]" = None
 
     def add_target_for_config_options_only(self, target: MultiArchTargetAlias) -> None:
         # TODO remove this ugly hack
@@ -405,20 +441,26 @@ class TargetManager:
         # this cannot be done in the Project metaclass as otherwise we get
         # RuntimeError: super(): empty __class__ cell
         # https://stackoverflow.com/questions/13126727/how-is-super-in-python-3-implemented/28605694#28605694
-        for tgt in self._all_targets.values():
-            if not isinstance(tgt, _TargetAliasBase):
+        # Only handle targets that were added since the last call (project modules can be imported lazily).
+        for tgt in list(self._all_targets.values()):
+            if not isinstance(tgt, _TargetAliasBase) and tgt.name not in self._targets_with_options:
                 tgt.project_class.setup_config_options()
+                self._targets_with_options.add(tgt.name)
+
+    @staticmethod
+    def is_hybrid_target(target: Target) -> bool:
+        xtarget = target.xtarget
+        # NB: We allow hybrid for baremetal targets (for now...)
+        return (
+            xtarget.get_rootfs_target().is_cheri_hybrid()
+            and not xtarget.target_info_cls.is_baremetal()
+            and not xtarget.is_native()
+        )
 
     @staticmethod
     def target_disabled_reason(target: Target, config: CheriConfig) -> Optional[str]:
         if not config.enable_hybrid_targets:
-            xtarget = target.xtarget
-            # NB: We allow hybrid for baremetal targets (for now...)
-            if (
-                xtarget.get_rootfs_target().is_cheri_hybrid()
-                and not xtarget.target_info_cls.is_baremetal()
-                and not xtarget.is_native()
-            ):
+            if TargetManager.is_hybrid_target(target):
                 return (
                     f"{target.name} is a hybrid target, which should not be used unless you know what you're doing. "
                     "If you are still sure you want to build this, use --enable-hybrid-targets."
@@ -453,7 +495,11 @@ class TargetManager:
         # return the actual target without resolving MultiArchTargetAlias
         result = self._all_targets.get(name)
         if result is None:
-            result = self._targets_for_command_line_options_only[name]
+            result = self._targets_for_command_line_options_only.get(name)
+        if result is None:
+            if self.lazy_target_loader is not None and self.lazy_target_loader(name):
+                return self.get_target_raw(name)
+            raise KeyError(name)
         return result
 
     def get_target(
@@ -480,18 +526,34 @@ class TargetManager:
         return target
 
     @staticmethod
-    def sort_in_dependency_order(targets: "typing.Iterable[Target]") -> "list[Target]":
-        # remove duplicates (insert into an orderdict to keep order)
-        targets = list(OrderedDict((x, True) for x in targets).keys())
-        # Perform a topological sort using Kahn's algorithm
+    def _dependency_edges(
+        targets: "typing.Iterable[Target]", config: CheriConfig
+    ) -> "tuple[list[Target], dict[Target, int], dict[Target, list[Target]]]":
+        """Return the deduplicated targets, the number of dependencies of each target that are also part of targets
+        and a mapping from each target to the targets that depend on it."""
+        # remove duplicates (insert into a dict to keep order)
+        targets = list(dict.fromkeys(targets))
+        # noinspection PyProtectedMember
+        graph = config._dependency_graph
+        node_ids = [graph.node_id(node.name) for node in targets]
+        by_id: "dict[int, Target]" = dict(zip(node_ids, targets))
         in_degree = {node: 0 for node in targets}
         adj: "dict[Target, list[Target]]" = {node: [] for node in targets}
-
-        for node in targets:
-            for dep in node.project_class.cached_full_dependencies():
-                if dep in adj:
+        for node_id, node in zip(node_ids, targets):
+            dependencies = graph.closure_ids(node_id, graph.FULL_DEPENDENCIES)
+            if dependencies is None:
+                raise ValueError("Dependencies of " + node.name + " have not been cached")
+            for dep_id in dependencies:
+                dep = by_id.get(dep_id)
+                if dep is not None:
                     adj[dep].append(node)
                     in_degree[node] += 1
+        return targets, in_degree, adj
+
+    @staticmethod
+    def sort_in_dependency_order(targets: "typing.Iterable[Target]", config: CheriConfig) -> "list[Target]":
+        # Perform a topological sort using Kahn's algorithm
+        targets, in_degree, adj = TargetManager._dependency_edges(targets, config)
         # Place the starting nodes (those with no dependencies) in the queue and work from there.
         # Find starting nodes (those with no dependencies) and add them to a priority queue.
         # The priority queue will always return the node with the smallest name.
@@ -513,26 +575,132 @@ class TargetManager:
 
         if len(result) != len(targets):
             raise ValueError("A cycle was detected in the dependency graph.")
-        # Ensure that we got a valid result by running a stable sort and comparing.
-        assert result == list(sorted(result))
+        # Ensure that we got a valid result (all dependencies are ordered before the targets that depend on them).
+        position = {node: i for i, node in enumerate(result)}
+        assert all(position[node] > position[dep] for dep, dependents in adj.items() for node in dependents)
         return result
 
+    @staticmethod
+    def run_in_dependency_order(
+        targets: "list[Target]", func: "Callable[[Target], typing.Any]", config: CheriConfig, *, max_parallel: int
+    ) -> None:
+        """
+        Call func for each of the targets, running up to max_parallel calls concurrently. A target is only started
+        once all its dependencies in targets have completed successfully. Ready targets are started in the order in
+        which they appear in targets (normally the result of sort_in_dependency_order()).
+        If any call fails, no further targets are started and the first exception is re-raised once all running
+        calls have finished.
+        """
+        targets, in_degree, adj = TargetManager._dependency_edges(targets, config)
+        order = {node: i for i, node in enumerate(targets)}
+        ready = [(order[node], node) for node in targets if in_degree[node] == 0]
+        heapq.heapify(ready)
+        errors: "list[BaseException]" = []
+        completed = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix="target") as executor:
+            running: "dict[concurrent.futures.Future, Target]" = {}
+            while ready or running:
+                while ready and len(running) < max_parallel and not errors:
+                    _, node = heapq.heappop(ready)
+                    running[executor.submit(func, node)] = node
+                if not running:
+                    break
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    node = running.pop(future)
+                    exception = future.exception()
+                    if exception is not None:
+                        errors.append(exception)
+                        continue
+                    completed += 1
+                    for neighbour in adj[node]:
+                        in_degree[neighbour] -= 1
+                        if in_degree[neighbour] == 0:
+                            heapq.heappush(ready, (order[neighbour], neighbour))
+        if errors:
+            raise errors[0]
+        if completed != len(targets):
+            raise ValueError("A cycle was detected in the dependency graph.")
+
+    def execute_in_parallel(self, targets: "list[Target]", config: CheriConfig, *, pipeline_tests=False) -> None:
+        """Build targets, running up to --parallel-targets independent targets at the same time.
+        The --make-jobs budget is shared between the targets that can run concurrently (either by splitting it evenly
+        or by using the --jobserver).
+        If pipeline_tests is set, the tests for each target are queued on a separate worker as soon as the target
+        (and therefore all its dependencies) has been built. Tests are run one at a time in the order in which the
+        targets finished building."""
+        max_parallel = max(1, min(config.parallel_targets, len(targets)))
+        jobs_per_target = config.make_jobs
+        if max_parallel == 1:
+            if not pipeline_tests:
+                for target in targets:
+                    target.execute(config)
+                return
+        elif config.use_jobserver:
+            # All build tools share the jobserver tokens, so there is no need to split the jobs between targets.
+            status_update("Building up to", max_parallel, "independent targets in parallel using the jobserver")
+        else:
+            jobs_per_target = max(1, config.make_jobs // max_parallel)
+            status_update(
+                "Building up to", max_parallel, "independent targets in parallel using", jobs_per_target, "jobs each"
+            )
+        # Set the common environment once for all targets. Any further set_env() calls (e.g. the SDK bindir that
+        # CrossCompileProject adds to $PATH) only apply to the commands started by the thread building that target.
+        new_env = {"PATH": config.dollar_path_with_other_tools}
+        if config.clang_colour_diags:
+            new_env["CLANG_FORCE_COLOR_DIAGNOSTICS"] = "always"
+        with set_env(**new_env, config=config), per_thread_environment():
+            if pipeline_tests:
+                self._build_with_pipelined_tests(
+                    targets, config, max_parallel=max_parallel, jobs_per_target=jobs_per_target
+                )
+            else:
+
+                def build(target: Target) -> None:
+                    with config.thread_make_jobs(jobs_per_target):
+                        target.execute(config)
+
+                self.run_in_dependency_order(targets, build, config, max_parallel=max_parallel)
+
+    def _build_with_pipelined_tests(
+        self, targets: "list[Target]", config: CheriConfig, *, max_parallel: int, jobs_per_target: int
+    ) -> None:
+        # Only the build threads use the reduced job count, the tests run one at a time and can use all --make-jobs.
+        test_futures: "list[concurrent.futures.Future]" = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="tests") as test_executor:
+
+            def build_and_queue_tests(target: Target) -> None:
+                # Stop building if one of the already queued tests failed.
+                for future in test_futures:
+                    if future.done() and future.exception() is not None:
+                        raise typing.cast(BaseException, future.exception())
+                with config.thread_make_jobs(jobs_per_target):
+                    target.execute(config)
+                test_futures.append(test_executor.submit(target.run_tests, config))
+
+            try:
+                self.run_in_dependency_order(targets, build_and_queue_tests, config, max_parallel=max_parallel)
+            except BaseException:
+                # Don't start any further tests if the build failed (the currently running one will complete).
+                for future in test_futures:
+                    future.cancel()
+                raise
+        for future in test_futures:
+            future.result()
+
     def get_all_targets(self, explicit_targets: "list[Target]", config: CheriConfig) -> "list[Target]":
-        chosen_targets: "list[Target]" = []
+        # Use a dict as an ordered set to avoid adding duplicates without quadratic list lookups.
+        chosen_targets: "dict[Target, None]" = {}
         for t in explicit_targets:
             if isinstance(t, SimpleTargetAlias):
                 t = t.get_real_target(None, config)
-            # Ensure we don't add any duplicates to ensure correct order
-            # TODO: this can go away once we properly implement target sorting without the cached_deps hack.
-            if t not in chosen_targets and not config.only_dependencies:
-                chosen_targets.append(t)
-            for dep in t.get_dependencies(config):
-                if dep not in chosen_targets:
-                    chosen_targets.append(dep)
+            if not config.only_dependencies:
+                chosen_targets[t] = None
+            chosen_targets.update(dict.fromkeys(t.get_dependencies(config)))
         for t in chosen_targets:
             # Initialize the full dependency cache so that sort() works (otherwise we'd have to pass config to __lt__).
             t.cache_dependencies(config)
-        sort = self.sort_in_dependency_order(chosen_targets)
+        sort = self.sort_in_dependency_order(chosen_targets, config)
         to_find = config.start_with if config.start_with is not None else config.start_after
         if to_find is not None:
             assert config.start_with is None or config.start_after is None, "Can't have both set"
@@ -0,0 +1,237 @@
+#
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import json
+import statistics
+import threading
+import time
+import typing
+from pathlib import Path
+from typing import Optional
+
+if typing.TYPE_CHECKING:  # no-combine
+    from .config.chericonfig import CheriConfig  # no-combine
+
+__all__ = [
+    "BUILD_PHASES",
+    "BuildTimingDatabase",
+    "TargetTimingSummary",
+    "TimingRecord",
+    "critical_path",
+    "format_timing_report",
+    "summarize_timings",
+]
+
+# The phases of Project.process() that are timed individually (in execution order).
+BUILD_PHASES = ("update", "configure", "compile", "install")
+
+
+class TimingRecord(typing.NamedTuple):
+    target: str
+    config: str  # The build configuration suffix (e.g. -asan), different configurations are reported separately.
+    action: str  # build/test/benchmark
+    timestamp: float
+    seconds: float
+    phases: "dict[str, float]"
+
+
+class BuildTimingDatabase:
+    """
+    An append-only database of the time spent on each target. Every target that was built/tested/benchmarked results
+    in one JSON object per line, which makes it safe to append to concurrently and easy to post-process.
+    """
+
+    filename = "cheribuild-timings.jsonl"
+    _lock = threading.Lock()  # Targets can be built in parallel (and all instances usually share the same file).
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    @classmethod
+    def for_config(cls, config: "CheriConfig") -> "BuildTimingDatabase":
+        return cls(config.build_root / cls.filename)
+
+    def add(self, record: TimingRecord) -> None:
+        line = json.dumps(record._asdict(), sort_keys=True) + "\n"
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a", encoding="utf-8") as f:
+                f.write(line)
+
+    def load(self) -> "list[TimingRecord]":
+        result: "list[TimingRecord]" = []
+        try:
+            lines = self.path.read_text(encoding="utf-8").splitlines()
+        except FileNotFoundError:
+            return result
+        for line in lines:
+            try:
+                value = json.loads(line)
+                result.append(
+                    TimingRecord(
+                        target=str(value["target"]),
+                        config=str(value.get("config", "")),
+                        action=str(value["action"]),
+                        timestamp=float(value["timestamp"]),
+                        seconds=float(value["seconds"]),
+                        phases={str(k): float(v) for k, v in value.get("phases", {}).items()},
+                    )
+                )
+            except (ValueError, KeyError, TypeError, AttributeError):
+                continue  # Ignore truncated lines (e.g. from a build that was killed while writing)
+        return result
+
+    def record(
+        self, target: str, config: str, action: str, seconds: float, phases: "Optional[dict[str, float]]" = None
+    ) -> None:
+        self.add(TimingRecord(target, config, action, time.time(), seconds, dict(phases or {})))
+
+
+class TargetTimingSummary(typing.NamedTuple):
+    target: str
+    config: str
+    runs: int
+    build_seconds: float  # Mean over the considered runs
+    last_build_seconds: float
+    phases: "dict[str, float]"  # Mean time spent in each phase
+    test_seconds: Optional[float]
+
+
+def _mean(values: "list[float]") -> float:
+    return statistics.fmean(values) if values else 0.0
+
+
+def summarize_timings(records: "list[TimingRecord]", max_runs: int = 10) -> "dict[str, TargetTimingSummary]":
+    """Summarize the most recent max_runs runs of each target. If a target has been built with different
+    configurations, only runs with the same configuration as the most recent one are considered."""
+    by_target: "dict[str, list[TimingRecord]]" = {}
+    for record in sorted(records, key=lambda r: r.timestamp):
+        by_target.setdefault(record.target, []).append(record)
+    result: "dict[str, TargetTimingSummary]" = {}
+    for target, target_records in by_target.items():
+        config = target_records[-1].config
+        matching = [r for r in target_records if r.config == config]
+        builds = [r for r in matching if r.action == "build"][-max_runs:]
+        tests = [r.seconds for r in matching if r.action == "test"][-max_runs:]
+        if not builds and not tests:
+            continue
+        result[target] = TargetTimingSummary(
+            target=target,
+            config=config,
+            runs=len(builds),
+            build_seconds=_mean([r.seconds for r in builds]),
+            last_build_seconds=builds[-1].seconds if builds else 0.0,
+            phases={phase: _mean([r.phases.get(phase, 0.0) for r in builds]) for phase in BUILD_PHASES},
+            test_seconds=_mean(tests) if tests else None,
+        )
+    return result
+
+
+def critical_path(
+    targets: "typing.Sequence[str]",
+    dependencies: "typing.Mapping[str, typing.Iterable[str]]",
+    durations: "typing.Mapping[str, float]",
+) -> "tuple[float, list[str]]":
+    """
+    Compute the longest (most expensive) chain of dependencies, i.e. the lower bound for the wall-clock time of a build
+    with unlimited parallelism. targets must be sorted in dependency order, dependencies on targets that are not
+    included in targets are ignored.
+    """
+    finish_time: "dict[str, float]" = {}
+    predecessor: "dict[str, Optional[str]]" = {}
+    for target in targets:
+        start, prev = 0.0, None
+        for dep in dependencies.get(target, ()):
+            if dep in finish_time and finish_time[dep] > start:
+                start, prev = finish_time[dep], dep
+        finish_time[target] = start + durations.get(target, 0.0)
+        predecessor[target] = prev
+    if not finish_time:
+        return 0.0, []
+    last: "Optional[str]" = max(targets, key=lambda t: finish_time[t])
+    total = finish_time[last]
+    path: "list[str]" = []
+    while last is not None:
+        path.append(last)
+        last = predecessor[last]
+    return total, path[::-1]
+
+
+def _format_seconds(seconds: "Optional[float]") -> str:
+    if seconds is None:
+        return "-"
+    if seconds >= 3600:
+        return f"{seconds / 3600:.1f}h"
+    if seconds >= 60:
+        return f"{seconds / 60:.1f}m"
+    return f"{seconds:.1f}s"
+
+
+def format_timing_report(
+    summaries: "typing.Mapping[str, TargetTimingSummary]",
+    targets: "typing.Sequence[str]",
+    dependencies: "typing.Mapping[str, typing.Iterable[str]]",
+) -> str:
+    """Format a table of the recorded timings for targets (sorted in dependency order) and the critical path."""
+    targets = [t for t in targets if t in summaries]
+    if not targets:
+        return "No build timings have been recorded for the selected targets."
+    headers = ["Target", "Runs", "Mean", "Last", *BUILD_PHASES, "other", "test"]
+    rows = [headers]
+    for name in targets:
+        summary = summaries[name]
+        other = max(0.0, summary.build_seconds - sum(summary.phases.values()))
+        last = _format_seconds(summary.last_build_seconds)
+        if summary.runs > 1 and summary.build_seconds > 0:
+            change = (summary.last_build_seconds - summary.build_seconds) / summary.build_seconds
+            if abs(change) >= 0.1:
+                last += f" ({change:+.0%})"
+        rows.append(
+            [
+                f"{name} [{summary.config}]" if summary.config and not name.endswith(summary.config) else name,
+                str(summary.runs),
+                _format_seconds(summary.build_seconds),
+                last,
+                *(_format_seconds(summary.phases[phase]) for phase in BUILD_PHASES),
+                _format_seconds(other),
+                _format_seconds(summary.test_seconds),
+            ]
+        )
+    widths = [max(len(row[i]) for row in rows) for i in range(len(headers))]
+    lines = [
+        "  ".join(cell.ljust(widths[i]) if i == 0 else cell.rjust(widths[i]) for i, cell in enumerate(row)).rstrip()
+        for row in rows
+    ]
+    durations = {name: summaries[name].build_seconds for name in targets}
+    total = sum(durations.values())
+    path_seconds, path = critical_path(targets, dependencies, durations)
+    lines.append("")
+    lines.append(f"Total build time (all targets built serially): {_format_seconds(total)}")
+    lines.append(f"Critical path ({_format_seconds(path_seconds)}):")
+    for name in path:
+        share = durations[name] / path_seconds if path_seconds else 0.0
+        lines.append(f"  {name} {_format_seconds(durations[name])} ({share:.0%})")
+    if path_seconds > 0:
+        lines.append(f"Maximum speedup from building targets in parallel: {total / path_seconds:.2f}x")
+    return "\n".join(lines)
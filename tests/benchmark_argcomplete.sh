@@ -3,6 +3,7 @@
 set -xe
 
 export _ARGCOMPLETE=1
+# _ARGCOMPLETE_BENCHMARK bypasses the completion index, see benchmark_completion.py for the fast path.
 export _ARGCOMPLETE_BENCHMARK=1
 python3 -m cProfile -o ./cheribuild.prof ../cheribuild.py
 snakeviz ./cheribuild.prof
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# Measure how long it takes to answer tab-completion requests from the cached completion index.
+# The index is generated by running cheribuild once, which is included in the "first run" timing.
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+CHERIBUILD = Path(__file__).absolute().parent.parent / "cheribuild.py"
+RUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+MAX_LATENCY = 0.05
+
+
+def complete(env: "dict[str, str]", line: str) -> "list[str]":
+    with tempfile.NamedTemporaryFile() as output:
+        subprocess.run(
+            [sys.executable, str(CHERIBUILD)],
+            check=True,
+            env={
+                **env,
+                "_ARGCOMPLETE": "1",
+                "_ARGCOMPLETE_STDOUT_FILENAME": output.name,
+                "COMP_LINE": line,
+                "COMP_POINT": str(len(line)),
+            },
+        )
+        return Path(output.name).read_text().split("\013")
+
+
+def measure(env: "dict[str, str]", line: str) -> float:
+    times = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        complete(env, line)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+with tempfile.TemporaryDirectory() as cache_dir:
+    env = {**os.environ, "XDG_CACHE_HOME": cache_dir}
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, str(CHERIBUILD), "--pretend", "--skip-update", "--list-targets"],
+        check=True,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    print(f"first run (generates the index):      {time.perf_counter() - start:.3f}s")
+    assert "cheribsd-riscv64-purecap " in complete(env, "cheribuild.py cheribsd-riscv64-pur")
+    results = {
+        "target name": measure(env, "cheribuild.py cheribsd-"),
+        "option name": measure(env, "cheribuild.py --cheribsd/"),
+        "option value": measure(env, "cheribuild.py --llvm-native/build-type "),
+    }
+    for kind, latency in results.items():
+        print(f"complete {kind + ':':<29} {latency * 1000:.1f}ms")
+    if max(results.values()) > MAX_LATENCY:
+        sys.exit(f"Completion latency exceeds {MAX_LATENCY * 1000:.0f}ms")
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# Measure how long it takes to resolve (and sort) the dependencies of all targets.
+# Startup time (loading all projects and parsing arguments) is measured using --list-targets and subtracted.
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+CHERIBUILD = Path(__file__).absolute().parent.parent / "cheribuild.py"
+RUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+
+def measure(*args: str) -> float:
+    times = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, str(CHERIBUILD), "--pretend", "--skip-update", "--enable-hybrid-targets", *args],
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+startup = measure("--list-targets")
+resolve_all = measure("--print-targets-only", "--include-dependencies", "__run_everything__")
+print(f"startup (--list-targets):             {startup:.3f}s")
+print(f"resolve all targets (-d, sorted):     {resolve_all:.3f}s")
+print(f"dependency resolution and sorting:    {resolve_all - startup:.3f}s")
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# Measure how long it takes to parse a METALOG file (and how much memory the parsed tree needs).
+# Note: this creates the parsed METALOG cache file next to the METALOG.
+# Usage: benchmark_metalog.py [METALOG] [RUNS]
+# If no METALOG is given, the first $HOME/cheri/output/rootfs-*/METALOG.world file is used.
+import io
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent))
+from pycheribuild.mtree import MtreeFile  # noqa: E402
+
+if len(sys.argv) > 1:
+    METALOG = Path(sys.argv[1])
+else:
+    METALOG = next(iter(sorted(Path.home().glob("cheri/output/rootfs-*/METALOG.world"))), None)
+    if METALOG is None:
+        sys.exit("No METALOG.world found, please pass the path to a METALOG file as the first argument")
+RUNS = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+
+def measure(fn) -> float:
+    times = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+mtree = MtreeFile(verbose=False, file=METALOG)
+num_lines = sum(1 for _ in METALOG.open("rb"))
+load = measure(lambda: MtreeFile(verbose=False, file=METALOG))
+CACHE_DIR = Path(tempfile.mkdtemp())
+MtreeFile(verbose=False).load(METALOG, append=False, cache_dir=CACHE_DIR)  # create the cache
+cached_load = measure(lambda: MtreeFile(verbose=False).load(METALOG, append=False, cache_dir=CACHE_DIR))
+shutil.rmtree(CACHE_DIR)
+write = measure(lambda: mtree.write(io.StringIO(), pretend=False))
+tracemalloc.start()
+MtreeFile(verbose=False, file=METALOG)
+peak_memory = tracemalloc.get_traced_memory()[1]
+tracemalloc.stop()
+print(f"{METALOG}: {num_lines} lines, {len(mtree.root)} entries")
+print(f"load:                {load:.3f}s")
+print(f"load (cached):       {cached_load:.3f}s")
+print(f"write:               {write:.3f}s")
+print(f"peak memory (load):  {peak_memory / (1024 * 1024):.1f} MiB")
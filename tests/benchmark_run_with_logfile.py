@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# Replay a captured buildworld log (or a synthetic one) through SimpleProject.run_with_logfile() using the CheriBSD
+# output filter and report the CPU time used by cheribuild. For comparison, the same log is also processed by a
+# line-by-line reader that flushes stdout after every line (how run_with_logfile() used to work).
+# Usage: benchmark_run_with_logfile.py [buildworld.log]
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent))
+sys.path.insert(0, str(Path(__file__).absolute().parent))
+from setup_mock_chericonfig import setup_mock_chericonfig  # noqa: E402
+
+from pycheribuild.config.compilation_targets import CompilationTargets  # noqa: E402
+from pycheribuild.projects.cross.cheribsd import BuildCHERIBSD  # noqa: E402
+from pycheribuild.projects.project import DefaultInstallDir, ExternallyManagedSourceRepository, Project  # noqa: E402
+
+
+class ReplayProject(Project):
+    do_not_add_to_targets = True
+    target = "replay-buildworld-log"
+    default_directory_basename = "replay-buildworld-log"
+    _xtarget = CompilationTargets.NATIVE
+    _should_not_be_instantiated = False
+    default_install_dir = DefaultInstallDir.DO_NOT_INSTALL
+    repository = ExternallyManagedSourceRepository()
+
+    @classmethod
+    def cached_full_dependencies(cls):
+        return []
+
+    def _stdout_filter(self, line: bytes) -> None:
+        BuildCHERIBSD._stdout_filter(self, line)  # type: ignore[arg-type]
+
+
+def write_synthetic_log(path: Path, lines: int = 500_000) -> None:
+    with path.open("w") as f:
+        for i in range(lines):
+            if i % 50_000 == 0:
+                f.write(f">>> stage {i // 50_000}: building libraries\n")
+            elif i % 200 == 0:
+                f.write(f"===> lib/lib{i // 200} (all)\n")
+            else:
+                f.write(
+                    f"/output/sdk/bin/clang -target riscv64-unknown-freebsd15.0 -march=rv64gcxcheri -O2 -pipe -g "
+                    f"-DNDEBUG -fPIC -I/source/cheribsd/lib/lib{i // 200} -Wall -Wextra -c file{i}.c -o file{i}.o\n"
+                )
+
+
+def line_by_line_baseline(args: "list[str]", logfile: Path, project: ReplayProject) -> None:
+    lock = threading.Lock()
+    with logfile.open("ab") as log:
+        proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        def handle_stderr():
+            for line in proc.stderr:
+                with lock:
+                    sys.stderr.buffer.write(line)
+                    sys.stderr.flush()
+                    log.write(line)
+
+        stderr_thread = threading.Thread(target=handle_stderr)
+        stderr_thread.start()
+        for line in proc.stdout:
+            with lock:
+                log.write(line)
+                project._stdout_filter(line)
+        proc.wait()
+        stderr_thread.join()
+
+
+def measure(name: str, fn) -> None:
+    saved_stdout = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    try:
+        os.dup2(devnull, 1)
+        fn()
+        sys.stdout.flush()
+    finally:
+        os.dup2(saved_stdout, 1)
+        os.close(devnull)
+        os.close(saved_stdout)
+    wall, cpu = time.perf_counter() - start_wall, time.process_time() - start_cpu
+    print(f"{name:<30} wall {wall:6.2f}s  cheribuild CPU {cpu:6.2f}s")
+
+
+with tempfile.TemporaryDirectory() as td:
+    log_path = Path(sys.argv[1]) if len(sys.argv) > 1 else Path(td, "buildworld.log")
+    if len(sys.argv) <= 1:
+        write_synthetic_log(log_path)
+    print(f"Replaying {log_path} ({log_path.stat().st_size / 1e6:.1f} MB)")
+    config = setup_mock_chericonfig(Path(td), pretend=False)
+    config.verbose = False
+    ReplayProject.setup_config_options()
+    project = ReplayProject(config, crosscompile_target=CompilationTargets.NATIVE)
+    cmd = ["cat", str(log_path)]
+    measure(
+        "line-by-line (previous)",
+        lambda: line_by_line_baseline(cmd, Path(td, "baseline.log"), project),
+    )
+    project._last_stdout_line_can_be_overwritten = False
+    measure(
+        "run_with_logfile()",
+        lambda: project.run_with_logfile(cmd, Path(td, "replay.log"), stdout_filter=project._stdout_filter, cwd=Path(td)),
+    )
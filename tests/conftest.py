@@ -34,3 +34,10 @@ def _register_targets():
     SimpleProject._config_loader = loader
     target_manager.register_command_line_options()
     ConfigLoaderBase._cheri_config.load()
+    return loader
+
+
+@pytest.fixture(scope="session")
+def default_config_loader(_register_targets: DefaultCheribuildConfigLoader) -> DefaultCheribuildConfigLoader:
+    """The config loader that all target options have been registered with."""
+    return _register_targets
@@ -1,5 +1,5 @@
-import collections
 import inspect
+import os
 import re
 import sys
 import tempfile
@@ -17,7 +17,9 @@ import pytest
 from pycheribuild.config.compilation_targets import CompilationTargets, FreeBSDTargetInfo
 from pycheribuild.config.defaultconfig import CheribuildAction, DefaultCheriConfig
 from pycheribuild.config.loader import ConfigLoaderBase, ConfigOptionHandle, JsonAndCommandLineConfigOption
+from pycheribuild.dependency_graph import DependencyGraph
 from pycheribuild.jenkins_utils import jenkins_override_install_dirs_hack
+from pycheribuild.jobserver import Jobserver
 
 # noinspection PyUnresolvedReferences
 from pycheribuild.projects import *  # noqa: F401, F403, RUF100
@@ -34,7 +36,7 @@ from pycheribuild.projects.cross.qt5 import BuildQtBase
 
 # noinspection PyProtectedMember
 from pycheribuild.projects.disk_image import BuildCheriBSDDiskImage, BuildDiskImageBase
-from pycheribuild.projects.project import Project
+from pycheribuild.projects.project import MakeCommandKind, Project
 from pycheribuild.projects.run_qemu import LaunchCheriBSD
 
 # Override the default config loader:
@@ -67,7 +69,7 @@ def _parse_arguments(
 ) -> DefaultCheriConfig:
     assert isinstance(args, list)
     assert all(isinstance(arg, str) for arg in args), "Invalid argv " + str(args)
-    ConfigLoaderBase._cheri_config._cached_deps = collections.defaultdict(dict)
+    ConfigLoaderBase._cheri_config._dependency_graph = DependencyGraph()
     assert isinstance(ConfigLoaderBase._cheri_config, DefaultCheriConfig)
     target_manager.reset()
     ConfigLoaderBase._cheri_config.loader._config_path = config_file
@@ -1714,3 +1716,167 @@ def test_freebsd_with_default_options_build_dir_no_overlap():
     # Assert the exact build directories
     assert freebsd.build_dir.name == "freebsd-riscv64-build"
     assert freebsd_default_options.build_dir.name == "freebsd-with-default-options-riscv64-build"
+
+
+def test_cheribsd_buildenv_vars_single_query(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(BuildFreeBSD, "_make_var_cache", {})
+    (tmp_path / "src/cheribsd").mkdir(parents=True)
+    config = _parse_arguments(["--source-root", str(tmp_path / "src"), "--build-root", str(tmp_path / "build")])
+    cheribsd = _get_cheribsd_instance("cheribsd-riscv64-purecap", config)
+    objdir = tmp_path / "obj"
+    (objdir / "sys").mkdir(parents=True)
+    fake_bmake = cheribsd.build_dir / "bmake-install/bin/bmake"
+    fake_bmake.parent.mkdir(parents=True)
+    fake_bmake.write_text(
+        f"""#!/bin/sh
+echo "$@" >> "{tmp_path}/bmake.log"
+echo "some unrelated output"
+while [ $# -gt 0 ]; do
+  if [ "$1" = "-V" ]; then
+    case "$2" in
+      .OBJDIR) echo "{objdir}" ;;
+      KRNLOBJDIR) echo "{objdir}/sys" ;;
+      OTHER_VAR) echo "/other" ;;
+      FAIL_VAR) exit 1 ;;
+      *) echo "" ;;
+    esac
+  fi
+  shift
+done
+"""
+    )
+    fake_bmake.chmod(0o755)
+    assert cheribsd.objdir == objdir
+    assert cheribsd.kernel_objdir("GENERIC") == objdir / "sys/GENERIC"
+    # Later queries with the same make options use the cached results
+    assert cheribsd._query_make_var(cheribsd.buildworld_args, "KRNLOBJDIR") == objdir / "sys"
+    assert len((tmp_path / "bmake.log").read_text().splitlines()) == 1
+    assert cheribsd._query_make_var(cheribsd.buildworld_args, "UNSET_VAR") is None
+    assert len((tmp_path / "bmake.log").read_text().splitlines()) == 2
+    # Empty variables at the end of the output must not shift the values of the other variables
+    assert cheribsd._query_make_vars(cheribsd.buildworld_args, ["OTHER_VAR", "UNSET_VAR2"]) == {
+        "OTHER_VAR": Path("/other"),
+        "UNSET_VAR2": None,
+    }
+    # Failed queries are not cached
+    assert cheribsd._query_make_var(cheribsd.buildworld_args, "FAIL_VAR") is None
+    assert cheribsd._query_make_var(cheribsd.buildworld_args, "FAIL_VAR") is None
+    assert len((tmp_path / "bmake.log").read_text().splitlines()) == 5
+
+
+def test_batched_elf_stripping(tmp_path: Path, monkeypatch):
+    config = _parse_arguments(["--make-jobs", "2"])
+    project = _get_cheribsd_instance("cheribsd-riscv64-purecap", config)
+    for i in range(5):
+        (tmp_path / f"sub{i % 2}").mkdir(exist_ok=True)
+        (tmp_path / f"sub{i % 2}/prog{i}").write_bytes(b"\x7fELF" + bytes(60))
+    (tmp_path / "script.sh").write_text("#!/bin/sh\n")
+    (tmp_path / "crt1.o").write_bytes(b"\x7fELF" + bytes(60))  # must not be stripped
+    (tmp_path / "link").symlink_to("sub0/prog0")
+    commands = []
+    monkeypatch.setattr(project, "run_cmd", lambda *args, **kwargs: commands.append(args))
+    files = sorted(project.walk_files(tmp_path))
+    assert tmp_path / "link" not in files
+    stripped = project.maybe_strip_elf_files((f, None) for f in files)
+    assert stripped == {tmp_path / f"sub{i % 2}/prog{i}" for i in range(5)}
+    # One llvm-strip invocation per job, each with multiple files
+    assert len(commands) == 2
+    assert sorted(f for cmd in commands for f in cmd[1:]) == sorted(stripped)
+    assert all(cmd[0] == project.target_info.strip_tool for cmd in commands)
+    # Files with an output path are stripped at the output path
+    commands.clear()
+    assert project.maybe_strip_elf_files([(tmp_path / "sub0/prog0", tmp_path / "out/prog0")]) == {
+        tmp_path / "sub0/prog0"
+    }
+    assert commands == [(project.target_info.strip_tool, tmp_path / "out/prog0")]
+
+
+def test_strip_cache(tmp_path: Path, monkeypatch):
+    config = _parse_arguments(["--make-jobs", "2"])
+    project = _get_cheribsd_instance("cheribsd-riscv64-purecap", config)
+    fake_strip = tmp_path / "fake-strip"
+    fake_strip.write_text(
+        f'#!/bin/sh\nfor f in "$@"; do echo "$f" >> "{tmp_path}/strip.log"; echo "stripped $(cat "$f")" > "$f"; done\n'
+    )
+    fake_strip.chmod(0o755)
+    monkeypatch.setattr(type(project.target_info), "strip_tool", property(lambda _: fake_strip))
+    monkeypatch.setattr(config, "pretend", False)
+    monkeypatch.setattr(config, "verbose", False)
+    cache_dir = tmp_path / "strip-cache"
+    inputs = [tmp_path / f"prog{i}" for i in range(3)]
+    for i, f in enumerate(inputs):
+        f.write_bytes(b"\x7fELF" + str(i).encode())
+    monkeypatch.setattr(SimpleProject, "_pruned_strip_caches", set())
+    prune_calls = []
+    original_prune = SimpleProject._prune_strip_cache
+    monkeypatch.setattr(
+        SimpleProject, "_prune_strip_cache", lambda self, d: (prune_calls.append(d), original_prune(self, d))
+    )
+    expired = cache_dir / "ab" / ("ab" + "0" * 62)
+    expired.parent.mkdir(parents=True)
+    expired.write_text("unused for a long time")
+    os.utime(str(expired), (0, 0))
+
+    def strip_all(output_dir: Path) -> "list[str]":
+        project.maybe_strip_elf_files([(f, output_dir / f.name) for f in inputs], cache_dir=cache_dir)
+        return [(output_dir / f.name).read_text() for f in inputs]
+
+    expected = [f"stripped \x7fELF{i}\n" for i in range(3)]
+    assert strip_all(tmp_path / "out1") == expected
+    assert len((tmp_path / "strip.log").read_text().splitlines()) == 3
+    # No temporary files are left behind in the cache directory and unused outputs have been pruned
+    assert sorted(len(f.name) for f in cache_dir.rglob("*") if f.is_file()) == [64, 64, 64]
+    assert not expired.exists()
+    # The second run uses the cached outputs and marks them as recently used
+    for f in cache_dir.rglob("*"):
+        os.utime(str(f), (0, 0))
+    assert strip_all(tmp_path / "out2") == expected
+    assert len((tmp_path / "strip.log").read_text().splitlines()) == 3
+    assert all(f.stat().st_mtime > 0 for f in cache_dir.rglob("*") if f.is_file())
+    # Only the modified input is stripped again
+    inputs[1].write_bytes(b"\x7fELF-changed")
+    expected[1] = "stripped \x7fELF-changed\n"
+    assert strip_all(tmp_path / "out3") == expected
+    assert (tmp_path / "strip.log").read_text().splitlines()[3:] == [str(tmp_path / "out3/prog1")]
+    # Inputs are never modified
+    assert inputs[0].read_bytes() == b"\x7fELF0"
+    # A different strip tool does not use the cached outputs
+    fake_strip.write_text(fake_strip.read_text().replace("stripped", "stripped-v2"))
+    assert strip_all(tmp_path / "out4") == [s.replace("stripped", "stripped-v2") for s in expected]
+    # The cache directory is only checked for expired outputs once
+    assert prune_calls == [cache_dir]
+
+
+def test_run_make_uses_jobserver(monkeypatch):
+    config = _parse_arguments(["--make-jobs", "4", "--jobserver"])
+    project = _get_cheribsd_instance("cheribsd-riscv64-purecap", config)
+    jobserver = Jobserver(4)
+    try:
+        monkeypatch.setattr("pycheribuild.projects.project.get_jobserver", lambda _config: jobserver)
+        client_args_calls = []
+        original_client_args = Project._jobserver_client_args
+
+        def count_client_args(self, options, parallel):
+            client_args_calls.append(options.kind)
+            return original_client_args(self, options, parallel)
+
+        monkeypatch.setattr(Project, "_jobserver_client_args", count_client_args)
+        commands = []
+        monkeypatch.setattr(project, "run_with_logfile", lambda args, **kwargs: commands.append((args, kwargs)))
+        project.run_make("all")
+        # The jobserver arguments are only computed once per make invocation
+        assert client_args_calls == [MakeCommandKind.BsdMake]
+        assert len(commands) == 1
+        args, kwargs = commands[0]
+        jobserver_flag = f"{jobserver.read_fd},{jobserver.write_fd}"
+        assert args[args.index("-J") + 1] == jobserver_flag
+        # bmake gets the -j flag from the jobserver arguments, so it must not be passed twice
+        assert [arg for arg in args if str(arg).startswith("-j")] == ["-j4"]
+        assert kwargs["pass_fds"] == (jobserver.read_fd, jobserver.write_fd)
+        # Without parallel builds, there is no need to connect to the jobserver
+        commands.clear()
+        project.run_make("all", parallel=False)
+        assert "-J" not in commands[0][0]
+        assert commands[0][1]["pass_fds"] == ()
+    finally:
+        jobserver.close()
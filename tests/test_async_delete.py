@@ -216,3 +216,51 @@ class TestAsyncDelete:
 
         self._assert_dir_empty(self.project.build_dir)  # dir should still be empty
         assert not moved_builddir.exists()  # tempdir should be deleted now
+
+    def test_parallel_delete(self):
+        outside = self.tempRoot / "outside"
+        (outside / "dir").mkdir(parents=True)
+        (outside / "file").write_text("keep")
+        trees = [self.project.build_dir / "a", self.project.build_dir / "b"]
+        for tree in trees:
+            for i in range(5):
+                nested = tree / f"dir{i}" / "nested" / "deeper"
+                nested.mkdir(parents=True)
+                for j in range(20):
+                    (nested / f"file{j}").write_text(str(j))
+                    (nested.parent / f"file{j}").write_text(str(j))
+                (nested / "empty").mkdir()
+            # Symlinks must be removed without deleting the files they point to
+            (tree / "dir0" / "link-to-dir").symlink_to(outside / "dir")
+            (tree / "dir1" / "link-to-file").symlink_to(outside / "file")
+            (tree / "dir2" / "dangling-link").symlink_to(tree / "does-not-exist")
+        single_file = self.project.build_dir / "single-file"
+        single_file.write_text("x")
+        self.project._delete_directories(*trees, single_file, self.project.build_dir / "does-not-exist")
+        for tree in trees:
+            assert not tree.exists()
+        assert not single_file.exists()
+        assert (outside / "dir").is_dir()
+        assert (outside / "file").read_text() == "keep"
+
+    def test_concurrent_async_deletes_share_pool(self):
+        from pycheribuild.filesystemutils import deletion_pool
+
+        dirs = [self.tempRoot / "build" / f"dir{i}" for i in range(20)]
+        for d in dirs:
+            (d / "subdir").mkdir(parents=True)
+            (d / "subdir" / "file").write_text("x")
+        joiner = None
+        for d in dirs:
+            if joiner is None:
+                joiner = self.project.async_clean_directory(d)
+            else:
+                joiner += self.project.async_clean_directory(d)
+        with joiner:
+            pass
+        for d in dirs:
+            self._assert_dir_empty(d)
+            assert not d.with_suffix(".delete-me-pls").exists()
+        pool = deletion_pool()
+        assert len(pool._workers) == pool.num_workers
+        assert pool.num_removed(dirs[0].with_suffix(".delete-me-pls")) is None
@@ -0,0 +1,48 @@
+from pathlib import Path
+
+# Make sure all projects are loaded so that target_manager gets populated
+from pycheribuild.completion import CompletionIndex
+from pycheribuild.config.defaultconfig import DefaultCheribuildConfigLoader
+from pycheribuild.projects import *  # noqa: F401, F403, RUF100
+from pycheribuild.projects.cross import *  # noqa: F401, F403, RUF100
+from pycheribuild.targets import target_manager
+
+
+def _generate_index(tmp_path: Path, loader: DefaultCheribuildConfigLoader) -> CompletionIndex:
+    index = CompletionIndex.generate(
+        loader._parser,
+        sorted(target_manager.non_deprecated_target_names(None)),
+        loader.default_completion_excludes(),
+    )
+    index.save(str(tmp_path / "completion-index-test.txt"))
+    loaded = CompletionIndex.load(str(tmp_path / "completion-index-test.txt"))
+    assert loaded is not None
+    return loaded
+
+
+def test_complete_targets_and_options(tmp_path: Path, default_config_loader: DefaultCheribuildConfigLoader):
+    index = _generate_index(tmp_path, default_config_loader)
+    assert "cheribsd-riscv64-purecap" in index.complete([], "cheribsd-")
+    assert all(x.startswith("llvm") for x in index.complete(["--pretend"], "llvm"))
+    assert "--skip-dependencies" not in index.complete([], "--skip-")
+    assert "--skip-update" in index.complete([], "--skip-")
+    assert "--cheribsd/build-tests" in index.complete(["cheribsd"], "--cheribsd/build-t")
+
+
+def test_complete_option_values(tmp_path: Path, default_config_loader: DefaultCheribuildConfigLoader):
+    index = _generate_index(tmp_path, default_config_loader)
+    # Flags do not consume the next word
+    assert "cheribsd-riscv64-purecap" in index.complete(["--pretend"], "cheribsd-r")
+    # Options with choices complete the valid values (including --option=value)
+    assert index.complete(["--llvm-native/build-type"], "Rel") == ["Release", "RelWithDebInfo"]
+    assert index.complete([], "--llvm-native/build-type=Deb") == ["--llvm-native/build-type=Debug"]
+    # Options without choices (e.g. file names) have to be handled by argcomplete.
+    assert index.complete(["--source-root"], "/") is None
+    assert index.complete([], "--source-root=/") is None
+    assert index.complete(["--", "--pretend"], "") is None
+
+
+def test_stale_index_is_ignored(tmp_path: Path):
+    (tmp_path / "index.txt").write_text("# cheribuild completion index v0\n")
+    assert CompletionIndex.load(str(tmp_path / "index.txt")) is None
+    assert CompletionIndex.load(str(tmp_path / "missing.txt")) is None
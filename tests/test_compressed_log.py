@@ -0,0 +1,91 @@
+import lzma
+import sys
+import tempfile
+from pathlib import Path
+
+from .setup_mock_chericonfig import setup_mock_chericonfig
+from .test_run_with_logfile import MockProject
+from pycheribuild.compressed_log import CompressedLogReader, CompressedLogWriter
+from pycheribuild.config.compilation_targets import CompilationTargets
+
+BUILD_OUTPUT = b"".join(
+    [
+        b"===> lib/libc (all)\n",
+        *(f"cc -c file{i}.c\n".encode() for i in range(5000)),
+        b"file.c:1:2: warning: unused variable 'x'\n",
+        b"===> bin/sh (all)\n",
+        *(f"cc -c sh{i}.c\n".encode() for i in range(5000)),
+        b"sh.c:3:4: error: use of undeclared identifier 'y'\n",
+        b"*** Error code 1\n",
+    ]
+)
+
+
+def _write_log(path: Path, data: bytes, *, chunk_size: int, append: bool = False) -> None:
+    with CompressedLogWriter(path, append=append) as writer:
+        writer.frame_size = 16 * 1024
+        for i in range(0, len(data), chunk_size):
+            writer.write(data[i : i + chunk_size])
+
+
+def test_compressed_log_roundtrip(tmp_path: Path):
+    log = tmp_path / "build.log.xz"
+    # Use an odd chunk size to ensure that lines are split across write() calls.
+    _write_log(log, BUILD_OUTPUT, chunk_size=1000)
+    # The output is a valid .xz file
+    assert lzma.decompress(log.read_bytes()) == BUILD_OUTPUT
+    reader = CompressedLogReader(log)
+    assert len(reader.frames) > 5
+    assert reader.uncompressed_size == len(BUILD_OUTPUT)
+    assert b"".join(reader.iter_chunks()) == BUILD_OUTPUT
+    assert [(e.kind, reader.read_line(e)) for e in reader.entries] == [
+        ("target", b"===> lib/libc (all)"),
+        ("warning", b"file.c:1:2: warning: unused variable 'x'"),
+        ("target", b"===> bin/sh (all)"),
+        ("error", b"sh.c:3:4: error: use of undeclared identifier 'y'"),
+        ("error", b"*** Error code 1"),
+    ]
+    lines = BUILD_OUTPUT.split(b"\n")
+    for entry in reader.entries:
+        assert lines[entry.line - 1] == reader.read_line(entry)
+    failures = [(reader.read_line(t) if t else None, reader.read_line(e)) for t, e in reader.failures()]
+    assert failures == [
+        (b"===> bin/sh (all)", b"sh.c:3:4: error: use of undeclared identifier 'y'"),
+        (b"===> bin/sh (all)", b"*** Error code 1"),
+    ]
+    assert len(list(reader.failures(include_warnings=True))) == 3
+    # Reading lines from the same frame only decompresses it once
+    decompressed: "list[int]" = []
+    original_decompress_frame = reader._decompress_frame
+    reader._decompress_frame = lambda i: decompressed.append(i) or original_decompress_frame(i)
+    reader._cached_frame = None
+    for _, entry in reader.failures():
+        reader.read_line(entry)
+    assert decompressed == [len(reader.frames) - 1]
+
+
+def test_compressed_log_append(tmp_path: Path):
+    log = tmp_path / "build.log.xz"
+    _write_log(log, b"first: warning: foo\n", chunk_size=7)
+    _write_log(log, BUILD_OUTPUT, chunk_size=4096, append=True)
+    assert lzma.decompress(log.read_bytes()) == b"first: warning: foo\n" + BUILD_OUTPUT
+    reader = CompressedLogReader(log)
+    assert [e.line for e in reader.entries if e.kind == "error"] == [10005, 10006]
+    assert reader.read_line(reader.entries[0]) == b"first: warning: foo"
+    assert reader.read_line(reader.entries[-1]) == b"*** Error code 1"
+
+
+def test_run_with_compressed_logfile():
+    with tempfile.TemporaryDirectory() as td:
+        config = setup_mock_chericonfig(Path(td), pretend=False)
+        config.quiet = True
+        config.compress_logs = True
+        MockProject.setup_config_options()
+        project = MockProject(config, crosscompile_target=CompilationTargets.NATIVE)
+        # Split the error message to avoid matching the command line that is written to the logfile.
+        script = "import sys; print('===> foo'); print('foo.c:1: err' + 'or: bar', file=sys.stderr)"
+        project.run_with_logfile([sys.executable, "-c", script], Path(td, "build.log"), cwd=Path(td))
+        assert not Path(td, "build.log").exists()
+        reader = CompressedLogReader(Path(td, "build.log.xz"))
+        assert b"".join(reader.iter_chunks()).endswith(b"===> foo\nfoo.c:1: error: bar\n")
+        assert [reader.read_line(e) for _, e in reader.failures()] == [b"foo.c:1: error: bar"]
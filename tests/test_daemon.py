@@ -0,0 +1,52 @@
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+CHERIBUILD_DIR = Path(__file__).absolute().parent.parent
+
+
+def _run_client(env: "dict[str, str]", *args: str) -> "subprocess.CompletedProcess[str]":
+    return subprocess.run(
+        [sys.executable, str(CHERIBUILD_DIR / "cheribuild-client.py"), "--skip-update", *args],
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Requires UNIX sockets")
+def test_daemon_matches_cheribuild(tmp_path: Path):
+    socket_path = tmp_path / "daemon.sock"
+    env = {**os.environ, "CHERIBUILD_DAEMON_SOCKET": str(socket_path), "XDG_CACHE_HOME": str(tmp_path)}
+    # Without a running daemon the client just runs cheribuild.py
+    direct = _run_client(env, "--get-config-option", "llvm-native/build-type")
+    assert direct.returncode == 0, direct.stderr
+    assert direct.stdout.strip() == "BuildType.RELEASE"
+
+    daemon = subprocess.Popen(
+        [sys.executable, str(CHERIBUILD_DIR / "cheribuild-daemon.py")], env=env, stdout=subprocess.DEVNULL
+    )
+    try:
+        for _ in range(600):
+            if socket_path.exists() or daemon.poll() is not None:
+                break
+            time.sleep(0.1)
+        assert socket_path.exists(), "daemon did not start"
+        result = _run_client(env, "--get-config-option", "llvm-native/build-type")
+        assert (result.returncode, result.stdout) == (direct.returncode, direct.stdout)
+        # Arguments and exit codes are forwarded
+        result = _run_client(env, "--get-config-option", "llvm-native/does-not-exist")
+        assert result.returncode == 3
+        assert "Unknown config key llvm-native/does-not-exist" in result.stderr
+        result = _run_client(env, "--llvm-native/build-type=Debug", "--get-config-option=llvm-native/build-type")
+        assert (result.returncode, result.stdout.strip()) == (0, "BuildType.DEBUG")
+        # A second daemon refuses to start
+        assert subprocess.run([sys.executable, str(CHERIBUILD_DIR / "cheribuild-daemon.py")], env=env).returncode != 0
+    finally:
+        daemon.terminate()
+        daemon.wait(timeout=30)
+    assert not socket_path.exists()
@@ -0,0 +1,125 @@
+import os
+import stat
+import types
+from pathlib import Path
+
+from .setup_mock_chericonfig import setup_mock_chericonfig
+from pycheribuild.filesystemutils import FileCopyEngine, FileSystemUtils
+from pycheribuild.projects.cross.cheribsd import BuildCheriBsdSysrootArchive
+
+
+def test_copy_file(tmp_path: Path):
+    engine = FileCopyEngine()
+    src = tmp_path / "src"
+    src.write_bytes(os.urandom(3 * 1024 * 1024 + 17))
+    src.chmod(0o750)
+    method = engine.copy_file(src, tmp_path / "dst")
+    assert method in ("reflink", "copy_file_range", "copy")
+    assert (tmp_path / "dst").read_bytes() == src.read_bytes()
+    assert stat.S_IMODE((tmp_path / "dst").stat().st_mode) == 0o750
+    assert engine.stats[method] == 1
+    # Writable files are never hardlinked
+    assert engine.copy_file(src, tmp_path / "dst2", allow_hardlink=True) != "hardlink"
+    assert not os.path.samefile(src, tmp_path / "dst2")
+
+
+def test_copy_file_fallback(tmp_path: Path):
+    engine = FileCopyEngine()
+    src = tmp_path / "src"
+    src.write_bytes(b"contents")
+    dev = src.stat().st_dev
+    # Simulate a file system that doesn't support any of the fast mechanisms
+    engine._unsupported.update({("reflink", dev, dev), ("copy_file_range", dev, dev)})
+    assert engine.copy_file(src, tmp_path / "dst") == "copy"
+    assert (tmp_path / "dst").read_bytes() == b"contents"
+
+
+def test_copy_file_hardlink(tmp_path: Path):
+    engine = FileCopyEngine()
+    src = tmp_path / "src"
+    src.write_bytes(b"read-only")
+    src.chmod(0o444)
+    dst = tmp_path / "dst"
+    assert engine.copy_file(src, dst, allow_hardlink=True) == "hardlink"
+    assert os.path.samefile(src, dst)
+    # Overwriting the destination must replace the hardlink instead of modifying the source file
+    other = tmp_path / "other"
+    other.write_bytes(b"new contents")
+    engine.copy_file(other, dst, allow_hardlink=True)
+    assert dst.read_bytes() == b"new contents"
+    assert src.read_bytes() == b"read-only"
+
+
+def test_copy_directory(tmp_path: Path):
+    config = setup_mock_chericonfig(tmp_path, pretend=False)
+    fs = FileSystemUtils(config)
+    src = tmp_path / "src"
+    (src / "subdir").mkdir(parents=True)
+    (src / "subdir" / "file").write_text("file")
+    (src / "link").symlink_to("subdir/file")
+    dst = tmp_path / "dst"
+    (dst / "existing").mkdir(parents=True)
+    fs.copy_directory(src, dst, symlinks=True, dirs_exist_ok=True)
+    assert (dst / "existing").is_dir()
+    assert (dst / "subdir" / "file").read_text() == "file"
+    assert (dst / "link").is_symlink()
+    assert os.readlink(str(dst / "link")) == "subdir/file"
+
+
+def test_copy_sysroot_from_metalog(tmp_path: Path):
+    rootfs = tmp_path / "rootfs"
+    (rootfs / "lib").mkdir(parents=True)
+    (rootfs / "usr/include/sys").mkdir(parents=True)
+    (rootfs / "bin").mkdir(parents=True)
+    (rootfs / "lib/libc.so.7").write_bytes(b"libc")
+    (rootfs / "lib/libc.so.7").chmod(0o444)
+    (rootfs / "usr/include/sys/types.h").write_text("types")
+    (rootfs / "usr/include/with space.h").write_text("space")
+    (rootfs / "usr/include/not-in-metalog.h").write_text("ignored")
+    (rootfs / "bin/sh").write_bytes(b"sh")
+    (rootfs / "lib/libc.so").symlink_to("libc.so.7")
+    metalog = tmp_path / "METALOG.world"
+    metalog.write_text(
+        "#mtree 2.0\n"
+        ". type=dir uname=root gname=wheel mode=0755\n"
+        "./bin type=dir uname=root gname=wheel mode=0755\n"
+        "./bin/sh type=file uname=root gname=wheel mode=0555 size=2\n"
+        "./lib type=dir uname=root gname=wheel mode=0755\n"
+        "./lib/libc.so.7 type=file uname=root gname=wheel mode=0444 size=4\n"
+        "./lib/libc.so type=link uname=root gname=wheel mode=0755 link=libc.so.7\n"
+        "./usr/include/sys/types.h type=file uname=root gname=wheel mode=0444 size=5\n"
+        "./usr/include/with\\040space.h type=file uname=root gname=wheel mode=0444 size=5\n"
+    )
+    sysroot = tmp_path / "sysroot"
+    (sysroot / "usr/include").mkdir(parents=True)
+    (sysroot / "usr/include/stale.h").write_text("removed from the rootfs")
+    config = setup_mock_chericonfig(tmp_path, pretend=False)
+    bsdtar_calls = []
+    project = types.SimpleNamespace(
+        config=config,
+        sysroot_paths=BuildCheriBsdSysrootArchive.sysroot_paths,
+        info=print,
+        warning=print,
+        clean_directory=FileSystemUtils(config).clean_directory,
+        _parse_sysroot_metalog=BuildCheriBsdSysrootArchive._parse_sysroot_metalog,
+        _copy_metalog_files_with_bsdtar=lambda *args: bsdtar_calls.append(args),
+    )
+    BuildCheriBsdSysrootArchive._copy_metalog_files(project, rootfs, metalog, sysroot)
+    assert (sysroot / "lib/libc.so.7").read_bytes() == b"libc"
+    # Read-only files are copied instead of hardlinked
+    assert (sysroot / "lib/libc.so.7").stat().st_ino != (rootfs / "lib/libc.so.7").stat().st_ino
+    assert (sysroot / "usr/include/with space.h").read_text() == "space"
+    assert not (sysroot / "usr/include/stale.h").exists()
+    assert os.readlink(str(sysroot / "lib/libc.so")) == "libc.so.7"
+    assert (sysroot / "usr/include/sys/types.h").read_text() == "types"
+    assert not (sysroot / "usr/include/not-in-metalog.h").exists()
+    assert not (sysroot / "bin").exists()
+    # Copying the rootfs onto itself must not delete any files
+    BuildCheriBsdSysrootArchive._copy_metalog_files(project, rootfs, metalog, rootfs)
+    assert (rootfs / "lib/libc.so.7").read_bytes() == b"libc"
+    # Entries that can't be copied directly fall back to bsdtar
+    assert bsdtar_calls == []
+    with metalog.open("a") as f:
+        f.write("./usr/lib/libfoo.so type=hlink uname=root gname=wheel mode=0444\n")
+    BuildCheriBsdSysrootArchive._copy_metalog_files(project, rootfs, metalog, sysroot)
+    assert bsdtar_calls == [(rootfs, metalog, sysroot)]
@@ -473,3 +473,68 @@ def test_handle_old_urls_branch_exists(shared_remote: Path, local_repo: Path, tm
     # The new remote should be 'origin'
     assert "origin" in remotes
     assert str(shared_remote) in remotes
+
+
+def test_source_fingerprint(tmp_path: Path):
+    repo_dir = create_remote_repo(tmp_path / "repo")
+    project = setup_test_project(tmp_path / "local", repo_dir)
+    repository = project.repository
+    assert isinstance(repository, GitRepository)
+    clean_fingerprint = repository.source_fingerprint(project, repo_dir)
+    assert clean_fingerprint is not None
+    assert repository.source_fingerprint(project, repo_dir) == clean_fingerprint
+    # Modifying a tracked file changes the fingerprint
+    (repo_dir / "file").write_text("modified")
+    modified_fingerprint = repository.source_fingerprint(project, repo_dir)
+    assert modified_fingerprint != clean_fingerprint
+    # As does adding an untracked file
+    (repo_dir / "untracked").write_text("new")
+    untracked_fingerprint = repository.source_fingerprint(project, repo_dir)
+    assert untracked_fingerprint not in (clean_fingerprint, modified_fingerprint)
+    # Reverting the changes restores the original fingerprint
+    (repo_dir / "untracked").unlink()
+    subprocess.run(["git", "checkout", "file"], cwd=repo_dir, check=True)
+    assert repository.source_fingerprint(project, repo_dir) == clean_fingerprint
+    # A new commit also changes the fingerprint
+    subprocess.run(["git", "commit", "--allow-empty", "-m", "empty commit"], cwd=repo_dir, check=True)
+    assert repository.source_fingerprint(project, repo_dir) != clean_fingerprint
+    # Directories that are not a git repository can't be fingerprinted
+    (tmp_path / "not-a-repo").mkdir()
+    assert repository.source_fingerprint(project, tmp_path / "not-a-repo") is None
+
+
+def test_skip_unchanged_targets(tmp_path: Path):
+    repo_dir = create_remote_repo(tmp_path / "repo")
+    project = setup_test_project(tmp_path / "local", repo_dir)
+    project.config.skip_unchanged_targets = True
+    project.config.skip_install = False
+    project.config.clean = False
+    project.source_dir = repo_dir
+    type(project)._cached_full_deps = []
+    built = []
+    project.update = lambda: None
+    project.configure = lambda: None
+    project.compile = lambda: built.append(True)
+    project.install = lambda: None
+    project.setup()
+    project.process()
+    assert len(built) == 1
+    fingerprint_file = project.build_dir / ".cheribuild_build_fingerprint"
+    assert fingerprint_file.read_text() == project.compute_build_fingerprint()
+    # Nothing changed -> the build is skipped
+    project.process()
+    assert len(built) == 1
+    assert project.build_was_up_to_date
+    # Changing the sources triggers a rebuild
+    (repo_dir / "file").write_text("modified")
+    project.process()
+    assert len(built) == 2
+    # Building without --skip-unchanged-targets invalidates the fingerprint
+    project.config.skip_unchanged_targets = False
+    (repo_dir / "file").write_text("modified again")
+    project.process()
+    assert len(built) == 3
+    assert not fingerprint_file.exists()
+    project.config.skip_unchanged_targets = True
+    project.process()
+    assert len(built) == 4
@@ -0,0 +1,75 @@
+import os
+import re
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from pycheribuild.jobserver import Jobserver
+
+
+def _available_tokens(jobserver: Jobserver) -> int:
+    os.set_blocking(jobserver.read_fd, False)
+    try:
+        tokens = b""
+        while True:
+            try:
+                data = os.read(jobserver.read_fd, 64)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            tokens += data
+        # Return the tokens to the pool
+        os.write(jobserver.write_fd, tokens)
+        return len(tokens)
+    finally:
+        os.set_blocking(jobserver.read_fd, True)
+
+
+def test_jobserver_tokens():
+    jobserver = Jobserver(4)
+    try:
+        assert jobserver.fifo_path.exists()
+        # Every client has an implicit token, so only jobs - 1 tokens are in the pipe
+        assert _available_tokens(jobserver) == 3
+        fifo_args = jobserver.gnu_make_fifo_client_args()
+        assert fifo_args.env["MAKEFLAGS"] == f" -j4 --jobserver-auth=fifo:{jobserver.fifo_path}"
+        assert fifo_args.pass_fds == ()
+        bmake_args = jobserver.bmake_client_args()
+        assert bmake_args.flags == ["-j4", "-J", f"{jobserver.read_fd},{jobserver.write_fd}"]
+        assert bmake_args.pass_fds == (jobserver.read_fd, jobserver.write_fd)
+    finally:
+        jobserver.close()
+    assert not jobserver.fifo_path.exists()
+
+
+@pytest.mark.skipif(shutil.which("make") is None, reason="GNU make is not installed")
+def test_gnu_make_uses_jobserver(tmp_path: Path):
+    version_output = subprocess.check_output(["make", "--version"])
+    match = re.search(rb"GNU Make (\d+)\.(\d+)", version_output)
+    if match is None or (int(match.group(1)), int(match.group(2))) < (4, 2):
+        pytest.skip("Need GNU make >= 4.2")
+    (tmp_path / "Makefile").write_text("all: a b\na b:\n\t@echo $@\n")
+    jobserver = Jobserver(2)
+    try:
+        if (int(match.group(1)), int(match.group(2))) >= (4, 4):
+            client_args = jobserver.gnu_make_fifo_client_args()
+        else:
+            client_args = jobserver.gnu_make_pipe_client_args()
+        result = subprocess.run(
+            ["make"],
+            cwd=str(tmp_path),
+            env={**os.environ, **client_args.env},
+            pass_fds=client_args.pass_fds,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            check=True,
+        )
+        # make prints a warning (e.g. "jobserver unavailable") if it cannot connect to the jobserver
+        assert sorted(result.stdout.splitlines()) == [b"a", b"b"], result.stdout
+        # All tokens must have been returned once make exits
+        assert _available_tokens(jobserver) == 1
+    finally:
+        jobserver.close()
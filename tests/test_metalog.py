@@ -294,3 +294,97 @@ def test_path_escape_spaces():
     result = MtreePath.escape(input_path)
     expected = "/hello\\040world.txt"
     assert expected == result
+
+
+def test_load_with_cache(tmp_path: Path):
+    world = tmp_path / "METALOG.world"
+    world.write_text(
+        """#mtree 2.0
+. type=dir uname=root gname=wheel mode=0755
+./bin type=dir uname=root gname=wheel mode=0755
+./bin/cat type=file uname=root gname=wheel mode=0755 contents=./bin/cat
+./etc type=dir uname=root gname=wheel mode=0755
+./etc/rc.conf type=file uname=root gname=wheel mode=0644
+"""
+    )
+    kernel = tmp_path / "METALOG.kernel"
+    kernel.write_text(
+        """#mtree 2.0
+./boot/kernel type=dir uname=root gname=wheel mode=0755
+./boot/kernel/kernel type=file uname=root gname=wheel mode=0555
+./etc/rc.conf type=file uname=root gname=wheel mode=0600
+"""
+    )
+
+    def load(**kwargs) -> str:
+        mtree = MtreeFile(verbose=False)
+        mtree.load(world, append=True, contents_root=tmp_path, **kwargs)
+        mtree.load(kernel, append=True, contents_root=tmp_path, **kwargs)
+        return _get_as_str(mtree)
+
+    expected = load()
+    cache_dir = tmp_path / "cache"
+    assert not MtreeFile.cache_path(world, cache_dir).exists()
+    assert load(cache_dir=cache_dir) == expected
+    assert MtreeFile.cache_path(world, cache_dir).exists()
+    assert MtreeFile.cache_path(kernel, cache_dir).exists()
+    # Nothing is written next to the METALOG files and no temporary files are left behind
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["METALOG.kernel", "METALOG.world", "cache"]
+    assert len(list(cache_dir.iterdir())) == 2
+    # METALOG files with the same name in different directories use different cache files
+    assert MtreeFile.cache_path(tmp_path / "other/METALOG.world", cache_dir) != MtreeFile.cache_path(world, cache_dir)
+    # The second load should use the cache instead of parsing the file again (the cache is only validated using the
+    # size and modification time, so a change that preserves both is not noticed).
+    st = world.stat()
+    world.write_text(world.read_text().replace("./bin/cat", "./bin/dog"))
+    os.utime(world, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert load(cache_dir=cache_dir) == expected
+    # Modifying the METALOG invalidates the cache
+    with world.open("a") as f:
+        f.write("./bin/ls type=file uname=root gname=wheel mode=0755\n")
+    result = load(cache_dir=cache_dir)
+    assert "./bin/ls type=file" in result
+    assert result == load()
+    mtree = MtreeFile(verbose=False)
+    mtree.load(world, append=False, cache_dir=cache_dir)
+    mtree.load(world, append=False, cache_dir=cache_dir)
+    assert len(mtree._mtree) == 6
+
+
+def test_exclude_matching():
+    file = """#mtree 2.0
+. type=dir uname=root gname=wheel mode=0755
+./bin type=dir uname=root gname=wheel mode=0755
+./bin/cat type=file uname=root gname=wheel mode=0755
+./bin/sh type=file uname=root gname=wheel mode=0755
+./usr type=dir uname=root gname=wheel mode=0755
+./usr/lib type=dir uname=root gname=wheel mode=0755
+./usr/lib/libc.a type=file uname=root gname=wheel mode=0644
+./usr/lib/libc.so.7 type=file uname=root gname=wheel mode=0644
+./usr/lib/libc_p.a type=file uname=root gname=wheel mode=0644
+./usr/lib/libm.a type=file uname=root gname=wheel mode=0644
+"""
+    mtree = MtreeFile(file=io.StringIO(file), verbose=False)
+    mtree.exclude_matching(["./usr/lib/*.a", "*/cat"], exceptions=["*/libm.a"])
+    assert (
+        _get_as_str(mtree)
+        == """#mtree 2.0
+. type=dir uname=root gname=wheel mode=0755
+./bin type=dir uname=root gname=wheel mode=0755
+./bin/sh type=file uname=root gname=wheel mode=0755
+./usr type=dir uname=root gname=wheel mode=0755
+./usr/lib type=dir uname=root gname=wheel mode=0755
+./usr/lib/libc.so.7 type=file uname=root gname=wheel mode=0644
+./usr/lib/libm.a type=file uname=root gname=wheel mode=0644
+# END
+"""
+    )
+    # An empty list of globs does not remove anything
+    mtree.exclude_matching([])
+    assert "./bin/sh" in mtree
+    assert "./usr/lib/libm.a" in mtree
+    # Unlike pathlib globs, fnmatch-style * also matches directory separators
+    mtree.exclude_matching("./usr*")
+    assert "./usr" not in mtree
+    assert "./usr/lib/libm.a" not in mtree
+    assert "./bin/sh" in mtree
@@ -0,0 +1,171 @@
+import os
+import threading
+import time
+from typing import Optional
+
+import pytest
+
+from .setup_mock_chericonfig import setup_mock_chericonfig
+
+# Make sure all projects are loaded so that target_manager gets populated
+from pycheribuild.projects import *  # noqa: F401, F403, RUF100
+from pycheribuild.projects.cross import *  # noqa: F401, F403, RUF100
+from pycheribuild.config.chericonfig import CheriConfig
+from pycheribuild.processutils import run_command, set_env
+from pycheribuild.targets import Target, target_manager
+
+
+def _get_targets(names: "list[str]") -> "tuple[CheriConfig, list[Target]]":
+    target_manager.reset()
+    config = setup_mock_chericonfig()
+    config.include_dependencies = True
+    explicit = [target_manager.get_target(t, config=config, caller="test") for t in names]
+    return config, target_manager.get_all_targets(explicit, config)
+
+
+def _run_recording(
+    config: CheriConfig,
+    targets: "list[Target]",
+    max_parallel: int,
+    fail: "tuple[str, ...]" = (),
+    started: "Optional[list[Target]]" = None,
+):
+    lock = threading.Lock()
+    completed: "list[Target]" = []
+    if started is None:
+        started = []
+    started_before_deps: "list[str]" = []
+    running = 0
+    max_running = 0
+
+    def func(target: Target) -> None:
+        nonlocal running, max_running
+        with lock:
+            for dep in target.project_class.cached_full_dependencies():
+                if dep in targets and dep not in completed:
+                    started_before_deps.append(f"{target.name} started before {dep.name}")
+            started.append(target)
+            running += 1
+            max_running = max(max_running, running)
+        time.sleep(0.01)
+        with lock:
+            running -= 1
+            if target.name in fail:
+                raise RuntimeError("failed " + target.name)
+            completed.append(target)
+
+    try:
+        target_manager.run_in_dependency_order(targets, func, config, max_parallel=max_parallel)
+    finally:
+        assert started_before_deps == []
+    return completed, max_running
+
+
+def test_parallel_respects_dependencies():
+    config, targets = _get_targets(["sdk-riscv64-hybrid"])
+    assert len(targets) > 3
+    completed, max_running = _run_recording(config, targets, max_parallel=4)
+    assert sorted(t.name for t in completed) == sorted(t.name for t in targets)
+    # gdb-native, llvm-native and qemu do not depend on each other
+    assert max_running > 1
+    assert max_running <= 4
+
+
+def test_single_job_keeps_sorted_order():
+    config, targets = _get_targets(["sdk-riscv64-hybrid"])
+    completed, max_running = _run_recording(config, targets, max_parallel=1)
+    assert completed == targets
+    assert max_running == 1
+
+
+def test_failure_stops_dependent_targets():
+    config, targets = _get_targets(["sdk-riscv64-hybrid"])
+    started: "list[Target]" = []
+    with pytest.raises(RuntimeError, match="failed llvm-native"):
+        _run_recording(config, targets, max_parallel=2, fail=("llvm-native",), started=started)
+    llvm = next(t for t in targets if t.name == "llvm-native")
+    dependents = [t for t in targets if llvm in t.project_class.cached_full_dependencies()]
+    assert dependents, "Expected some targets to depend on llvm-native"
+    assert llvm in started
+    assert [t.name for t in started if t in dependents] == []
+
+
+def test_parallel_targets_environment(monkeypatch):
+    # set_env() calls from targets that are built concurrently must not affect each other (or os.environ).
+    config, targets = _get_targets(["sdk-riscv64-hybrid"])
+    config.parallel_targets = 4
+    barrier = threading.Barrier(2, timeout=5)
+    seen: "dict[str, str]" = {}
+
+    def fake_execute(self: Target, _config) -> None:
+        if self.name not in ("llvm-native", "qemu"):
+            return
+        with set_env(CHERIBUILD_TEST_VAR=self.name, config=config):
+            barrier.wait()  # Make sure both targets have set the variable before checking it
+            assert "CHERIBUILD_TEST_VAR" not in os.environ
+            seen[self.name] = run_command(
+                "sh", "-c", "echo $CHERIBUILD_TEST_VAR", capture_output=True, run_in_pretend_mode=True, config=config
+            ).stdout.decode().strip()
+            barrier.wait()
+
+    monkeypatch.setattr(Target, "execute", fake_execute)
+    target_manager.execute_in_parallel(targets, config)
+    assert seen == {"llvm-native": "llvm-native", "qemu": "qemu"}
+    assert "CHERIBUILD_TEST_VAR" not in os.environ
+
+
+def test_pipelined_tests(monkeypatch):
+    config, targets = _get_targets(["sdk-riscv64-hybrid"])
+    config.parallel_targets = 2
+    lock = threading.Lock()
+    events: "list[tuple[str, str]]" = []
+
+    def fake_execute(self: Target, _config) -> None:
+        time.sleep(0.01)
+        with lock:
+            events.append(("built", self.name))
+
+    def fake_run_tests(self: Target, _config) -> None:
+        with lock:
+            events.append(("tested", self.name))
+
+    monkeypatch.setattr(Target, "execute", fake_execute)
+    monkeypatch.setattr(Target, "run_tests", fake_run_tests)
+    target_manager.execute_in_parallel(targets, config, pipeline_tests=True)
+    assert sorted(name for kind, name in events if kind == "tested") == sorted(t.name for t in targets)
+    for target in targets:
+        assert events.index(("built", target.name)) < events.index(("tested", target.name))
+    # The first tests should have started before the last target has been built
+    assert events.index(("tested", targets[0].name)) < events.index(("built", targets[-1].name))
+
+
+def test_pipelined_tests_make_jobs(monkeypatch):
+    # The --make-jobs budget is split between the parallel builds, but the tests run one at a time and use all of it.
+    config, targets = _get_targets(["sdk-riscv64-hybrid"])
+    config.make_jobs = 4
+    config.parallel_targets = 2
+    config.use_jobserver = False
+    build_jobs: "set[int]" = set()
+    test_jobs: "set[int]" = set()
+    monkeypatch.setattr(Target, "execute", lambda self, c: build_jobs.add(c.make_jobs))
+    monkeypatch.setattr(Target, "run_tests", lambda self, c: test_jobs.add(c.make_jobs))
+    target_manager.execute_in_parallel(targets, config, pipeline_tests=True)
+    assert build_jobs == {2}
+    assert test_jobs == {4}
+    assert config.make_jobs == 4
+
+
+def test_pipelined_tests_failure(monkeypatch):
+    config, targets = _get_targets(["sdk-riscv64-hybrid"])
+    tested: "list[str]" = []
+
+    def fake_run_tests(self: Target, _config) -> None:
+        tested.append(self.name)
+        raise RuntimeError("tests failed for " + self.name)
+
+    monkeypatch.setattr(Target, "execute", lambda self, _config: time.sleep(0.05))
+    monkeypatch.setattr(Target, "run_tests", fake_run_tests)
+    with pytest.raises(RuntimeError, match="tests failed for " + targets[0].name):
+        target_manager.execute_in_parallel(targets, config, pipeline_tests=True)
+    # Building stops once a test failure has been noticed, so not all targets will have been tested
+    assert len(tested) < len(targets)
@@ -0,0 +1,197 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from .setup_mock_chericonfig import setup_mock_chericonfig
+from pycheribuild import processutils
+from pycheribuild.filesystemutils import FileSystemUtils
+from pycheribuild.probe_cache import PersistentProbeCache, file_hash_cache, probe_cache
+from pycheribuild.processutils import get_compiler_info
+
+FAKE_CLANG = """#!/bin/sh
+echo "$@" >> "{log}"
+case "$*" in
+  -v) echo "clang version 15.0.1" >&2; echo "Target: x86_64-unknown-linux-gnu" >&2 ;;
+  -print-resource-dir) echo "/fake/lib/clang/15" ;;
+  *-Wp,-v*) printf '#include <...> search starts here:\\n /fake/include\\nEnd of search list.\\n' >&2 ;;
+  *-Wfake-supported*) exit 0 ;;
+  *) exit 1 ;;
+esac
+"""
+
+
+@pytest.fixture()
+def fake_clang(tmp_path: Path, monkeypatch):
+    compiler = tmp_path / "clang"
+    compiler.write_text(FAKE_CLANG.format(log=tmp_path / "invocations.log"))
+    compiler.chmod(0o755)
+    monkeypatch.setattr(processutils, "_cached_compiler_infos", {})
+    yield compiler
+    probe_cache.configure(None)
+
+
+def _probe_all(compiler: Path, config) -> tuple:
+    processutils._cached_compiler_infos.clear()
+    info = get_compiler_info(compiler, config=config)
+    return (
+        info.compiler,
+        info.version,
+        info.default_target,
+        info.get_resource_dir(),
+        info.get_include_dirs(["-target", "x86_64-unknown-linux-gnu"]),
+        info.supports_warning_flag("-Wfake-supported"),
+        info.supports_warning_flag("-Wfake-unsupported"),
+    )
+
+
+def test_compiler_info_persistent_cache(fake_clang: Path, tmp_path: Path):
+    config = setup_mock_chericonfig(tmp_path, pretend=False)
+    probe_cache.configure(tmp_path / "probe-cache.json")
+    invocations = tmp_path / "invocations.log"
+    expected = (
+        "clang",
+        (15, 0, 1),
+        "x86_64-unknown-linux-gnu",
+        Path("/fake/lib/clang/15"),
+        [Path("/fake/include")],
+        True,
+        False,
+    )
+    assert _probe_all(fake_clang, config) == expected
+    assert len(invocations.read_text().splitlines()) == 5
+    # A new cheribuild invocation (i.e. without the in-memory cache) should not run the compiler again.
+    probe_cache.configure(tmp_path / "probe-cache.json")
+    assert _probe_all(fake_clang, config) == expected
+    assert len(invocations.read_text().splitlines()) == 5
+    # Rebuilding the compiler invalidates the cached results.
+    st = fake_clang.stat()
+    os.utime(fake_clang, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    assert _probe_all(fake_clang, config) == expected
+    assert len(invocations.read_text().splitlines()) == 10
+
+
+def test_probe_cache_read_only(fake_clang: Path, tmp_path: Path):
+    config = setup_mock_chericonfig(tmp_path, pretend=False)
+    probe_cache.configure(tmp_path / "probe-cache.json", read_only=True)
+    get_compiler_info(fake_clang, config=config)
+    assert not (tmp_path / "probe-cache.json").exists()
+    assert probe_cache.get("compiler-info", fake_clang, "version") == [
+        "clang",
+        [15, 0, 1],
+        "clang version 15.0.1",
+        "x86_64-unknown-linux-gnu",
+    ]
+
+
+# Reports all unknown warning flags like clang, or just fails without a diagnostic if $SILENT is set.
+FAKE_CLANG_WARNINGS = """#!/bin/sh
+echo "$@" >> "{log}"
+status=0
+for arg in "$@"; do
+  case "$arg" in
+    -Wknown*|-Werror=unknown-warning-option|-fsyntax-only|-xc|/dev/null) ;;
+    *) status=1; [ -z "$SILENT" ] && echo "error: unknown warning option '$arg'" >&2 ;;
+  esac
+done
+exit $status
+"""
+
+
+@pytest.mark.parametrize("silent", [False, True])
+def test_batched_flag_probing(tmp_path: Path, monkeypatch, silent: bool):
+    compiler = tmp_path / "clang"
+    compiler.write_text(FAKE_CLANG_WARNINGS.format(log=tmp_path / "invocations.log"))
+    compiler.chmod(0o755)
+    if silent:
+        monkeypatch.setenv("SILENT", "1")
+    config = setup_mock_chericonfig(tmp_path, pretend=False)
+    info = processutils.CompilerInfo(compiler, "clang", (15, 0, 0), "clang version 15.0.0", "", config=config)
+    candidates = [f"-Wknown-{i}" for i in range(16)] + ["-Wbad-1", "-Wbad-2"]
+    assert info.supported_warning_flags(candidates) == {f"-Wknown-{i}" for i in range(16)}
+    invocations = len((tmp_path / "invocations.log").read_text().splitlines())
+    if silent:
+        # Bisection needs more invocations but should still be a lot cheaper than one per flag
+        assert invocations < len(candidates)
+    else:
+        assert invocations == 2  # One with all flags and one without the rejected ones
+    # The results are cached
+    assert info.supports_warning_flag("-Wknown-3")
+    assert not info.supports_warning_flag("-Wbad-2")
+    assert len((tmp_path / "invocations.log").read_text().splitlines()) == invocations
+
+
+def test_version_output_cache(tmp_path: Path):
+    config = setup_mock_chericonfig(tmp_path, pretend=False)
+    probe_cache.configure(tmp_path / "probe-cache.json")
+    tool = tmp_path / "fake-tool"
+    tool.write_text(f'#!/bin/sh\necho "$@" >> "{tmp_path}/invocations.log"\necho "fake-tool version 1.2.3 \\377"\n')
+    tool.chmod(0o755)
+    invocations = tmp_path / "invocations.log"
+
+    def get_version_output(*args) -> bytes:
+        processutils.get_version_output.cache_clear()  # Only use the persistent cache (i.e. simulate a new run)
+        return processutils.get_version_output(tool, *args, config=config)
+
+    assert get_version_output() == b"fake-tool version 1.2.3 \xff\n"
+    assert get_version_output() == b"fake-tool version 1.2.3 \xff\n"
+    assert get_version_output(("-v",)) == b"fake-tool version 1.2.3 \xff\n"
+    assert invocations.read_text().splitlines() == ["--version", "-v"]
+    # Updating the tool invalidates the cached output
+    tool.write_text(tool.read_text().replace("1.2.3", "1.2.4"))
+    assert get_version_output() == b"fake-tool version 1.2.4 \xff\n"
+    # Without --cache-tool-probes the cache is left unconfigured
+    probe_cache.configure(None)
+    get_version_output()
+    assert len(invocations.read_text().splitlines()) == 4
+
+
+
+def test_version_output_cache_thread_path(tmp_path: Path):
+    # Tools found in a $PATH that was only changed for the current thread must be cached under that executable.
+    config = setup_mock_chericonfig(tmp_path, pretend=False)
+    probe_cache.configure(tmp_path / "probe-cache.json")
+    bindir = tmp_path / "thread-bin"
+    bindir.mkdir()
+    tool = bindir / "cheribuild-fake-tool"
+    tool.write_text('#!/bin/sh\necho "fake-tool version 4.5.6"\n')
+    tool.chmod(0o755)
+    processutils.get_version_output.cache_clear()
+    path = str(bindir) + os.pathsep + os.environ.get("PATH", "")
+    with processutils.per_thread_environment(), processutils.set_env(PATH=path, config=config):
+        assert processutils.get_version_output(Path(tool.name), config=config) == b"fake-tool version 4.5.6\n"
+    assert probe_cache.get("version-output", str(tool), "--version") == "fake-tool version 4.5.6\n"
+
+
+def test_file_hash_cache(tmp_path: Path, monkeypatch):
+    import hashlib
+
+    fs = FileSystemUtils(setup_mock_chericonfig(tmp_path, pretend=False))
+    files = [tmp_path / f"download-{i}.tar.xz" for i in range(4)]
+    for i, f in enumerate(files):
+        f.write_bytes(os.urandom(i * 100000))
+    expected = {f: hashlib.sha256(f.read_bytes()).hexdigest() for f in files}
+    assert fs.sha512sum(files[1]) == hashlib.sha512(files[1].read_bytes()).hexdigest()
+    file_hash_cache.configure(tmp_path / "file-hash-cache.json")
+    writes = []
+    original_write_file = PersistentProbeCache._write_file
+    monkeypatch.setattr(
+        PersistentProbeCache, "_write_file", lambda self, data: (writes.append(self), original_write_file(self, data))
+    )
+    try:
+        assert fs.hashsums(files, "sha256") == expected
+        # All new hashes are written to the cache file at once
+        assert writes == [file_hash_cache]
+        assert fs.hashsums(files, "sha256", max_workers=1) == expected
+        assert writes == [file_hash_cache]
+        file_hash_cache.configure(tmp_path / "file-hash-cache.json")  # simulate a new run
+        # Cached hashes are used without reading the files again
+        monkeypatch.setattr(FileSystemUtils, "_compute_hashsum", staticmethod(lambda file, algorithm: "not-cached"))
+        assert fs.sha256sum(files[2]) == expected[files[2]]
+        # Modifying a file invalidates the cached hash
+        files[2].write_bytes(b"new contents")
+        assert fs.sha256sum(files[2]) == "not-cached"
+        assert fs.sha512sum(files[3]) == "not-cached"
+        assert not (tmp_path / "probe-cache.json").exists()
+    finally:
+        file_hash_cache.configure(None)
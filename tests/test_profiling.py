@@ -0,0 +1,47 @@
+import json
+import threading
+from pathlib import Path
+
+from pycheribuild.profiling import Profiler
+
+
+def test_profiler_events(tmp_path: Path):
+    profiler = Profiler()
+    # Nothing is recorded unless profiling has been started
+    with profiler.phase("disabled"):
+        pass
+    assert profiler.events == []
+    profiler.start(use_cprofile=False)
+    with profiler.phase("outer"):
+        with profiler.phase("setup", "target", target="foo"):
+            pass
+
+        def run_in_thread():
+            with profiler.phase("setup", "target", target="baz"):
+                sum(range(10000))
+
+        thread = threading.Thread(target=run_in_thread)
+        thread.start()
+        thread.join()
+    # Inner phases finish first
+    assert [(e.category, e.name) for e in profiler.events] == [
+        ("target", "setup"),
+        ("target", "setup"),
+        ("cheribuild", "outer"),
+    ]
+    outer = profiler.events[-1]
+    assert all(e.start >= outer.start and e.wall <= outer.wall for e in profiler.events)
+    assert profiler.events[0].thread == outer.thread != profiler.events[1].thread
+
+    profiler.write_chrome_trace(tmp_path / "trace.json")
+    trace = json.loads((tmp_path / "trace.json").read_text())
+    assert [e["name"] for e in trace["traceEvents"]] == ["foo: setup", "baz: setup", "outer"]
+    assert all(e["ph"] == "X" and e["dur"] >= 0 and "cpu_ms" in e["args"] for e in trace["traceEvents"])
+    assert trace["traceEvents"][0]["args"]["target"] == "foo"
+
+    summary = profiler.format_summary().splitlines()
+    assert summary[0].split() == ["Phase", "Calls", "Wall", "CPU"]
+    # Sorted by total wall time (outer includes the two setup phases)
+    assert summary[1].split()[:3] == ["cheribuild:", "outer", "1"]
+    assert summary[2].split()[:3] == ["target:", "setup", "2"]
+    assert summary[-1].startswith("Total runtime: ")
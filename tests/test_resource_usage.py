@@ -0,0 +1,71 @@
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from .setup_mock_chericonfig import setup_mock_chericonfig
+from pycheribuild.processutils import check_call_handle_noexec, popen_handle_noexec, run_command
+from pycheribuild.resource_usage import ResourceUsageRecorder, resource_usage
+
+
+@pytest.fixture()
+def recorder(monkeypatch) -> ResourceUsageRecorder:
+    # Don't include the commands run by other tests
+    monkeypatch.setattr(resource_usage, "commands", [])
+    monkeypatch.setattr(resource_usage, "enabled", True)
+    return resource_usage
+
+
+def test_resource_usage_recorded(recorder: ResourceUsageRecorder, tmp_path: Path):
+    config = setup_mock_chericonfig(tmp_path, pretend=False)
+    allocate = "x = bytearray(256 * 1024 * 1024); x[::4096] = b'1' * len(x[::4096])"
+    with recorder.context(target="foo", phase="build"):
+        with recorder.context(phase="compile"):
+            run_command(sys.executable, "-c", allocate, config=config)
+        check_call_handle_noexec([sys.executable, "-c", "sum(range(10**6))"])
+    proc = popen_handle_noexec([sys.executable, "-c", "raise SystemExit(3)"])
+    assert proc.wait() == 3
+    assert [(c.target, c.phase, c.exit_code) for c in recorder.commands] == [
+        ("foo", "compile", 0),
+        ("foo", "build", 0),
+        (None, None, 3),
+    ]
+    assert recorder.commands[0].max_rss >= 256 * 1024 * 1024
+    assert recorder.commands[1].user_time > 0
+    assert all(c.wall_time > 0 for c in recorder.commands)
+
+    recorder.write_summary(tmp_path / "usage.json")
+    summary = json.loads((tmp_path / "usage.json").read_text())
+    assert len(summary["commands"]) == 3
+    assert set(summary["targets"]) == {"foo", "(none)"}
+    compile_summary = summary["targets"]["foo"]["compile"]
+    assert compile_summary["commands"] == 1
+    assert compile_summary["max_rss"] == recorder.commands[0].max_rss
+    assert "bytearray" in compile_summary["max_rss_command"]
+    assert "Commands with the highest peak RSS:" in recorder.format_summary()
+
+
+def test_resource_usage_poll_and_timeout(recorder: ResourceUsageRecorder):
+    # Processes that are reaped by poll() must also be recorded, and a wait() that timed out can be retried.
+    proc = popen_handle_noexec([sys.executable, "-c", "import time; time.sleep(0.2)"])
+    with pytest.raises(subprocess.TimeoutExpired):
+        proc.wait(timeout=0.01)
+    assert proc.wait() == 0
+    proc = popen_handle_noexec([sys.executable, "-c", "raise SystemExit(2)"])
+    while proc.poll() is None:
+        time.sleep(0.01)
+    assert proc.returncode == 2
+    assert [c.exit_code for c in recorder.commands] == [0, 2]
+
+
+def test_resource_usage_disabled(monkeypatch):
+    monkeypatch.setattr(resource_usage, "commands", [])
+    monkeypatch.setattr(resource_usage, "enabled", False)
+    check_call_handle_noexec([sys.executable, "-c", "pass"])
+    proc = popen_handle_noexec([sys.executable, "-c", "raise SystemExit(3)"])
+    assert proc.wait() == 3
+    assert type(proc).__name__ == "_ThreadEnvPopen"
+    assert resource_usage.commands == []
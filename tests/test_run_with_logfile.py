@@ -0,0 +1,94 @@
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from .setup_mock_chericonfig import setup_mock_chericonfig
+from pycheribuild.config.compilation_targets import CompilationTargets
+from pycheribuild.processutils import multiplex_process_output
+from pycheribuild.projects.project import DefaultInstallDir, ExternallyManagedSourceRepository, Project
+from pycheribuild.projects.simple_project import _clear_line_sequence
+
+# Interleaves stdout and stderr output, writes a partial line and a final line without trailing newline.
+CHILD_SCRIPT = r"""
+import sys
+for i in range(1000):
+    sys.stdout.write(f"line {i}\n")
+    if i % 250 == 0:
+        sys.stdout.flush()
+        sys.stderr.write(f"error {i}\n")
+        sys.stderr.flush()
+sys.stdout.write("partial ")
+sys.stdout.flush()
+sys.stdout.write("line\nno newline")
+"""
+
+
+class MockProject(Project):
+    do_not_add_to_targets = True
+    target = "run-with-logfile-test"
+    default_directory_basename = "run-with-logfile-test"
+    _xtarget = CompilationTargets.NATIVE
+    _should_not_be_instantiated = False
+    default_install_dir = DefaultInstallDir.DO_NOT_INSTALL
+    repository = ExternallyManagedSourceRepository()
+
+    @classmethod
+    def cached_full_dependencies(cls):
+        return []
+
+    def _stdout_filter(self, line: bytes) -> None:
+        if line.startswith(b"error") or line.startswith(b"partial"):
+            self._show_line_stdout_filter(line)
+        else:
+            self._line_not_important_stdout_filter(line)
+
+
+def _run_child(**kwargs) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, "-c", CHILD_SCRIPT], stdout=subprocess.PIPE, **kwargs)
+
+
+def test_multiplex_process_output():
+    stdout_blocks = []
+    stderr_blocks = []
+    refreshes = []
+    proc = _run_child(stderr=subprocess.PIPE)
+    multiplex_process_output(
+        proc, on_stdout=stdout_blocks.append, on_stderr=stderr_blocks.append, on_refresh=lambda: refreshes.append(1)
+    )
+    assert proc.wait() == 0
+    assert refreshes
+    expected_lines = [f"line {i}\n".encode() for i in range(1000)]
+    assert b"".join(stdout_blocks) == b"".join(expected_lines) + b"partial line\nno newline"
+    assert b"".join(stderr_blocks) == b"error 0\nerror 250\nerror 500\nerror 750\n"
+    # All blocks other than the final one consist of complete lines.
+    assert all(block.endswith(b"\n") for block in stdout_blocks[:-1])
+
+
+@pytest.mark.parametrize("verbose", [True, False])
+def test_run_with_logfile(capfdbinary, verbose: bool):
+    with tempfile.TemporaryDirectory() as td:
+        config = setup_mock_chericonfig(Path(td), pretend=False)
+        config.verbose = verbose
+        MockProject.setup_config_options()
+        project = MockProject(config, crosscompile_target=CompilationTargets.NATIVE)
+        logfile = Path(td, "build.log")
+        project.run_with_logfile(
+            [sys.executable, "-c", CHILD_SCRIPT], logfile, stdout_filter=project._stdout_filter, cwd=Path(td)
+        )
+        log = logfile.read_bytes()
+    for i in range(1000):
+        assert f"line {i}\n".encode() in log
+    assert b"error 750\n" in log
+    assert log.endswith(b"no newline")
+    stdout, stderr = capfdbinary.readouterr()
+    assert stderr == b"error 0\nerror 250\nerror 500\nerror 750\n"
+    if verbose:
+        # No filtering, all output is shown
+        assert b"line 999\npartial line\nno newline" in stdout
+    else:
+        # Progress lines are only shown at the refresh interval (and before stderr output), important lines always.
+        assert stdout.count(_clear_line_sequence) < 100
+        assert b"partial line\n" in stdout
@@ -865,3 +865,21 @@ def test_toolchain_dependencies(xtarget: CrossCompileTarget, expected: "list[str
         assert len(expected) == 1
         compiler_target = target_manager.get_target_raw(expected[0])
         assert compiler_target.get_real_target(CompilationTargets.NATIVE, config) == compiler_target
+
+
+def test_dependency_graph():
+    target_manager.reset()
+    config = setup_mock_chericonfig()
+    config.include_dependencies = True
+    gdb = target_manager.get_target("gdb-morello-purecap", config=config, caller="test")
+    assert target_manager.get_all_targets([gdb], config)[-1] == gdb
+    # noinspection PyProtectedMember
+    graph = config._dependency_graph
+    key = graph.FULL_DEPENDENCIES
+    gdb_id = graph.node_id(gdb.name)
+    direct = [graph.target(i).name for i in graph.direct_dependency_ids(gdb_id, key)]
+    assert "gmp-morello-purecap" in direct
+    assert "mpfr-morello-purecap" in direct
+    closure = [graph.target(i) for i in graph.closure_ids(gdb_id, key)]
+    assert closure == gdb.project_class.cached_full_dependencies()
+    assert set(direct) <= {t.name for t in closure}
@@ -0,0 +1,38 @@
+from pathlib import Path
+
+from .setup_mock_chericonfig import setup_mock_chericonfig
+
+# Make sure all projects are loaded so that target_manager gets populated
+from pycheribuild.config.defaultconfig import DefaultCheribuildConfigLoader
+from pycheribuild.projects import *  # noqa: F401, F403, RUF100
+from pycheribuild.projects.cross import *  # noqa: F401, F403, RUF100
+from pycheribuild.target_registry import TargetRegistry
+from pycheribuild.targets import target_manager
+
+
+def test_target_registry(tmp_path: Path, default_config_loader: DefaultCheribuildConfigLoader):
+    registry = TargetRegistry.generate(target_manager, default_config_loader)
+    registry.save(tmp_path / "target-registry-test.json")
+    loaded = TargetRegistry.load(tmp_path / "target-registry-test.json")
+    assert loaded is not None
+    assert loaded.target_modules == registry.target_modules
+    assert loaded.option_modules == registry.option_modules
+    assert loaded.target_modules["llvm-native"] == "pycheribuild.projects.cross.llvm"
+    assert loaded.target_modules["cheribsd"] == "pycheribuild.projects.cross.cheribsd"
+
+    config = setup_mock_chericonfig()
+    config.enable_hybrid_targets = False
+    assert loaded.listed_target_names(include_hybrid=False) == list(target_manager.non_alias_target_names(config))
+    config.enable_hybrid_targets = True
+    assert loaded.listed_target_names(include_hybrid=True) == list(target_manager.non_alias_target_names(config))
+
+    assert loaded.modules_for_command_line(["--list-targets", "-p"]) == set()
+    assert loaded.modules_for_command_line(["--get-config-option", "llvm-native/build-type"]) == {
+        "pycheribuild.projects.cross.llvm"
+    }
+    assert loaded.modules_for_command_line(
+        ["--get-config-option=build-root", "--qemu/no-use-smbd", "--cheribsd/build-options=-DFOO"]
+    ) == {"pycheribuild.projects.build_qemu", "pycheribuild.projects.cross.cheribsd"}
+    # Unknown options require loading all modules
+    assert loaded.modules_for_command_line(["--get-config-option", "llvm-native/does-not-exist"]) is None
+    assert loaded.modules_for_command_line(["--not-an-option"]) is None
@@ -0,0 +1,52 @@
+from pathlib import Path
+
+from pycheribuild.timings import BuildTimingDatabase, critical_path, format_timing_report, summarize_timings
+
+
+def test_critical_path():
+    #   a(10) -> b(5) -> d(1)
+    #   a(10) -> c(20) -> d(1)
+    #   e(25)
+    deps = {"b": ["a"], "c": ["a"], "d": ["a", "b", "c"]}
+    durations = {"a": 10, "b": 5, "c": 20, "d": 1, "e": 25}
+    assert critical_path(["a", "b", "c", "d", "e"], deps, durations) == (31, ["a", "c", "d"])
+    # Dependencies that are not part of the list are ignored
+    assert critical_path(["b", "d", "e"], deps, durations) == (25, ["e"])
+    assert critical_path([], deps, durations) == (0, [])
+
+
+def test_timing_database(tmp_path: Path):
+    db = BuildTimingDatabase(tmp_path / BuildTimingDatabase.filename)
+    assert db.load() == []
+    db.record("llvm-native", "", "build", 100.0, {"configure": 10.0, "compile": 80.0})
+    db.record("llvm-native", "", "build", 200.0, {"configure": 10.0, "compile": 180.0})
+    db.record("llvm-native", "", "test", 50.0)
+    db.record("cheribsd-riscv64-purecap", "-riscv64-purecap-asan", "build", 1000.0)
+    db.record("cheribsd-riscv64-purecap", "-riscv64-purecap", "build", 300.0)
+    # Truncated entries (e.g. from a killed process) are ignored
+    with db.path.open("a") as f:
+        f.write('{"target": "qemu", "act')
+    records = db.load()
+    assert len(records) == 5
+    summaries = summarize_timings(records)
+    assert summaries.keys() == {"llvm-native", "cheribsd-riscv64-purecap"}
+    llvm = summaries["llvm-native"]
+    assert llvm.runs == 2
+    assert llvm.build_seconds == 150.0
+    assert llvm.last_build_seconds == 200.0
+    assert llvm.phases == {"update": 0.0, "configure": 10.0, "compile": 130.0, "install": 0.0}
+    assert llvm.test_seconds == 50.0
+    # Only runs with the most recent configuration are considered
+    cheribsd = summaries["cheribsd-riscv64-purecap"]
+    assert cheribsd.runs == 1
+    assert cheribsd.config == "-riscv64-purecap"
+    assert cheribsd.build_seconds == 300.0
+
+    report = format_timing_report(
+        summaries,
+        ["llvm-native", "qemu", "cheribsd-riscv64-purecap"],
+        {"cheribsd-riscv64-purecap": ["llvm-native", "qemu"]},
+    )
+    assert "llvm-native                  2  2.5m  3.3m (+33%)" in report
+    assert "Total build time (all targets built serially): 7.5m" in report
+    assert "Critical path (7.5m):\n  llvm-native 2.5m (33%)\n  cheribsd-riscv64-purecap 5.0m (67%)" in report